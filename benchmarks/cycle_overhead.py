@@ -0,0 +1,106 @@
+"""
+Measure the framework overhead of an agent cycle, before and after trusted updates.
+
+Runs a loop of cheap components against a stub model response, so that the time
+measured is spent building and updating states rather than calling a model:
+
+    python benchmarks/cycle_overhead.py --cycles 2000
+
+The "before" run swaps `BaseSchema.trusted` and `BaseSchema.evolve` for the code
+they replaced: schemas built by their validating constructors, and updated with
+`copy(update=...)`.
+"""
+import argparse
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from sembla.llm.openai.chat_completion import apply_chat_completion_response
+from sembla.schemas.base import BaseSchema
+from sembla.schemas.system import (
+    MemoryState,
+    Message,
+    ProcessingStatus,
+    ProcessorOutput,
+    SystemState,
+    TaskState,
+)
+from sembla.system import AgentSystem
+
+STUB_RESPONSE = {
+    "choices": [{"message": {"role": "assistant", "content": "Hello, world!"}}],
+    "usage": {"prompt_tokens": 100, "completion_tokens": 10, "total_tokens": 110},
+}
+
+
+def generate_response(system_state: SystemState) -> SystemState:
+    return apply_chat_completion_response(system_state, STUB_RESPONSE)
+
+
+def process_response(system_state: SystemState) -> SystemState:
+    agent_response = system_state.agent_response
+    processor_output = ProcessorOutput.trusted(
+        processor_name="stub", processing_status=ProcessingStatus.Success
+    )
+    new_response = agent_response.evolve(
+        processor_outputs=[processor_output],
+        processed_response=agent_response.raw_response,
+    )
+    return system_state.evolve(agent_response=new_response)
+
+
+def manage_memory(system_state: SystemState) -> SystemState:
+    message = Message.trusted(
+        role="assistant", content=system_state.agent_response.processed_response
+    )
+    history = system_state.memory.conversation_history.copy()
+    history.append(message)
+    while history.evictable_count > 100:
+        history.evict()
+    memory = system_state.memory.evolve(
+        conversation_history=history, message_count=len(history)
+    )
+    return system_state.evolve(memory=memory)
+
+
+@contextmanager
+def pre_change_schemas() -> Iterator[None]:
+    """Build and update schemas as sembla did before `trusted` and `evolve`."""
+    trusted, evolve = BaseSchema.__dict__["trusted"], BaseSchema.__dict__["evolve"]
+    BaseSchema.trusted = classmethod(lambda cls, **values: cls(**values))
+    BaseSchema.evolve = lambda self, **changes: self.copy(update=changes)
+    try:
+        yield
+    finally:
+        BaseSchema.trusted = trusted
+        BaseSchema.evolve = evolve
+
+
+def time_cycles(cycles: int) -> float:
+    """Return the mean seconds per cycle of a loop of `cycles` cycles."""
+    system = AgentSystem([generate_response, process_response, manage_memory])
+    memory = MemoryState(conversation_history=[Message(role="system", content="Hi")])
+    system_state = SystemState(task=TaskState(max_cycles=cycles), memory=memory)
+    start = time.perf_counter()
+    system.loop(system_state)
+    return (time.perf_counter() - start) / cycles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cycles", type=int, default=2000)
+    args = parser.parse_args()
+
+    # Warm up caches before timing either run
+    time_cycles(100)
+    with pre_change_schemas():
+        before = time_cycles(args.cycles)
+    after = time_cycles(args.cycles)
+
+    print(f"before:  {before * 1e6:8.1f} us/cycle")
+    print(f"after:   {after * 1e6:8.1f} us/cycle")
+    print(f"speedup: {before / after:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""
+Microbenchmarks of the hot paths of an agent cycle.
+
+Each benchmark is timed over several repeats, and the results are written as JSON
+so that they can be kept as a baseline and compared against later runs:
+
+    python benchmarks/suite.py --save benchmarks/baseline.json
+    python benchmarks/suite.py --compare benchmarks/baseline.json
+
+Timings depend on the machine, so baselines are not committed: record one locally
+before making a change, then compare against it afterwards. Benchmarks are compared
+by their fastest repeat, which is the least disturbed by other work on the machine,
+and a benchmark only counts as a regression if it is slower by more than both the
+tolerance and the spread between the repeats of either run. Comparing only reports
+the changes, unless --fail is given, in which case it exits with a non-zero status
+if any benchmark regressed against a baseline recorded on the same host.
+
+Token counts use a byte level encoding by default, so that the suite runs without
+downloading tiktoken encodings; pass --tiktoken to count with the real encoding of
+each model.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import tiktoken
+
+from sembla.actions.utils import execute_action_call
+from sembla.conversation_history import update_conversation_history, with_token_count
+from sembla.llm.openai.chat_completion import apply_chat_completion_response
+from sembla.llm.tokenizer import get_tokenizer
+from sembla.prompt.utils import create_system_prompt
+from sembla.response.processor import parse_json_response
+from sembla.schemas.system import (
+    Action,
+    ActionCall,
+    MemoryState,
+    Message,
+    ModelState,
+    ResponseSchema,
+    SystemState,
+    TaskState,
+)
+from sembla.system import AgentSystem
+
+MODEL_NAME = "gpt-4-32k"
+HISTORY_SIZES = [10, 100, 1000]
+
+RESPONSE = ResponseSchema(
+    goal="Find the weather in London",
+    objectives=["Search for the forecast", "Summarise it for the user"],
+    observations=["The user is in London", "It is the morning"],
+    action=ActionCall(
+        name="describe_weather", parameters={"city": "London", "days": 3}
+    ),
+)
+RESPONSE_JSON = RESPONSE.json()
+
+STUB_COMPLETION = {
+    "choices": [{"message": {"role": "assistant", "content": RESPONSE_JSON}}],
+    "usage": {"prompt_tokens": 500, "completion_tokens": 80, "total_tokens": 580},
+}
+
+
+def describe_weather(city: str, days: int = 1) -> str:
+    """Describe the weather forecast for `city` over the next `days` days."""
+    return f"Sunny in {city} for {days} days"
+
+
+def search(query: str) -> str:
+    """Search the web for `query`."""
+    return f"Results for {query}"
+
+
+def read_file(path: str) -> str:
+    """Read the contents of the file at `path`."""
+    return path
+
+
+ACTIONS = [Action.from_callable(f) for f in [search, read_file, describe_weather]]
+
+
+class BenchmarkResult(NamedTuple):
+    """The seconds per call of a benchmark, over `repeat` timings of `number` calls."""
+
+    number: int
+    repeat: int
+    min: float
+    median: float
+    mean: float
+    max: float
+
+    @property
+    def spread(self) -> float:
+        """The fraction by which the slowest repeat was slower than the fastest."""
+        return self.max / self.min - 1 if self.min else 0.0
+
+
+def time_benchmark(
+    benchmark: Callable[[], object], repeat: int, min_time: float
+) -> BenchmarkResult:
+    """Time `benchmark`, calling it enough times per repeat to take `min_time`."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            benchmark()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_time / elapsed) + 1)
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            benchmark()
+        timings.append((time.perf_counter() - start) / number)
+    return BenchmarkResult(
+        number=number,
+        repeat=repeat,
+        min=min(timings),
+        median=statistics.median(timings),
+        mean=statistics.mean(timings),
+        max=max(timings),
+    )
+
+
+def make_message(index: int) -> Message:
+    role = "user" if index % 2 == 0 else "assistant"
+    return Message(role=role, content=f"This is message number {index}.")
+
+
+def bench_count_tokens_uncached() -> Callable[[], object]:
+    tokenizer = get_tokenizer()
+    content = " ".join(f"word{i}" for i in range(200))
+
+    def run():
+        tokenizer.clear_cache()
+        return tokenizer.count_tokens(content, MODEL_NAME)
+
+    return run
+
+
+def bench_count_tokens_cached() -> Callable[[], object]:
+    tokenizer = get_tokenizer()
+    content = " ".join(f"word{i}" for i in range(200))
+    tokenizer.count_tokens(content, MODEL_NAME)
+    return lambda: tokenizer.count_tokens(content, MODEL_NAME)
+
+
+def bench_update_conversation_history(history_size: int) -> Callable[[], object]:
+    """Move one message into a history that is kept at `history_size` messages."""
+    # Messages in the history carry their token counts, as if they had been added
+    # by update_conversation_history
+    history = [Message(role="system", content="You are a helpful assistant.")]
+    history += [make_message(i) for i in range(history_size)]
+    history = [with_token_count(message, MODEL_NAME) for message in history]
+    memory = MemoryState(
+        max_history_message_count=history_size + 1,
+        max_history_token_count=1_000_000,
+        conversation_history=history,
+    )
+    model = ModelState(name=MODEL_NAME)
+    state = update_conversation_history(SystemState(memory=memory, model=model))
+    new_message = make_message(history_size)
+
+    def run():
+        nonlocal state
+        memory = state.memory.evolve(conversation_buffer=[new_message])
+        state = update_conversation_history(state.evolve(memory=memory))
+
+    return run
+
+
+def bench_execute_action_call() -> Callable[[], object]:
+    action_call = ActionCall(name="describe_weather", parameters={"city": "Paris"})
+    return lambda: execute_action_call(ACTIONS, action_call)
+
+
+def bench_parse_json_response() -> Callable[[], object]:
+    return lambda: parse_json_response(RESPONSE_JSON, ResponseSchema)
+
+
+def bench_create_system_prompt() -> Callable[[], object]:
+    instructions = "You are an agent that answers questions about the weather."
+    return lambda: create_system_prompt(instructions, ACTIONS, RESPONSE)
+
+
+def bench_agent_loop() -> Callable[[], object]:
+    """Run ten cycles of an agent system against a stub model."""
+
+    def generate_response(system_state: SystemState) -> SystemState:
+        return apply_chat_completion_response(system_state, STUB_COMPLETION)
+
+    def process_response(system_state: SystemState) -> SystemState:
+        agent_response = system_state.agent_response
+        parsed_response = parse_json_response(
+            agent_response.raw_response, ResponseSchema
+        )
+        action_output = execute_action_call(ACTIONS, parsed_response.action)
+        new_messages = [
+            Message.trusted(role="assistant", content=agent_response.raw_response),
+            Message.trusted(role="user", content=action_output.output),
+        ]
+        memory = system_state.memory.evolve(conversation_buffer=new_messages)
+        new_response = agent_response.evolve(parsed_response=parsed_response)
+        return system_state.evolve(agent_response=new_response, memory=memory)
+
+    system = AgentSystem(
+        [generate_response, process_response, update_conversation_history]
+    )
+    memory = MemoryState(
+        conversation_history=[Message(role="system", content="You are an agent.")],
+        max_history_token_count=1_000_000,
+    )
+    state = SystemState(
+        task=TaskState(max_cycles=10), model=ModelState(name=MODEL_NAME), memory=memory
+    )
+    return lambda: system.loop(state)
+
+
+def get_benchmarks() -> Dict[str, Callable[[], Callable[[], object]]]:
+    benchmarks = {
+        "count_tokens/uncached": bench_count_tokens_uncached,
+        "count_tokens/cached": bench_count_tokens_cached,
+    }
+    for history_size in HISTORY_SIZES:
+        benchmarks[
+            f"update_conversation_history/{history_size}"
+        ] = lambda history_size=history_size: bench_update_conversation_history(
+            history_size
+        )
+    benchmarks.update(
+        {
+            "execute_action_call": bench_execute_action_call,
+            "parse_json_response": bench_parse_json_response,
+            "create_system_prompt": bench_create_system_prompt,
+            "agent_loop/10_cycles": bench_agent_loop,
+        }
+    )
+    return benchmarks
+
+
+def register_byte_encoding():
+    """Count tokens with a byte level encoding, so that nothing is downloaded."""
+    encoding = tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+    get_tokenizer().register_encoding(MODEL_NAME, encoding)
+
+
+def run_suite(
+    repeat: int, min_time: float, name_filter: Optional[str]
+) -> Dict[str, BenchmarkResult]:
+    results = {}
+    for name, make_benchmark in get_benchmarks().items():
+        if name_filter and name_filter not in name:
+            continue
+        results[name] = time_benchmark(make_benchmark(), repeat, min_time)
+        print(f"{name:40} {results[name].median * 1e6:12.2f} us", file=sys.stderr)
+    return results
+
+
+def get_environment(encoding: str) -> Dict[str, str]:
+    return {
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "encoding": encoding,
+    }
+
+
+def is_same_environment(baseline: Dict, environment: Dict[str, str]) -> bool:
+    return all(baseline.get(key) == value for key, value in environment.items())
+
+
+def compare_results(
+    results: Dict[str, BenchmarkResult], baseline: Dict, tolerance: float
+) -> List[str]:
+    """Print the change from `baseline` and return the benchmarks that regressed."""
+    regressions = []
+    baseline_results = baseline["benchmarks"]
+    for name, result in results.items():
+        if name not in baseline_results:
+            continue
+        baseline_result = BenchmarkResult(**baseline_results[name])
+        ratio = result.min / baseline_result.min
+        threshold = max(tolerance, result.spread, baseline_result.spread)
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:40} {ratio:8.2f}x baseline (noise {threshold:.0%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument("-k", dest="name_filter", help="only run matching names")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare the results to this JSON file")
+    parser.add_argument(
+        "--fail",
+        action="store_true",
+        help="exit with a non-zero status if a benchmark regressed",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="the fraction slower than baseline that counts as a regression",
+    )
+    parser.add_argument("--tiktoken", action="store_true")
+    args = parser.parse_args()
+
+    if not args.tiktoken:
+        register_byte_encoding()
+    results = run_suite(args.repeat, args.min_time, args.name_filter)
+    environment = get_environment("tiktoken" if args.tiktoken else "bytes")
+    report = {
+        **environment,
+        "benchmarks": {name: result._asdict() for name, result in results.items()},
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.tolerance)
+        if not is_same_environment(baseline, environment):
+            print("The baseline was recorded in another environment, so no benchmark")
+            print("fails against it. Record a baseline here with --save.")
+        elif regressions and args.fail:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
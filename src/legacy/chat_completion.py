@@ -1,4 +1,5 @@
 import logging
+from typing import Any, Callable, Optional
 
 import openai
 
@@ -6,9 +7,16 @@ from sembla.conversation_history import ConversationHistory
 
 
 class ChatCompletion:
-    def __init__(self, model: str, conversation_history: ConversationHistory):
+    def __init__(
+        self,
+        model: str,
+        conversation_history: ConversationHistory,
+        create_completion: Optional[Callable[..., Any]] = None,
+    ):
         self.model = model
         self.conversation_history = conversation_history
+        # Defaults to the live API; pass e.g. a cassette's `create` to replay
+        self.create_completion = create_completion or openai.ChatCompletion.create
 
     def create(
         self,
@@ -28,9 +36,9 @@ class ChatCompletion:
             self.conversation_history._get_token_count(),
         )
         logging.info("Max completion tokens: %s", max_completion_tokens)
-        response = openai.ChatCompletion.create(
+        response = self.create_completion(
             model=self.model,
-            messages=self.conversation_history.conversation_history,
+            messages=self.conversation_history.conversation_history.messages,
             temperature=temperature,
             n=n,
             max_tokens=max_completion_tokens,
@@ -4,6 +4,8 @@ from typing import Dict, List, Optional
 
 import tiktoken
 
+from sembla.memory.history import MessageHistory
+
 Message = Dict[str, str]
 
 
@@ -28,7 +30,7 @@ class ConversationHistory:
         self.max_history_token_count = max_history_token_count or get_max_token_count(
             model
         )
-        self.conversation_history = []
+        self.conversation_history: MessageHistory[Message] = MessageHistory()
         self.conversation_buffer = []
 
     def add_message(self, message: Message):
@@ -42,10 +44,7 @@ class ConversationHistory:
             self.remove_earliest_non_system_message()
 
     def remove_earliest_non_system_message(self):
-        for i, msg in enumerate(self.conversation_history):
-            if msg["role"] != "system":
-                del self.conversation_history[i]
-                break
+        self.conversation_history.evict()
 
     def extend_history(self, history: List[Message]):
         for msg in history:
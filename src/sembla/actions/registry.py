@@ -0,0 +1,91 @@
+import inspect
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sembla.schemas.system import Action, ActionCallable
+
+ActionSetKey = Tuple[Tuple[str, Optional[str]], ...]
+
+
+class ActionRegistry:
+    """
+    A set of actions with their callables, signatures and docs resolved once.
+
+    Attributes:
+        callables: The callable of each action, by action name.
+        docs: The documentation of the actions, one line per action.
+    """
+
+    def __init__(self, actions: List[Action]):
+        self.callables: Dict[str, ActionCallable] = {}
+        action_docs = []
+        for action in actions:
+            action_callable = action.callable
+            if action_callable is None:
+                continue
+            self.callables[action.name] = action_callable
+            method_signature = inspect.signature(action_callable)
+            method_doc = inspect.getdoc(action_callable)
+            action_docs.append(f"{action.name}{method_signature}: {method_doc}")
+        self.docs = "\n".join(action_docs)
+
+    def get(self, name: str) -> Optional[ActionCallable]:
+        return self.callables.get(name)
+
+
+DEFAULT_MAX_REGISTRIES = 128
+
+IdentityEntry = Tuple[List[Action], ActionRegistry]
+
+
+class RegistryCache:
+    """
+    A bounded LRU of action registries.
+
+    States evolved from one another share their action list, so registries are
+    found by the identity of the list first, in O(1). Other lists fall back to a
+    key built from their contents, so equal action sets still share a registry.
+    Action lists are treated as immutable once they have been looked up.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_REGISTRIES):
+        self.max_size = max_size
+        # Each entry keeps its list alive, so that its id cannot be reused
+        self._by_identity: "OrderedDict[int, IdentityEntry]" = OrderedDict()
+        self._by_key: "OrderedDict[ActionSetKey, ActionRegistry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, actions: List[Action]) -> ActionRegistry:
+        with self._lock:
+            entry = self._by_identity.get(id(actions))
+            if entry is not None and entry[0] is actions:
+                self._by_identity.move_to_end(id(actions))
+                return entry[1]
+        key = tuple((action.name, action.callable_name) for action in actions)
+        with self._lock:
+            registry = self._by_key.get(key)
+        if registry is None:
+            registry = ActionRegistry(actions)
+        with self._lock:
+            registry = self._by_key.setdefault(key, registry)
+            self._by_key.move_to_end(key)
+            self._by_identity[id(actions)] = (actions, registry)
+            self._by_identity.move_to_end(id(actions))
+            for entries in (self._by_key, self._by_identity):
+                while len(entries) > self.max_size:
+                    entries.popitem(last=False)
+        return registry
+
+    def clear(self):
+        with self._lock:
+            self._by_identity.clear()
+            self._by_key.clear()
+
+
+_registries = RegistryCache()
+
+
+def get_action_registry(actions: List[Action]) -> ActionRegistry:
+    """Return the registry for `actions`, shared by every state with the same set."""
+    return _registries.get(actions)
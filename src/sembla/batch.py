@@ -0,0 +1,146 @@
+"""
+Run an agent system over many independent system states at once.
+
+Results are yielded as soon as each run completes, in completion order, and a
+failing run is reported in its result rather than stopping the batch:
+
+    agent_system = init_async_autonomous_agent_system(components)
+    async for result in arun_batch(system_states, agent_system, concurrency=32):
+        ...
+"""
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ThreadPoolExecutor
+from concurrent.futures import wait as wait_for_futures
+from typing import AsyncIterator, Dict, Iterable, Iterator, NamedTuple, Optional, Union
+
+from .schemas.system import SystemState
+from .system import AsyncStateOperator, StateOperator, as_async_operator
+
+
+class BatchResult(NamedTuple):
+    """
+    The outcome of one run in a batch.
+
+    Attributes:
+        index: The position of the input state in the batch.
+        system_state: The final state of the run, if it succeeded.
+        error: The exception raised by the run, if it failed.
+    """
+
+    index: int
+    system_state: Optional[SystemState] = None
+    error: Optional[BaseException] = None
+
+
+def check_concurrency(concurrency: int):
+    if concurrency <= 0:
+        raise ValueError(f"Concurrency must be positive, not {concurrency}")
+
+
+def arun_batch(
+    system_states: Iterable[SystemState],
+    operator: Union[StateOperator, AsyncStateOperator],
+    concurrency: int = 8,
+) -> AsyncIterator[BatchResult]:
+    """Run `operator` over `system_states` as tasks on the running event loop.
+
+    At most `concurrency` runs are in flight at once. States are drawn from
+    `system_states` lazily, so it may be a generator of any length.
+
+    Raises:
+        ValueError: If `concurrency` is not positive.
+    """
+    # Checked here rather than in the generator, so that it raises on the call
+    check_concurrency(concurrency)
+    return _arun_batch(system_states, operator, concurrency)
+
+
+async def _arun_batch(
+    system_states: Iterable[SystemState],
+    operator: Union[StateOperator, AsyncStateOperator],
+    concurrency: int,
+) -> AsyncIterator[BatchResult]:
+    async_operator = as_async_operator(operator)
+    states = enumerate(system_states)
+    pending: Dict[asyncio.Task, int] = {}
+
+    def submit_next() -> bool:
+        for index, system_state in states:
+            task = asyncio.ensure_future(async_operator(system_state))
+            pending[task] = index
+            return True
+        return False
+
+    try:
+        while len(pending) < concurrency and submit_next():
+            pass
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index = pending.pop(task)
+                error = task.exception()
+                if error is None:
+                    yield BatchResult(index, system_state=task.result())
+                else:
+                    yield BatchResult(index, error=error)
+                submit_next()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def run_batch(
+    system_states: Iterable[SystemState],
+    operator: StateOperator,
+    concurrency: int = 8,
+    executor: Optional[Executor] = None,
+) -> Iterator[BatchResult]:
+    """Run `operator` over `system_states` in `executor`.
+
+    Uses a thread pool of `concurrency` workers unless an executor is given. Pass a
+    `ProcessPoolExecutor` for CPU bound operators; the operator and states must
+    then be picklable. At most `concurrency` runs are submitted at once.
+
+    Raises:
+        ValueError: If `concurrency` is not positive.
+    """
+    check_concurrency(concurrency)
+    return _run_batch(system_states, operator, concurrency, executor)
+
+
+def _run_batch(
+    system_states: Iterable[SystemState],
+    operator: StateOperator,
+    concurrency: int,
+    executor: Optional[Executor],
+) -> Iterator[BatchResult]:
+    own_executor = executor is None
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+    states = enumerate(system_states)
+    pending: Dict[Future, int] = {}
+
+    def submit_next() -> bool:
+        for index, system_state in states:
+            pending[executor.submit(operator, system_state)] = index
+            return True
+        return False
+
+    try:
+        while len(pending) < concurrency and submit_next():
+            pass
+        while pending:
+            done, _ = wait_for_futures(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                error = future.exception()
+                if error is None:
+                    yield BatchResult(index, system_state=future.result())
+                else:
+                    yield BatchResult(index, error=error)
+                submit_next()
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=False)
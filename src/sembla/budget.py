@@ -0,0 +1,93 @@
+"""
+Account for the time, tokens and money spent on a task, and check its budgets.
+"""
+from typing import Tuple
+
+from sembla.llm.models import get_completion_cost
+from sembla.schemas.system import SystemState, TaskState, TokenUsage
+
+
+def get_new_token_usage(system_state: SystemState) -> Tuple[int, int]:
+    """Return the prompt and completion tokens of a response not yet accounted for."""
+    agent_response = system_state.agent_response
+    if agent_response is None or agent_response.usage is None:
+        return 0, 0
+    usage = agent_response.usage
+    if agent_response.accounted or usage.replayed:
+        return 0, 0
+    return usage.prompt_tokens, usage.completion_tokens
+
+
+def check_prices(system_state: SystemState):
+    """Check that every model the state may use has a price, if cost is budgeted.
+
+    Raises:
+        ValueError: If the task has a cost budget and a model has no price, so that
+            the task fails before any completion is paid for rather than after.
+    """
+    if system_state.task.max_cost is None:
+        return
+    model = system_state.model
+    for model_name in [model.name, *model.cascade]:
+        try:
+            get_completion_cost(model_name, 0, 0)
+        except ValueError:
+            raise ValueError(
+                f"Cannot budget the cost of a model with no price: {model_name}"
+            ) from None
+
+
+def add_completion_usage(
+    task: TaskState, model_name: str, usage: TokenUsage
+) -> TaskState:
+    """Add the tokens and cost of a completion by `model_name` to `task`.
+
+    Replayed usage was paid for by another call, so it is not added.
+    """
+    tokens = usage.prompt_tokens + usage.completion_tokens
+    if usage.replayed or not tokens:
+        return task
+    cost = usage.cost
+    if cost is None:
+        try:
+            cost = get_completion_cost(
+                model_name, usage.prompt_tokens, usage.completion_tokens
+            )
+        except ValueError:
+            if task.max_cost is not None:
+                raise
+            # Spend on unknown models is not counted unless it is budgeted
+            cost = 0.0
+    return task.evolve(
+        total_tokens=task.total_tokens + tokens, total_cost=task.total_cost + cost
+    )
+
+
+def account_usage(
+    system_state: SystemState, new_state: SystemState, elapsed_time: float
+) -> SystemState:
+    """Add any completion made going from `system_state` to `new_state`.
+
+    `elapsed_time` is the seconds since the task started.
+    """
+    task = new_state.task
+    prompt_tokens, completion_tokens = get_new_token_usage(new_state)
+    if prompt_tokens or completion_tokens:
+        agent_response = new_state.agent_response
+        task = add_completion_usage(task, new_state.model.name, agent_response.usage)
+        new_state = new_state.evolve(
+            agent_response=agent_response.evolve(accounted=True)
+        )
+    return new_state.evolve(task=task.evolve(elapsed_time=elapsed_time))
+
+
+def budget_exceeded(task: TaskState) -> bool:
+    """Check if the task has spent its time, token or cost budget."""
+    return (
+        (task.max_wall_time is not None and task.elapsed_time >= task.max_wall_time)
+        or (
+            task.max_total_tokens is not None
+            and task.total_tokens >= task.max_total_tokens
+        )
+        or (task.max_cost is not None and task.total_cost >= task.max_cost)
+    )
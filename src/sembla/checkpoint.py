@@ -0,0 +1,217 @@
+"""
+Checkpoint a system state after every cycle, so that a failed run can be resumed.
+
+Checkpoints are written to a JSON lines file. The first record is a snapshot of
+the whole state, and every later record holds only what changed since the record
+before it: the state and memory fields that were replaced, and the messages that
+entered the conversation history. Fields are compared by identity, which is cheap
+because `evolve` shares every field it does not change, and new messages are found
+by walking the history on from the end of the one saved before, so a checkpoint costs
+the same however long the conversation grows. A history that was replaced rather
+than added to is saved whole.
+
+    checkpointer = Checkpointer("run.jsonl")
+    system = AgentSystem(components, checkpointer=checkpointer)
+    system.loop(system_state)
+
+    # After a crash, carry on from the last cycle that was saved
+    system.loop(checkpointer.resume())
+"""
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from pydantic.json import pydantic_encoder
+
+from sembla.memory.history import MessageHistory
+from sembla.schemas.system import MemoryState, Message, SystemState
+
+STATE_FIELDS = [name for name in SystemState.__fields__ if name != "memory"]
+MEMORY_FIELDS = [
+    name for name in MemoryState.__fields__ if name != "conversation_history"
+]
+
+
+class Checkpointer:
+    """
+    Saves the changes to a system state after each cycle to a JSON lines file.
+
+    Attributes:
+        path: The path of the checkpoint file.
+        cycles: The cycle of every checkpoint in the file, in order.
+    """
+
+    def __init__(self, path: Union[str, Path], fsync: bool = False):
+        self.path = Path(path)
+        self.fsync = fsync
+        self.cycles: List[int] = []
+        self._offsets: List[int] = []
+        self._previous: Optional[SystemState] = None
+        self._file = open(self.path, "a+b")
+        self._recover()
+
+    def save(self, system_state: SystemState):
+        """Save the changes to `system_state` since the last checkpoint."""
+        record = diff_system_state(self._previous, system_state)
+        data = json.dumps(record, default=pydantic_encoder, separators=(",", ":"))
+        self._offsets.append(self._file.tell())
+        self._file.write(data.encode("utf-8") + b"\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.cycles.append(system_state.task.current_cycle)
+        self._previous = system_state
+
+    def load(self, cycle: Optional[int] = None) -> SystemState:
+        """Rebuild the state saved at `cycle`, or at the last checkpoint."""
+        index = self._get_index(cycle)
+        restored = RestoredState()
+        for record in self._iter_records(index + 1):
+            restored.apply(record)
+        return restored.to_system_state()
+
+    def resume(self, cycle: Optional[int] = None) -> SystemState:
+        """Load the state saved at `cycle` and discard any later checkpoints."""
+        system_state = self.load(cycle)
+        index = self._get_index(cycle)
+        if index + 1 < len(self._offsets):
+            self._file.truncate(self._offsets[index + 1])
+            del self._offsets[index + 1 :]
+            del self.cycles[index + 1 :]
+        self._file.seek(0, os.SEEK_END)
+        self._previous = system_state
+        return system_state
+
+    def close(self):
+        self._file.close()
+
+    def _get_index(self, cycle: Optional[int]) -> int:
+        if not self.cycles:
+            raise ValueError(f"No checkpoints in {self.path}")
+        if cycle is None:
+            return len(self.cycles) - 1
+        for index in range(len(self.cycles) - 1, -1, -1):
+            if self.cycles[index] == cycle:
+                return index
+        raise ValueError(f"No checkpoint for cycle {cycle} in {self.path}")
+
+    def _iter_records(self, count: int) -> Iterator[Dict[str, Any]]:
+        self._file.seek(0)
+        for _ in range(count):
+            yield json.loads(self._file.readline())
+        self._file.seek(0, os.SEEK_END)
+
+    def _recover(self):
+        """Index the checkpoints in the file and discard a torn last record."""
+        self._file.seek(0)
+        offset = 0
+        for line in self._file:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            self._offsets.append(offset)
+            self.cycles.append(record["cycle"])
+            offset += len(line)
+        self._file.truncate(offset)
+        self._file.seek(offset)
+
+    def __enter__(self) -> "Checkpointer":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def diff_system_state(
+    previous: Optional[SystemState], system_state: SystemState
+) -> Dict[str, Any]:
+    """Return the checkpoint record of the changes from `previous` to `system_state`.
+
+    Without a previous state, or if the history was replaced rather than added to,
+    the record is a snapshot of the whole state.
+    """
+    history = system_state.memory.conversation_history
+    snapshot = previous is None or not history.extends(
+        previous.memory.conversation_history
+    )
+    if snapshot:
+        state_changes = {name: getattr(system_state, name) for name in STATE_FIELDS}
+        memory_changes = {
+            name: getattr(system_state.memory, name) for name in MEMORY_FIELDS
+        }
+        history_entries = history.entries_since(0)
+    else:
+        state_changes = changed_fields(previous, system_state, STATE_FIELDS)
+        memory_changes = changed_fields(
+            previous.memory, system_state.memory, MEMORY_FIELDS
+        )
+        history_entries = history.entries_after(previous.memory.conversation_history)
+    return {
+        "cycle": system_state.task.current_cycle,
+        "snapshot": snapshot,
+        "state": state_changes,
+        "memory": memory_changes,
+        "history": {
+            "entries": history_entries,
+            "first_position": history.first_position,
+            "next_position": history.next_position,
+        },
+    }
+
+
+def changed_fields(previous: Any, current: Any, names: List[str]) -> Dict[str, Any]:
+    changes = {}
+    for name in names:
+        value = getattr(current, name)
+        if value is not getattr(previous, name):
+            changes[name] = value
+    return changes
+
+
+class RestoredState:
+    """A system state being rebuilt from checkpoint records."""
+
+    def __init__(self):
+        self.state_fields: Dict[str, Any] = {}
+        self.memory_fields: Dict[str, Any] = {}
+        self.history: MessageHistory[Message] = MessageHistory()
+
+    def apply(self, record: Dict[str, Any]):
+        if record["snapshot"]:
+            self.state_fields = {}
+            self.memory_fields = {}
+            self.history = MessageHistory()
+        self.state_fields.update(record["state"])
+        self.memory_fields.update(record["memory"])
+        history_changes = record["history"]
+        apply_history_entries(
+            self.history,
+            history_changes["entries"],
+            history_changes["first_position"],
+            history_changes["next_position"],
+        )
+
+    def to_system_state(self) -> SystemState:
+        memory = MemoryState(
+            **self.memory_fields, conversation_history=self.history.copy()
+        )
+        return SystemState(**self.state_fields, memory=memory)
+
+
+def apply_history_entries(
+    history: MessageHistory,
+    entries: List[Tuple[int, Dict[str, Any]]],
+    first_position: int,
+    next_position: int,
+):
+    """Add the saved `entries` to `history` and evict up to `first_position`."""
+    for position, message in entries:
+        history.advance_to(position)
+        history.append(Message.parse_obj(message))
+    history.advance_to(next_position)
+    while history.first_position < first_position:
+        history.evict()
@@ -1,111 +1,282 @@
-import logging
-from typing import List
+from typing import TYPE_CHECKING, Iterable, List, NamedTuple, Optional, Protocol, Tuple
 
-import tiktoken
+from sembla.llm.models import get_max_prompt_tokens, get_model_spec
+from sembla.llm.tokenizer import get_tokenizer
+from sembla.memory.history import MessageHistory
+from sembla.schemas.system import MemoryState, Message, SystemState
+from sembla.system import StateOperator
 
-from sembla.schemas.system import Message, SystemState
+if TYPE_CHECKING:
+    from sembla.memory.store import MessageLog
+
+REPLY_PRIMING_TOKENS = 3  # every reply is primed with <|start|>assistant<|message|>
+
+
+class EvictionHandler(Protocol):
+    """A callable that receives messages as they are evicted from the history."""
+
+    def __call__(
+        self, system_state: SystemState, evicted_messages: List[Message]
+    ) -> SystemState:
+        ...
 
 
 def update_conversation_history(system_state: SystemState) -> SystemState:
-    # Update the conversation history
-    new_conversation_history = (
-        system_state.memory.conversation_history
-        + system_state.memory.conversation_buffer
+    new_state, _ = _update_conversation_history(system_state)
+    return new_state
+
+
+def init_conversation_history_manager(
+    eviction_handlers: List[EvictionHandler],
+    message_log: Optional["MessageLog"] = None,
+) -> StateOperator:
+    """Create an operator that updates the history and hands on evicted messages.
+
+    If a `message_log` is given, every message entering the history is appended to
+    it, along with each new summary and recall, so that the memory can be restored
+    with `load_memory_state`.
+    """
+
+    def manage_conversation_history(system_state: SystemState) -> SystemState:
+        if message_log is not None:
+            system_state = log_conversation_buffer(system_state, message_log)
+        system_state, evicted_messages = _update_conversation_history(system_state)
+        while evicted_messages:
+            for eviction_handler in eviction_handlers:
+                system_state = eviction_handler(system_state, evicted_messages)
+            # A handler may have grown the summary or recall, so make room for it in
+            # this cycle's prompt rather than the next
+            system_state, evicted_messages = _update_conversation_history(system_state)
+        if message_log is not None:
+            system_state = log_memory_messages(system_state, message_log)
+        return system_state
+
+    return manage_conversation_history
+
+
+def log_conversation_buffer(
+    system_state: SystemState, message_log: "MessageLog"
+) -> SystemState:
+    """Append the messages in the conversation buffer to `message_log`."""
+    model_name = system_state.model.name
+    new_messages = [
+        with_token_count(message, model_name)
+        for message in system_state.memory.conversation_buffer
+    ]
+    message_log.extend(new_messages)
+    new_memory_state = system_state.memory.evolve(
+        conversation_buffer=new_messages, log_offset=message_log.size
     )
+    return system_state.evolve(memory=new_memory_state)
 
-    # Remove the oldest messages from the conversation history if necessary
-    while len(new_conversation_history) > system_state.memory.max_history_message_count:
-        new_conversation_history = remove_earliest_non_system_message(
-            new_conversation_history
-        )
 
-    # Remove the oldest tokens from the conversation history if necessary
-    while (
-        get_token_count(new_conversation_history, system_state.model.name)
-        > system_state.memory.max_history_token_count
-    ):
-        new_conversation_history = remove_earliest_non_system_message(
-            new_conversation_history
-        )
+def log_memory_messages(
+    system_state: SystemState, message_log: "MessageLog"
+) -> SystemState:
+    """Record any new summary or recall of the memory in `message_log`."""
+    memory = system_state.memory
+    offsets = [
+        message_log.save_memory_message(name, message)
+        for name, message in (("summary", memory.summary), ("recall", memory.recall))
+        if message is not None
+    ]
+    if not any(offset is not None for offset in offsets):
+        return system_state
+    new_memory_state = memory.evolve(log_offset=message_log.size)
+    return system_state.evolve(memory=new_memory_state)
+
 
-    # Update the memory state
-    new_memory_state = system_state.memory.copy(
-        update={"conversation_history": new_conversation_history}
+def _update_conversation_history(
+    system_state: SystemState,
+) -> Tuple[SystemState, List[Message]]:
+    model_name = system_state.model.name
+    memory = system_state.memory
+
+    # Count the new messages once, as they enter the history
+    new_messages = [
+        with_token_count(message, model_name) for message in memory.conversation_buffer
+    ]
+    new_conversation_history = memory.conversation_history.copy()
+    new_conversation_history.extend(new_messages)
+    token_count = get_running_token_count(memory, model_name) + sum(
+        message.token_count for message in new_messages
+    )
+
+    # Remove the oldest messages from the conversation history if necessary,
+    # leaving room for the summary and recall of earlier messages
+    evicted_messages = trim_conversation_history(
+        new_conversation_history,
+        token_count,
+        max_message_count=memory.max_history_message_count,
+        max_token_count=get_history_token_budget(system_state)
+        - get_reserved_token_count(memory),
     )
-    # Update the buffer
-    new_memory_state = new_memory_state.copy(update={"conversation_buffer": []})
-    # Update the token count
-    new_memory_state = new_memory_state.copy(
-        update={
-            "message_count": len(new_conversation_history),
-            "token_count": get_token_count(
-                new_conversation_history, system_state.model.name
-            ),
-        }
+    token_count -= sum(message.token_count for message in evicted_messages)
+
+    new_memory_state = memory.evolve(
+        conversation_history=new_conversation_history,
+        conversation_buffer=[],
+        message_count=len(new_conversation_history),
+        token_count=token_count,
     )
 
-    return system_state.copy(update={"memory": new_memory_state})
+    return system_state.evolve(memory=new_memory_state), evicted_messages
 
 
-def remove_earliest_non_system_message(
-    conversation_history: List[Message],
+def trim_conversation_history(
+    conversation_history: MessageHistory[Message],
+    token_count: int,
+    max_message_count: int,
+    max_token_count: int,
 ) -> List[Message]:
-    for i, msg in enumerate(conversation_history):
-        if msg.role != "system":
-            del conversation_history[i]
-            break
-    return conversation_history
+    """Evict the earliest non-system messages until the history fits its limits.
+
+    Messages must carry a cached `token_count`. The history is trimmed in place and
+    the evicted messages are returned, earliest first.
+    """
+    evicted_messages = []
+    while conversation_history.evictable_count and (
+        len(conversation_history) > max_message_count or token_count > max_token_count
+    ):
+        message = conversation_history.evict()
+        token_count -= message.token_count
+        evicted_messages.append(message)
+    return evicted_messages
+
+
+def get_prompt_messages(memory: MemoryState) -> List[Message]:
+    """Return the messages to send to the model.
+
+    The summary and recall of evicted messages stand in for the messages that came
+    before the earliest evictable message still in the history.
+    """
+    messages = memory.conversation_history.messages
+    earlier_messages = [
+        message for message in (memory.summary, memory.recall) if message is not None
+    ]
+    if not earlier_messages:
+        return messages
+    evictable = memory.conversation_history.evictable
+    index = messages.index(evictable[0]) if evictable else len(messages)
+    return messages[:index] + earlier_messages + messages[index:]
+
+
+def get_history_token_budget(system_state: SystemState) -> int:
+    """Return the tokens the history may use, leaving room for the completion."""
+    return min(
+        system_state.memory.max_history_token_count,
+        get_max_prompt_tokens(system_state.model.name, system_state.model.max_tokens),
+    )
+
+
+def get_reserved_token_count(memory: MemoryState) -> int:
+    """Return the tokens reserved from the history for the summary and recall."""
+    return sum(
+        message.token_count or 0
+        for message in (memory.summary, memory.recall)
+        if message is not None
+    )
 
 
-def get_token_count(conversation_history: List[Message], model_name: str) -> int:
-    return num_tokens_in_messages(conversation_history, model_name=model_name)
+def get_prompt_token_count(memory: MemoryState, model_name: str) -> int:
+    """Return the number of tokens in the prompt built by `get_prompt_messages`."""
+    return get_running_token_count(memory, model_name) + get_reserved_token_count(
+        memory
+    )
+
+
+def with_token_count(message: Message, model_name: str) -> Message:
+    """Return `message` with its token count cached."""
+    if message.token_count is not None:
+        return message
+    return message.evolve(token_count=count_message_tokens(message, model_name))
+
+
+def get_running_token_count(memory: MemoryState, model_name: str) -> int:
+    """Return the token count of the history, recounting only if it was never set."""
+    if memory.token_count or not memory.conversation_history:
+        return memory.token_count or REPLY_PRIMING_TOKENS
+    return get_token_count(memory.conversation_history, model_name)
+
+
+def get_token_count(conversation_history: Iterable[Message], model_name: str) -> int:
+    """Return the token count of the history, using cached message counts."""
+    num_tokens = REPLY_PRIMING_TOKENS
+    for message in conversation_history:
+        if message.token_count is None:
+            num_tokens += count_message_tokens(message, model_name)
+        else:
+            num_tokens += message.token_count
+    return num_tokens
 
 
 def get_max_token_count(model_name: str) -> int:
-    # TODO: Update this since GPT-3 now comes in multiple context lengths
-    if "gpt-3" in model_name:
-        return 4097
-    elif "gpt-4" in model_name:
-        return 8192
-    else:
-        raise ValueError(f"Unknown model: {model_name}")
+    return get_model_spec(model_name).context_window
 
 
 def num_tokens_in_messages(messages: List[Message], model_name="gpt-3.5-turbo-0301"):
     """Returns the number of tokens used by a list of messages."""
-    # Source: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
-    try:
-        encoding = tiktoken.encoding_for_model(model_name)
-    except KeyError:
-        logging.debug("Model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
-    if model_name == "gpt-3.5-turbo":
-        logging.debug(
-            "gpt-3.5-turbo may change over time. Returning num tokens assuming gpt-3.5-turbo-0301."
-        )
-        return num_tokens_in_messages(messages, model_name="gpt-3.5-turbo-0301")
-    elif model_name == "gpt-4":
-        logging.debug(
-            "gpt-4 may change over time. Returning num tokens assuming gpt-4-0314."
-        )
-        return num_tokens_in_messages(messages, model_name="gpt-4-0314")
-    elif model_name == "gpt-3.5-turbo-0301":
-        tokens_per_message = (
-            4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
+    num_tokens = 0
+    for message in messages:
+        num_tokens += count_message_tokens(message, model_name)
+    num_tokens += REPLY_PRIMING_TOKENS
+    return num_tokens
+
+
+class ConversationTokenCount(NamedTuple):
+    message_token_counts: List[int]
+    token_count: int
+
+
+def count_tokens_in_conversations(
+    conversations: List[List[Message]],
+    model_name: str = "gpt-3.5-turbo-0301",
+    num_threads: int = 8,
+) -> List[ConversationTokenCount]:
+    """Returns per-message and total token counts for many conversations at once.
+
+    The contents of all the messages are encoded in a single batch across a thread
+    pool, and the per-message overheads are then applied in one pass.
+    """
+    tokens_per_message, tokens_per_name = get_message_token_overhead(model_name)
+    messages = [message for conversation in conversations for message in conversation]
+    content_token_counts = get_tokenizer().count_tokens_batch(
+        [message.content for message in messages], model_name, num_threads
+    )
+    message_token_counts = [
+        tokens_per_message + num_tokens + (tokens_per_name if message.name else 0)
+        for message, num_tokens in zip(messages, content_token_counts)
+    ]
+
+    conversation_token_counts = []
+    start = 0
+    for conversation in conversations:
+        end = start + len(conversation)
+        counts = message_token_counts[start:end]
+        conversation_token_counts.append(
+            ConversationTokenCount(counts, sum(counts) + REPLY_PRIMING_TOKENS)
         )
-        tokens_per_name = -1  # if there's a name, the role is omitted
-    elif model_name == "gpt-4-0314":
-        tokens_per_message = 3
-        tokens_per_name = 1
-    else:
+        start = end
+    return conversation_token_counts
+
+
+def get_message_token_overhead(model_name: str) -> Tuple[int, int]:
+    """Return the tokens added per message and per name for `model_name`."""
+    try:
+        model_spec = get_model_spec(model_name)
+    except ValueError:
         raise NotImplementedError(
             f"""num_tokens_from_messages() is not implemented for model {model_name}. See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens."""
         )
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
-        num_tokens += len(encoding.encode(message.content))
-        if message.name:
-            num_tokens += tokens_per_name
-    num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+    return model_spec.tokens_per_message, model_spec.tokens_per_name
+
+
+def count_message_tokens(message: Message, model_name="gpt-3.5-turbo-0301") -> int:
+    """Returns the number of tokens a single message adds to a prompt."""
+    # Source: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+    tokens_per_message, tokens_per_name = get_message_token_overhead(model_name)
+    num_tokens = tokens_per_message
+    num_tokens += get_tokenizer().count_tokens(message.content, model_name)
+    if message.name:
+        num_tokens += tokens_per_name
     return num_tokens
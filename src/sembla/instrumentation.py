@@ -0,0 +1,210 @@
+"""
+Measure the time, memory and tokens spent by each component of an agent system.
+
+Pass a `Profiler` to an `AgentSystem` to wrap each of its components:
+
+    profiler = Profiler(callback=print)
+    system = AgentSystem(components, profiler=profiler)
+    system.loop(system_state)
+    profiler.totals()["generate_response"].wall_time
+
+Components are only wrapped when a profiler is given, so an agent system without
+one runs exactly as before.
+"""
+import time
+import tracemalloc
+from collections import defaultdict
+from functools import wraps
+from typing import Callable, Dict, List, NamedTuple, Optional, Union
+
+from .budget import get_new_token_usage
+from .schemas.system import SystemState
+from .system import AsyncStateOperator, StateOperator, is_async_operator
+
+
+class OperatorMetrics(NamedTuple):
+    """
+    The resources used by one call of a state operator.
+
+    Attributes:
+        operator_name: The name of the operator.
+        cycle: The task cycle of the state passed to the operator.
+        wall_time: The elapsed time of the call in seconds.
+        cpu_time: The CPU time of the calling thread in seconds. Not measured for
+            async operators, which share their thread with other tasks.
+        allocated_bytes: The change in memory traced by tracemalloc, if enabled.
+            Tracing covers the whole process, so this includes allocations by any
+            other operators running at the same time, and it is not measured for
+            async operators, which run alongside other tasks.
+        prompt_tokens: The prompt tokens of a completion made by the operator.
+        completion_tokens: The completion tokens of a completion made by the operator.
+    """
+
+    operator_name: str
+    cycle: int
+    wall_time: float
+    cpu_time: Optional[float] = None
+    allocated_bytes: Optional[int] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+class MetricsTotals:
+    """The resources used by many calls of state operators."""
+
+    def __init__(self):
+        self.calls = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.allocated_bytes = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def add(self, metrics: OperatorMetrics):
+        self.calls += 1
+        self.wall_time += metrics.wall_time
+        self.cpu_time += metrics.cpu_time or 0.0
+        self.allocated_bytes += metrics.allocated_bytes or 0
+        self.prompt_tokens += metrics.prompt_tokens
+        self.completion_tokens += metrics.completion_tokens
+
+    def __repr__(self) -> str:
+        return (
+            f"MetricsTotals(calls={self.calls}, wall_time={self.wall_time:.6f}, "
+            f"cpu_time={self.cpu_time:.6f}, allocated_bytes={self.allocated_bytes}, "
+            f"prompt_tokens={self.prompt_tokens}, "
+            f"completion_tokens={self.completion_tokens})"
+        )
+
+
+MetricsCallback = Callable[[OperatorMetrics], None]
+
+
+class Profiler:
+    """
+    Records the metrics of every call of the operators it wraps.
+
+    Args:
+        trace_memory: Measure memory with tracemalloc, starting it if needed.
+            Tracing slows down every allocation, so it is off by default, and is
+            stopped by `close` if the profiler started it.
+        callback: Called with the metrics of each call as soon as it returns.
+    """
+
+    def __init__(
+        self, trace_memory: bool = False, callback: Optional[MetricsCallback] = None
+    ):
+        self.trace_memory = trace_memory
+        self.callback = callback
+        self.records: List[OperatorMetrics] = []
+        self._started_tracing = False
+
+    def wrap(
+        self, operator: Union[StateOperator, AsyncStateOperator]
+    ) -> Union[StateOperator, AsyncStateOperator]:
+        """Return `operator` wrapped to record the metrics of each call."""
+        operator_name = getattr(operator, "__name__", type(operator).__name__)
+
+        if is_async_operator(operator):
+
+            @wraps(operator)
+            async def profile_async_call(system_state: SystemState) -> SystemState:
+                wall_start = time.perf_counter()
+                new_state = await operator(system_state)  # type: ignore
+                wall_time = time.perf_counter() - wall_start
+                self._record(
+                    operator_name,
+                    system_state,
+                    new_state,
+                    wall_time,
+                    None,
+                    None,
+                )
+                return new_state
+
+            return profile_async_call
+
+        @wraps(operator)
+        def profile_call(system_state: SystemState) -> SystemState:
+            allocated_start = self._traced_memory()
+            cpu_start = time.thread_time()
+            wall_start = time.perf_counter()
+            new_state = operator(system_state)
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = time.thread_time() - cpu_start
+            self._record(
+                operator_name,
+                system_state,
+                new_state,
+                wall_time,
+                cpu_time,
+                allocated_start,
+            )
+            return new_state
+
+        return profile_call
+
+    def by_cycle(self) -> Dict[int, Dict[str, MetricsTotals]]:
+        """Aggregate the records by cycle, then by operator."""
+        cycles: Dict[int, Dict[str, MetricsTotals]] = defaultdict(
+            lambda: defaultdict(MetricsTotals)
+        )
+        for metrics in self.records:
+            cycles[metrics.cycle][metrics.operator_name].add(metrics)
+        return {cycle: dict(totals) for cycle, totals in cycles.items()}
+
+    def totals(self) -> Dict[str, MetricsTotals]:
+        """Aggregate the records of the whole run by operator."""
+        totals: Dict[str, MetricsTotals] = defaultdict(MetricsTotals)
+        for metrics in self.records:
+            totals[metrics.operator_name].add(metrics)
+        return dict(totals)
+
+    def clear(self):
+        self.records = []
+
+    def close(self):
+        """Stop tracing memory, if the profiler started it."""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def __enter__(self) -> "Profiler":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _traced_memory(self) -> Optional[int]:
+        if not self.trace_memory:
+            return None
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        return tracemalloc.get_traced_memory()[0]
+
+    def _record(
+        self,
+        operator_name: str,
+        system_state: SystemState,
+        new_state: SystemState,
+        wall_time: float,
+        cpu_time: Optional[float],
+        allocated_start: Optional[int],
+    ):
+        allocated_bytes = None
+        if allocated_start is not None:
+            allocated_bytes = tracemalloc.get_traced_memory()[0] - allocated_start
+        prompt_tokens, completion_tokens = get_new_token_usage(new_state)
+        metrics = OperatorMetrics(
+            operator_name=operator_name,
+            cycle=system_state.task.current_cycle,
+            wall_time=wall_time,
+            cpu_time=cpu_time,
+            allocated_bytes=allocated_bytes,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+        )
+        self.records.append(metrics)
+        if self.callback is not None:
+            self.callback(metrics)
@@ -0,0 +1,179 @@
+"""
+Generate each response with the cheapest model that gets it right.
+
+The models of `ModelState.cascade` are tried in turn. The response of each is put
+through the response processors, and if any of them records an error, such as a
+response that does not parse or calls an unknown action, the next model is tried:
+
+    model = ModelState(cascade=["gpt-3.5-turbo", "gpt-4"])
+    stats = CascadeStats()
+    generate_response = init_model_cascade(
+        generate_chat_completion,
+        processors=[process_json_response, validate_action_call],
+        stats=stats,
+    )
+
+The state returned has the model that made the response it holds, and the usage
+of every model tried, priced at each model's own rate. Models without a price add
+nothing to the cost. `stats` counts how often each model succeeds, to help choose
+the models of the cascade.
+"""
+import threading
+from typing import Dict, List, NamedTuple, Optional
+
+from sembla.llm.models import get_completion_cost
+from sembla.response.processor import has_processing_error
+from sembla.schemas.system import SystemState, TokenUsage
+from sembla.system import AsyncStateOperator, StateOperator
+
+
+class TierInfo(NamedTuple):
+    """
+    The statistics of a model in a cascade.
+
+    Attributes:
+        attempts: Responses the model generated.
+        successes: Responses of the model that passed processing.
+    """
+
+    attempts: int
+    successes: int
+
+    @property
+    def success_rate(self) -> float:
+        return self.successes / self.attempts if self.attempts else 0.0
+
+
+class CascadeStats:
+    """Counts the attempts and successes of each model tried by a cascade."""
+
+    def __init__(self):
+        self._tiers: Dict[str, TierInfo] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_name: str, success: bool):
+        with self._lock:
+            attempts, successes = self._tiers.get(model_name, (0, 0))
+            self._tiers[model_name] = TierInfo(attempts + 1, successes + success)
+
+    def tier_info(self) -> Dict[str, TierInfo]:
+        with self._lock:
+            return dict(self._tiers)
+
+    def clear(self):
+        with self._lock:
+            self._tiers.clear()
+
+
+def get_cascade(system_state: SystemState) -> List[str]:
+    return system_state.model.cascade or [system_state.model.name]
+
+
+def get_priced_usage(system_state: SystemState) -> Optional[TokenUsage]:
+    """Return the usage of the agent response, priced for the model of the state."""
+    if system_state.agent_response is None:
+        return None
+    usage = system_state.agent_response.usage
+    if usage is None or usage.cost is not None:
+        return usage
+    try:
+        cost = get_completion_cost(
+            system_state.model.name, usage.prompt_tokens, usage.completion_tokens
+        )
+    except ValueError:
+        return usage
+    return usage.evolve(cost=cost)
+
+
+def add_usage(
+    total: Optional[TokenUsage], usage: Optional[TokenUsage]
+) -> Optional[TokenUsage]:
+    """Add up two usages, with the cost of those that have a price.
+
+    Replayed usages are left out unless every usage was replayed, so that a tier
+    answered without a call, such as from a cache, is not billed.
+    """
+    if total is None or usage is None:
+        return usage or total
+    if total.replayed != usage.replayed:
+        return usage if total.replayed else total
+    costs = [cost for cost in (total.cost, usage.cost) if cost is not None]
+    return TokenUsage.trusted(
+        prompt_tokens=total.prompt_tokens + usage.prompt_tokens,
+        completion_tokens=total.completion_tokens + usage.completion_tokens,
+        total_tokens=total.total_tokens + usage.total_tokens,
+        cost=sum(costs) if costs else None,
+        replayed=total.replayed,
+    )
+
+
+class CascadeAttempt:
+    """Processes the response of each model and keeps the usage of all of them."""
+
+    def __init__(self, processors: List[StateOperator], stats: Optional[CascadeStats]):
+        self.processors = processors
+        self.stats = stats
+        self.state: Optional[SystemState] = None
+        self.usage: Optional[TokenUsage] = None
+        self.attempts = 0
+
+    def start(self, system_state: SystemState, model_name: str) -> SystemState:
+        """Return `system_state` set to generate its response with `model_name`."""
+        if system_state.model.name == model_name:
+            return system_state
+        model = system_state.model.evolve(name=model_name)
+        return system_state.evolve(model=model)
+
+    def finish(self, new_state: SystemState) -> bool:
+        """Process the response of `new_state` and return whether it passed."""
+        for processor in self.processors:
+            new_state = processor(new_state)
+        self.state = new_state
+        self.attempts += 1
+        self.usage = add_usage(self.usage, get_priced_usage(new_state))
+        success = not has_processing_error(new_state)
+        if self.stats is not None:
+            self.stats.record(new_state.model.name, success)
+        return success
+
+    def result(self) -> SystemState:
+        if self.attempts == 1 or self.state.agent_response is None:
+            return self.state
+        agent_response = self.state.agent_response.evolve(usage=self.usage)
+        return self.state.evolve(agent_response=agent_response)
+
+
+def init_model_cascade(
+    generate: StateOperator,
+    processors: List[StateOperator],
+    stats: Optional[CascadeStats] = None,
+) -> StateOperator:
+    """Create an operator that escalates `generate` through the model cascade."""
+
+    def generate_with_model_cascade(system_state: SystemState) -> SystemState:
+        attempt = CascadeAttempt(processors, stats)
+        for model_name in get_cascade(system_state):
+            new_state = generate(attempt.start(system_state, model_name))
+            if attempt.finish(new_state):
+                break
+        return attempt.result()
+
+    return generate_with_model_cascade
+
+
+def init_async_model_cascade(
+    agenerate: AsyncStateOperator,
+    processors: List[StateOperator],
+    stats: Optional[CascadeStats] = None,
+) -> AsyncStateOperator:
+    """Create an operator that escalates `agenerate` through the model cascade."""
+
+    async def agenerate_with_model_cascade(system_state: SystemState) -> SystemState:
+        attempt = CascadeAttempt(processors, stats)
+        for model_name in get_cascade(system_state):
+            new_state = await agenerate(attempt.start(system_state, model_name))
+            if attempt.finish(new_state):
+                break
+        return attempt.result()
+
+    return agenerate_with_model_cascade
@@ -0,0 +1,175 @@
+import re
+from typing import Dict, NamedTuple, Optional
+
+from sembla.schemas.base import BaseSchema
+
+
+class ModelSpec(BaseSchema):
+    """
+    Describes the limits and tokenization of a chat model.
+
+    Attributes:
+        name: The name of the model, or the prefix of a family of model names.
+        context_window: The number of tokens shared by the prompt and completion.
+        encoding_name: The name of the tiktoken encoding used by the model.
+        tokens_per_message: The tokens added to the prompt for every message.
+        tokens_per_name: The tokens added to the prompt for a message name.
+        prompt_token_price: The price in US dollars of 1,000 prompt tokens, or None
+            if the model has no known price.
+        completion_token_price: The price in US dollars of 1,000 completion tokens,
+            or None if the model has no known price.
+    """
+
+    name: str
+    context_window: int
+    encoding_name: str = "cl100k_base"
+    tokens_per_message: int = 3
+    tokens_per_name: int = 1
+    prompt_token_price: Optional[float] = None
+    completion_token_price: Optional[float] = None
+
+
+class ContextWindowExceededError(ValueError):
+    """Raised when a prompt leaves no room in the context window for a completion."""
+
+
+class TokenBudget(NamedTuple):
+    prompt_tokens: int
+    completion_tokens: int
+
+
+DEFAULT_MODEL_SPECS = [
+    # gpt-3.5-turbo may change over time; count tokens as gpt-3.5-turbo-0301
+    ModelSpec(
+        name="gpt-3.5-turbo",
+        context_window=4097,
+        # every message follows <|start|>{role/name}\n{content}<|end|>\n
+        tokens_per_message=4,
+        # if there's a name, the role is omitted
+        tokens_per_name=-1,
+        prompt_token_price=0.0015,
+        completion_token_price=0.002,
+    ),
+    ModelSpec(
+        name="gpt-3.5-turbo-0301",
+        context_window=4097,
+        tokens_per_message=4,
+        tokens_per_name=-1,
+        prompt_token_price=0.0015,
+        completion_token_price=0.002,
+    ),
+    ModelSpec(
+        name="gpt-3.5-turbo-0613",
+        context_window=4097,
+        prompt_token_price=0.0015,
+        completion_token_price=0.002,
+    ),
+    ModelSpec(
+        name="gpt-3.5-turbo-16k",
+        context_window=16385,
+        prompt_token_price=0.003,
+        completion_token_price=0.004,
+    ),
+    ModelSpec(
+        name="gpt-3.5-turbo-1106",
+        context_window=16385,
+        prompt_token_price=0.001,
+        completion_token_price=0.002,
+    ),
+    # gpt-4 may change over time; count tokens as gpt-4-0314
+    ModelSpec(
+        name="gpt-4",
+        context_window=8192,
+        prompt_token_price=0.03,
+        completion_token_price=0.06,
+    ),
+    ModelSpec(
+        name="gpt-4-32k",
+        context_window=32768,
+        prompt_token_price=0.06,
+        completion_token_price=0.12,
+    ),
+    ModelSpec(
+        name="gpt-4-1106-preview",
+        context_window=128000,
+        prompt_token_price=0.01,
+        completion_token_price=0.03,
+    ),
+]
+
+# The dated snapshot of a model, such as gpt-4-0613, shares the model's spec
+DATE_SUFFIX = re.compile(r"-\d{4}\Z")
+
+_model_specs: Dict[str, ModelSpec] = {
+    model_spec.name: model_spec for model_spec in DEFAULT_MODEL_SPECS
+}
+
+
+def register_model_spec(model_spec: ModelSpec):
+    """Register `model_spec` for its model name and its dated snapshots."""
+    _model_specs[model_spec.name] = model_spec
+
+
+def find_model_spec(model_name: str) -> Optional[ModelSpec]:
+    """Return the spec registered for exactly `model_name`, if there is one."""
+    return _model_specs.get(model_name)
+
+
+def get_model_spec(model_name: str) -> ModelSpec:
+    """Return the spec of `model_name`, or of the model it is a dated snapshot of.
+
+    Other names that merely start with a registered name, such as a newer model
+    like gpt-4-1106-preview, are not matched, as their limits and prices differ.
+    """
+    model_spec = _model_specs.get(model_name)
+    if model_spec is not None:
+        return model_spec
+    match = DATE_SUFFIX.search(model_name)
+    if match is not None:
+        model_spec = _model_specs.get(model_name[: match.start()])
+        if model_spec is not None:
+            return model_spec
+    raise ValueError(f"Unknown model: {model_name}")
+
+
+def pack_token_budget(
+    model_name: str, prompt_tokens: int, max_completion_tokens: int
+) -> TokenBudget:
+    """Split the context window of `model_name` between prompt and completion.
+
+    The completion gets every token the prompt leaves free, up to
+    `max_completion_tokens`.
+    """
+    context_window = get_model_spec(model_name).context_window
+    completion_tokens = min(context_window - prompt_tokens, max_completion_tokens)
+    if completion_tokens <= 0:
+        raise ContextWindowExceededError(
+            f"Prompt of {prompt_tokens} tokens leaves no room for a completion in "
+            f"the {context_window} token context window of {model_name}."
+        )
+    return TokenBudget(prompt_tokens, completion_tokens)
+
+
+def get_max_prompt_tokens(model_name: str, max_completion_tokens: int) -> int:
+    """Return the most prompt tokens that leave room for `max_completion_tokens`."""
+    return get_model_spec(model_name).context_window - max_completion_tokens
+
+
+def get_completion_cost(
+    model_name: str, prompt_tokens: int, completion_tokens: int
+) -> float:
+    """Return the price in US dollars of a completion by `model_name`.
+
+    Raises:
+        ValueError: If the model is unknown or has no price.
+    """
+    model_spec = get_model_spec(model_name)
+    if (
+        model_spec.prompt_token_price is None
+        or model_spec.completion_token_price is None
+    ):
+        raise ValueError(f"No price for model: {model_name}")
+    return (
+        prompt_tokens * model_spec.prompt_token_price
+        + completion_tokens * model_spec.completion_token_price
+    ) / 1000
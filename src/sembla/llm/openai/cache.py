@@ -0,0 +1,244 @@
+"""
+Cache chat completions by the content of their requests.
+
+Requests with the same model, sampling parameters and messages share a cache entry.
+Entries are kept in an in-memory LRU and, if a directory is given, on disk, where
+they are shared between processes and survive restarts:
+
+    cache = ResponseCache(path=".completions", ttl=24 * 60 * 60)
+    create = init_cached_chat_completion(cache)
+    components = [..., init_chat_completion_generator(create), ...]
+
+Sampled responses differ from call to call, so requests with a temperature above
+`max_temperature` are passed through uncached. The usage of a cached response is
+marked as replayed, so that it is not billed against the task again.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple, Union
+
+from sembla.llm.openai.chat_completion import (
+    AsyncChatCompletionFn,
+    ChatCompletionFn,
+    acreate_chat_completion,
+    create_chat_completion,
+    get_request_key,
+    mark_replayed,
+)
+
+DEFAULT_MAX_TEMPERATURE = 0.2
+DEFAULT_MAX_CACHE_SIZE = 1024
+
+
+class ResponseCacheInfo(NamedTuple):
+    """
+    The statistics of a response cache.
+
+    Attributes:
+        memory_hits: Requests answered from memory.
+        disk_hits: Requests answered from disk.
+        misses: Cacheable requests that called the API.
+        skipped: Requests not cached because of their temperature.
+        latency_saved: The seconds the API took to answer the requests that hit.
+        current_size: The number of entries in memory.
+    """
+
+    memory_hits: int
+    disk_hits: int
+    misses: int
+    skipped: int
+    latency_saved: float
+    current_size: int
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of cacheable requests answered by the cache."""
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return hits / lookups if lookups else 0.0
+
+
+class CacheEntry(NamedTuple):
+    response: Dict[str, Any]
+    created: float
+    elapsed: float
+
+
+class ResponseCache:
+    """
+    A two tier cache of chat completion responses, keyed by request.
+
+    Args:
+        max_size: The number of entries to keep in memory.
+        path: The directory of the disk tier, if there is one.
+        ttl: The seconds an entry may be used for, or None to keep entries forever.
+        max_temperature: The highest temperature of requests that are cached.
+        clock: The function that returns the current time, for entry expiry.
+    """
+
+    def __init__(
+        self,
+        max_size: int = DEFAULT_MAX_CACHE_SIZE,
+        path: Optional[Union[str, Path]] = None,
+        ttl: Optional[float] = None,
+        max_temperature: float = DEFAULT_MAX_TEMPERATURE,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.max_size = max_size
+        self.path = Path(path) if path is not None else None
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self.clock = clock
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.latency_saved = 0.0
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        if self.path is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+
+    def is_cacheable(self, request: Dict[str, Any]) -> bool:
+        return request.get("temperature", 1.0) <= self.max_temperature
+
+    def skip(self):
+        """Count a request that was passed through because it is not cacheable."""
+        with self._lock:
+            self.skipped += 1
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached response for `key`, counting a hit or a miss."""
+        entry, tier = self._lookup(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            if tier == "memory":
+                self.memory_hits += 1
+            else:
+                self.disk_hits += 1
+            self.latency_saved += entry.elapsed
+        return entry.response
+
+    def put(self, key: str, response: Dict[str, Any], elapsed: float):
+        """Cache `response`, which took the API `elapsed` seconds to return."""
+        # Round trip through JSON, so that later changes to the response do not
+        # leak into the cache and memory and disk hits return the same data
+        data = json.dumps(
+            {"response": response, "created": self.clock(), "elapsed": elapsed},
+            default=str,
+        )
+        entry = CacheEntry(**json.loads(data))
+        self._store(key, entry)
+        if self.path is not None:
+            self._write(key, data)
+
+    def cache_info(self) -> ResponseCacheInfo:
+        with self._lock:
+            return ResponseCacheInfo(
+                memory_hits=self.memory_hits,
+                disk_hits=self.disk_hits,
+                misses=self.misses,
+                skipped=self.skipped,
+                latency_saved=self.latency_saved,
+                current_size=len(self._entries),
+            )
+
+    def clear(self):
+        """Remove every entry from memory. The disk tier is left as it is."""
+        with self._lock:
+            self._entries.clear()
+
+    def _lookup(self, key: str) -> Tuple[Optional[CacheEntry], str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._is_expired(entry):
+                    self._entries.move_to_end(key)
+                    return entry, "memory"
+                del self._entries[key]
+        if self.path is None:
+            return None, "memory"
+        entry = self._read(key)
+        if entry is None or self._is_expired(entry):
+            return None, "disk"
+        self._store(key, entry)
+        return entry, "disk"
+
+    def _is_expired(self, entry: CacheEntry) -> bool:
+        return self.ttl is not None and self.clock() - entry.created > self.ttl
+
+    def _store(self, key: str, entry: CacheEntry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _get_file_path(self, key: str) -> Path:
+        assert self.path is not None
+        return self.path / key[:2] / f"{key}.json"
+
+    def _read(self, key: str) -> Optional[CacheEntry]:
+        try:
+            with open(self._get_file_path(key), encoding="utf-8") as f:
+                return CacheEntry(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _write(self, key: str, data: str):
+        """Write an entry atomically, so that readers never see a partial file."""
+        file_path = self._get_file_path(key)
+        file_path.parent.mkdir(exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=file_path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(temp_path, file_path)
+
+
+def init_cached_chat_completion(
+    cache: ResponseCache, create: ChatCompletionFn = create_chat_completion
+) -> ChatCompletionFn:
+    """Wrap `create` to answer cacheable requests from `cache`."""
+
+    def create_cached_chat_completion(**request: Any) -> Dict[str, Any]:
+        if not cache.is_cacheable(request):
+            cache.skip()
+            return create(**request)
+        key = get_request_key(request)
+        response = cache.get(key)
+        if response is not None:
+            return mark_replayed(response)
+        start = time.perf_counter()
+        response = create(**request)
+        cache.put(key, response, time.perf_counter() - start)
+        return response
+
+    return create_cached_chat_completion
+
+
+def init_async_cached_chat_completion(
+    cache: ResponseCache, acreate: AsyncChatCompletionFn = acreate_chat_completion
+) -> AsyncChatCompletionFn:
+    """Wrap `acreate` to answer cacheable requests from `cache`."""
+
+    async def acreate_cached_chat_completion(**request: Any) -> Dict[str, Any]:
+        if not cache.is_cacheable(request):
+            cache.skip()
+            return await acreate(**request)
+        key = get_request_key(request)
+        response = cache.get(key)
+        if response is not None:
+            return mark_replayed(response)
+        start = time.perf_counter()
+        response = await acreate(**request)
+        cache.put(key, response, time.perf_counter() - start)
+        return response
+
+    return acreate_cached_chat_completion
@@ -0,0 +1,156 @@
+"""
+Record chat completions to a cassette file and replay them offline.
+
+A cassette stands in for `openai.ChatCompletion.create`, so agent systems can be
+run, profiled and load tested without calling the API:
+
+    cassette = Cassette("agent.cassette.jsonl", mode="record")
+    components = [..., init_chat_completion_generator(cassette.create), ...]
+
+Replaying the same requests with `mode="replay"` returns the recorded responses in
+the order they were recorded. Set `latency_scale=1.0` to sleep for as long as each
+recorded call took, or pass a fixed `latency` in seconds.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from openai.util import convert_to_openai_object
+
+from sembla.llm.openai.chat_completion import (
+    AsyncChatCompletionFn,
+    ChatCompletionFn,
+    acreate_chat_completion,
+    create_chat_completion,
+    get_request_key,
+)
+
+RECORD = "record"
+REPLAY = "replay"
+AUTO = "auto"
+
+
+class CassetteMissError(KeyError):
+    """Raised when a request being replayed was never recorded."""
+
+
+class Cassette:
+    """
+    Records chat completion requests and responses, and replays them.
+
+    Args:
+        path: The JSON lines file holding the recordings.
+        mode: "record" to call the API and append every call to the cassette,
+            "replay" to only return recorded responses, or "auto" to replay
+            recorded requests and record new ones.
+        create: The function called to record new completions.
+        acreate: The coroutine function called to record new async completions.
+        latency: Seconds to sleep before returning a replayed response.
+        latency_scale: The fraction of each call's recorded duration to sleep for
+            before returning a replayed response.
+
+    A request recorded more than once replays its responses in order, then keeps
+    returning the last one.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        mode: str = REPLAY,
+        create: ChatCompletionFn = create_chat_completion,
+        acreate: AsyncChatCompletionFn = acreate_chat_completion,
+        latency: float = 0.0,
+        latency_scale: float = 0.0,
+    ):
+        if mode not in (RECORD, REPLAY, AUTO):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = Path(path)
+        self.mode = mode
+        self._create = create
+        self._acreate = acreate
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self._recordings: Dict[str, List[Tuple[Dict[str, Any], float]]] = defaultdict(
+            list
+        )
+        self._replay_counts: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        if self.path.exists():
+            self._load()
+
+    def create(self, **request: Any) -> Dict[str, Any]:
+        """Return the completion of `request`, like `openai.ChatCompletion.create`."""
+        key = get_request_key(request)
+        if self.mode != RECORD:
+            replayed = self._next_recording(key)
+            if replayed is not None:
+                response, elapsed = replayed
+                time.sleep(self._get_delay(elapsed))
+                return convert_to_openai_object(response)
+            if self.mode == REPLAY:
+                raise CassetteMissError(key)
+        start = time.perf_counter()
+        response = self._create(**request)
+        self._record(key, request, response, time.perf_counter() - start)
+        return response
+
+    async def acreate(self, **request: Any) -> Dict[str, Any]:
+        """Return the completion of `request`, like `openai.ChatCompletion.acreate`."""
+        key = get_request_key(request)
+        if self.mode != RECORD:
+            replayed = self._next_recording(key)
+            if replayed is not None:
+                response, elapsed = replayed
+                await asyncio.sleep(self._get_delay(elapsed))
+                return convert_to_openai_object(response)
+            if self.mode == REPLAY:
+                raise CassetteMissError(key)
+        start = time.perf_counter()
+        response = await self._acreate(**request)
+        self._record(key, request, response, time.perf_counter() - start)
+        return response
+
+    def _next_recording(self, key: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        with self._lock:
+            recordings = self._recordings.get(key)
+            if not recordings:
+                return None
+            index = min(self._replay_counts[key], len(recordings) - 1)
+            self._replay_counts[key] += 1
+            return recordings[index]
+
+    def _get_delay(self, elapsed: float) -> float:
+        return self.latency + self.latency_scale * elapsed
+
+    def _record(
+        self,
+        key: str,
+        request: Dict[str, Any],
+        response: Dict[str, Any],
+        elapsed: float,
+    ):
+        record = {
+            "key": key,
+            "request": request,
+            "response": response,
+            "elapsed": elapsed,
+        }
+        line = json.dumps(record, separators=(",", ":"), default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self._recordings[key].append((json.loads(line)["response"], elapsed))
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                self._recordings[record["key"]].append(
+                    (record["response"], record["elapsed"])
+                )
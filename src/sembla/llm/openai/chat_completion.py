@@ -1,43 +1,116 @@
-from typing import Dict
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict
 
 import openai
+from openai.util import convert_to_openai_object
 
-from sembla.schemas.system import AgentResponse, Message, SystemState
+from sembla.conversation_history import get_prompt_messages, get_prompt_token_count
+from sembla.llm.models import pack_token_budget
+from sembla.schemas.system import AgentResponse, Message, SystemState, TokenUsage
+from sembla.system import AsyncStateOperator, StateOperator
 
 
 def convert_message_to_openai_format(message: Message) -> Dict[str, str]:
     return {"role": message.role, "content": message.content}
 
 
-def generate_chat_completion(system_state: SystemState) -> SystemState:
+def create_chat_completion_request(system_state: SystemState) -> Dict[str, Any]:
+    """Create the keyword arguments of a chat completion request for the state."""
     model = system_state.model.name
-    temperature = system_state.model.temperature
-    n = system_state.model.n
-    frequency_penalty = system_state.model.frequency_penalty
-    presence_penalty = system_state.model.presence_penalty
-
-    conversation_history = system_state.memory.conversation_history
-    max_completion_tokens = (
-        system_state.memory.max_history_token_count - system_state.memory.token_count
+    memory = system_state.memory
+    token_budget = pack_token_budget(
+        model, get_prompt_token_count(memory, model), system_state.model.max_tokens
     )
-    max_completion_tokens = int(max_completion_tokens * 0.95)
 
     messages = [
-        convert_message_to_openai_format(message) for message in conversation_history
+        convert_message_to_openai_format(message)
+        for message in get_prompt_messages(memory)
     ]
 
-    response = openai.ChatCompletion.create(
+    return dict(
         model=model,
         messages=messages,
-        temperature=temperature,
-        n=n,
-        max_tokens=max_completion_tokens,
-        frequency_penalty=frequency_penalty,
-        presence_penalty=presence_penalty,
+        temperature=system_state.model.temperature,
+        n=system_state.model.n,
+        max_tokens=token_budget.completion_tokens,
+        frequency_penalty=system_state.model.frequency_penalty,
+        presence_penalty=system_state.model.presence_penalty,
     )
-    top_response = response.choices[0]
+
+
+def apply_chat_completion_response(
+    system_state: SystemState, response: Dict[str, Any]
+) -> SystemState:
+    """Set the agent response of the state from a chat completion response."""
+    top_response = response["choices"][0]
     message_content = top_response["message"]["content"].strip()
-    agent_response = AgentResponse(raw_response=message_content)
-    new_state = system_state.copy(update={"agent_response": agent_response})
+    usage = response.get("usage")
+    agent_response = AgentResponse.trusted(
+        raw_response=message_content,
+        usage=TokenUsage(**usage) if usage else None,
+    )
+    new_state = system_state.evolve(agent_response=agent_response)
 
     return new_state
+
+
+ChatCompletionFn = Callable[..., Dict[str, Any]]
+AsyncChatCompletionFn = Callable[..., Awaitable[Dict[str, Any]]]
+
+
+def get_request_key(request: Dict[str, Any]) -> str:
+    """Return a key that is the same for requests with equal arguments."""
+    data = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def mark_replayed(response: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a copy of `response` with its usage marked as already paid for."""
+    usage = response.get("usage")
+    if not usage:
+        return convert_to_openai_object(dict(response))
+    return convert_to_openai_object({**response, "usage": {**usage, "replayed": True}})
+
+
+def create_chat_completion(**request: Any) -> Dict[str, Any]:
+    return openai.ChatCompletion.create(**request)
+
+
+async def acreate_chat_completion(**request: Any) -> Dict[str, Any]:
+    return await openai.ChatCompletion.acreate(**request)
+
+
+def init_chat_completion_generator(
+    create: ChatCompletionFn = create_chat_completion,
+) -> StateOperator:
+    """Create an operator that generates the agent response with `create`.
+
+    `create` takes the same keyword arguments as `openai.ChatCompletion.create` and
+    returns a response of the same shape, so that the API can be wrapped or
+    replaced.
+    """
+
+    def generate_chat_completion(system_state: SystemState) -> SystemState:
+        request = create_chat_completion_request(system_state)
+        response = create(**request)
+        return apply_chat_completion_response(system_state, response)
+
+    return generate_chat_completion
+
+
+def init_async_chat_completion_generator(
+    acreate: AsyncChatCompletionFn = acreate_chat_completion,
+) -> AsyncStateOperator:
+    """Create an operator that generates the agent response with `acreate`."""
+
+    async def agenerate_chat_completion(system_state: SystemState) -> SystemState:
+        request = create_chat_completion_request(system_state)
+        response = await acreate(**request)
+        return apply_chat_completion_response(system_state, response)
+
+    return agenerate_chat_completion
+
+
+generate_chat_completion = init_chat_completion_generator()
+agenerate_chat_completion = init_async_chat_completion_generator()
@@ -0,0 +1,402 @@
+"""
+Keep API traffic within request and token rate limits, and retry rejected calls.
+
+A `RateLimiter` holds a token bucket for requests and one for tokens. Each call
+takes one request and the tokens it may use (its prompt, counted before sending,
+plus its `max_tokens`) from the buckets, waiting in line until they have refilled
+enough. Completion tokens that went unused are returned once the response arrives,
+or once a streamed response ends. Calls the API still rejects with a 429 or 5xx are
+retried with jittered exponential backoff:
+
+    limiter = RateLimiter(requests_per_minute=3500, tokens_per_minute=90_000)
+    create = init_rate_limited_chat_completion(limiter)
+    components = [..., init_chat_completion_generator(create), ...]
+
+Share one limiter between every agent in a process. To share the limits between
+processes as well, give each process a limiter with the same `state_path`; the
+bucket levels are then kept in that file under an exclusive lock.
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import weakref
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import openai
+
+from sembla.conversation_history import REPLY_PRIMING_TOKENS, get_message_token_overhead
+from sembla.llm.openai.chat_completion import (
+    AsyncChatCompletionFn,
+    ChatCompletionFn,
+    acreate_chat_completion,
+    create_chat_completion,
+)
+from sembla.llm.tokenizer import get_tokenizer
+
+DEFAULT_BURST_SECONDS = 10.0
+DEFAULT_MESSAGE_TOKEN_OVERHEAD = (3, 1)
+
+
+AsyncLocks = "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]"
+
+
+class BucketLevels(NamedTuple):
+    requests: float
+    tokens: float
+    updated: float
+
+
+class RetryPolicy(NamedTuple):
+    """
+    When to retry a rejected call, and how long to wait before each retry.
+
+    The wait before retry `n` is drawn uniformly between zero and
+    `min(max_delay, base_delay * 2 ** n)`, or is the server's Retry-After if longer.
+    """
+
+    max_retries: int = 6
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+
+    def get_delay(self, retry: int, error: Exception) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**retry))
+        return max(delay, get_retry_after(error))
+
+
+def is_retryable(error: Exception) -> bool:
+    """Check if `error` is a rate limit, timeout or server error."""
+    if isinstance(
+        error,
+        (
+            openai.error.RateLimitError,
+            openai.error.ServiceUnavailableError,
+            openai.error.Timeout,
+            openai.error.APIConnectionError,
+        ),
+    ):
+        return True
+    http_status = getattr(error, "http_status", None)
+    return http_status is not None and (http_status == 429 or http_status >= 500)
+
+
+def get_retry_after(error: Exception) -> float:
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def estimate_request_tokens(request: Dict[str, Any]) -> int:
+    """Return the most tokens `request` can count towards a tokens per minute limit."""
+    model_name = request["model"]
+    try:
+        tokens_per_message, tokens_per_name = get_message_token_overhead(model_name)
+    except NotImplementedError:
+        # Estimate unregistered models as most chat models, with the tokenizer
+        # falling back to the default encoding
+        tokens_per_message, tokens_per_name = DEFAULT_MESSAGE_TOKEN_OVERHEAD
+    tokenizer = get_tokenizer()
+    prompt_tokens = REPLY_PRIMING_TOKENS
+    for message in request["messages"]:
+        prompt_tokens += tokens_per_message
+        prompt_tokens += tokenizer.count_tokens(message["content"], model_name)
+        if message.get("name"):
+            prompt_tokens += tokens_per_name
+    return prompt_tokens + request.get("max_tokens", 0) * request.get("n", 1)
+
+
+class RateLimiter:
+    """
+    Token buckets of requests and tokens, shared by every call that uses them.
+
+    Args:
+        requests_per_minute: The rate that requests may be sent at.
+        tokens_per_minute: The rate that tokens may be used at.
+        burst_seconds: The seconds of traffic the buckets can hold, and so can be
+            sent at once after a quiet spell.
+        state_path: A file to keep the bucket levels in, to share them between
+            processes. Requires `fcntl`, so is only available on Unix.
+
+    Callers wait in the order they arrived, so a large request is not starved by
+    a stream of small ones.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        burst_seconds: float = DEFAULT_BURST_SECONDS,
+        state_path: Optional[Union[str, Path]] = None,
+    ):
+        self.request_rate = requests_per_minute / 60
+        self.token_rate = tokens_per_minute / 60
+        self.request_capacity = max(1.0, self.request_rate * burst_seconds)
+        self.token_capacity = max(1.0, self.token_rate * burst_seconds)
+        self.state_path = Path(state_path) if state_path is not None else None
+        self.waited = 0.0
+        self._levels = BucketLevels(
+            self.request_capacity, self.token_capacity, time.monotonic()
+        )
+        self._lock = threading.Lock()
+        self._queue = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._async_locks: AsyncLocks = weakref.WeakKeyDictionary()
+
+    def acquire(self, tokens: int):
+        """Wait in line until `tokens` and a request can be taken from the buckets."""
+        with self._queue:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while self._serving != ticket:
+                self._queue.wait()
+        try:
+            while True:
+                wait = self.try_acquire(tokens)
+                if wait == 0:
+                    return
+                self._add_wait(wait)
+                time.sleep(wait)
+        finally:
+            with self._queue:
+                self._serving += 1
+                self._queue.notify_all()
+
+    async def aacquire(self, tokens: int):
+        """Wait in line on the event loop until `tokens` and a request are taken."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            lock = self._async_locks.get(loop)
+            if lock is None:
+                # A lock that has been waited on refers to its loop, so the locks
+                # of closed loops are dropped here as well as when collected
+                closed_loops = [key for key in self._async_locks if key.is_closed()]
+                for closed_loop in closed_loops:
+                    del self._async_locks[closed_loop]
+                lock = self._async_locks[loop] = asyncio.Lock()
+        # asyncio locks are acquired in the order they were waited for
+        async with lock:
+            while True:
+                wait = self.try_acquire(tokens)
+                if wait == 0:
+                    return
+                self._add_wait(wait)
+                await asyncio.sleep(wait)
+
+    def try_acquire(self, tokens: int) -> float:
+        """Take `tokens` and a request if the buckets hold them.
+
+        Returns zero if they were taken, or else the seconds until they will be.
+        """
+        tokens = min(tokens, self.token_capacity)
+
+        def take(levels: BucketLevels) -> Tuple[BucketLevels, float]:
+            levels = self._refill(levels)
+            wait = max(
+                (1 - levels.requests) / self.request_rate,
+                (tokens - levels.tokens) / self.token_rate,
+                0.0,
+            )
+            if wait > 0:
+                return levels, wait
+            new_levels = BucketLevels(
+                levels.requests - 1, levels.tokens - tokens, levels.updated
+            )
+            return new_levels, 0.0
+
+        return self._update(take)
+
+    def release(self, tokens: int):
+        """Return `tokens` that were taken but not used."""
+
+        def give_back(levels: BucketLevels) -> Tuple[BucketLevels, float]:
+            levels = self._refill(levels)
+            new_tokens = min(self.token_capacity, levels.tokens + tokens)
+            return BucketLevels(levels.requests, new_tokens, levels.updated), 0.0
+
+        self._update(give_back)
+
+    def _refill(self, levels: BucketLevels) -> BucketLevels:
+        now = self._now()
+        elapsed = max(0.0, now - levels.updated)
+        return BucketLevels(
+            min(self.request_capacity, levels.requests + elapsed * self.request_rate),
+            min(self.token_capacity, levels.tokens + elapsed * self.token_rate),
+            now,
+        )
+
+    def _now(self) -> float:
+        # Processes only share the wall clock
+        return time.time() if self.state_path is not None else time.monotonic()
+
+    def _update(self, change) -> float:
+        with self._lock:
+            if self.state_path is None:
+                self._levels, result = change(self._levels)
+                return result
+            return self._update_file(change)
+
+    def _update_file(self, change) -> float:
+        import fcntl
+
+        with open(self.state_path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                data = f.read()
+                if data:
+                    levels = BucketLevels(*json.loads(data))
+                else:
+                    levels = BucketLevels(
+                        self.request_capacity, self.token_capacity, time.time()
+                    )
+                new_levels, result = change(levels)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(list(new_levels)))
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return result
+
+    def _add_wait(self, wait: float):
+        with self._lock:
+            self.waited += wait
+
+
+def get_unused_tokens(reserved_tokens: int, response: Dict[str, Any]) -> int:
+    usage = response.get("usage")
+    if not usage:
+        return 0
+    return max(0, reserved_tokens - usage["total_tokens"])
+
+
+def get_delta_content(chunk: Dict[str, Any]) -> str:
+    return "".join(
+        choice.get("delta", {}).get("content") or "" for choice in chunk["choices"]
+    )
+
+
+def get_unused_stream_tokens(request: Dict[str, Any], content: List[str]) -> int:
+    """Return the completion tokens reserved for a stream that it did not use.
+
+    Streamed completions do not report usage, so the content streamed is counted.
+    """
+    completion_tokens = get_tokenizer().count_tokens("".join(content), request["model"])
+    max_completion_tokens = request.get("max_tokens", 0) * request.get("n", 1)
+    return max(0, max_completion_tokens - completion_tokens)
+
+
+def release_after_stream(
+    limiter: RateLimiter, request: Dict[str, Any], stream: Iterable[Dict[str, Any]]
+) -> Iterator[Dict[str, Any]]:
+    """Pass on the chunks of `stream`, releasing its unused tokens when it ends.
+
+    The tokens are released when the stream is exhausted or closed early.
+    """
+    content: List[str] = []
+    try:
+        for chunk in stream:
+            content.append(get_delta_content(chunk))
+            yield chunk
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+        limiter.release(get_unused_stream_tokens(request, content))
+
+
+async def arelease_after_stream(
+    limiter: RateLimiter,
+    request: Dict[str, Any],
+    stream: AsyncIterable[Dict[str, Any]],
+) -> AsyncIterator[Dict[str, Any]]:
+    """Pass on the chunks of `stream`, releasing its unused tokens when it ends."""
+    content: List[str] = []
+    try:
+        async for chunk in stream:
+            content.append(get_delta_content(chunk))
+            yield chunk
+    finally:
+        aclose = getattr(stream, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        limiter.release(get_unused_stream_tokens(request, content))
+
+
+def init_rate_limited_chat_completion(
+    limiter: RateLimiter,
+    create: ChatCompletionFn = create_chat_completion,
+    retry_policy: RetryPolicy = RetryPolicy(),
+) -> ChatCompletionFn:
+    """Wrap `create` to wait for `limiter` and retry rejected calls."""
+
+    def create_rate_limited_chat_completion(**request: Any) -> Dict[str, Any]:
+        tokens = estimate_request_tokens(request)
+        for retry in range(retry_policy.max_retries + 1):
+            limiter.acquire(tokens)
+            try:
+                response = create(**request)
+            except Exception as error:
+                # A failed call completed nothing, so its tokens are given back
+                # rather than taken again by every retry
+                limiter.release(tokens)
+                if retry == retry_policy.max_retries or not is_retryable(error):
+                    raise
+                time.sleep(retry_policy.get_delay(retry, error))
+                continue
+            if request.get("stream"):
+                return release_after_stream(limiter, request, response)
+            limiter.release(get_unused_tokens(tokens, response))
+            return response
+        raise AssertionError("unreachable")
+
+    return create_rate_limited_chat_completion
+
+
+def init_async_rate_limited_chat_completion(
+    limiter: RateLimiter,
+    acreate: AsyncChatCompletionFn = acreate_chat_completion,
+    retry_policy: RetryPolicy = RetryPolicy(),
+) -> AsyncChatCompletionFn:
+    """Wrap `acreate` to wait for `limiter` and retry rejected calls."""
+
+    async def acreate_rate_limited_chat_completion(**request: Any) -> Dict[str, Any]:
+        tokens = estimate_request_tokens(request)
+        for retry in range(retry_policy.max_retries + 1):
+            await limiter.aacquire(tokens)
+            try:
+                response = await acreate(**request)
+            except Exception as error:
+                # A failed call completed nothing, so its tokens are given back
+                # rather than taken again by every retry
+                limiter.release(tokens)
+                if retry == retry_policy.max_retries or not is_retryable(error):
+                    raise
+                await asyncio.sleep(retry_policy.get_delay(retry, error))
+                continue
+            if request.get("stream"):
+                return arelease_after_stream(limiter, request, response)
+            limiter.release(get_unused_tokens(tokens, response))
+            return response
+        raise AssertionError("unreachable")
+
+    return acreate_rate_limited_chat_completion
@@ -0,0 +1,194 @@
+"""
+Share one API call between identical requests that are in flight at once.
+
+Agents started from the same state often send the same first request at the same
+moment. While a request is waiting on the API, identical requests wait for it
+rather than make calls of their own, and every caller receives its response, or
+its error:
+
+    single_flight = SingleFlight()
+    create = init_single_flight_chat_completion(single_flight)
+    components = [..., init_chat_completion_generator(create), ...]
+
+Unlike a cache, nothing is kept once the call returns. Note that requests sampled
+at a temperature above zero that coalesce share one sample rather than each getting
+their own. Streamed requests can only be read once, so they are never coalesced.
+All callers but one get a copy of the response with its usage marked as replayed,
+so that the call is only billed once.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Tuple, TypeVar
+
+from sembla.llm.openai.chat_completion import (
+    AsyncChatCompletionFn,
+    ChatCompletionFn,
+    acreate_chat_completion,
+    create_chat_completion,
+    get_request_key,
+    mark_replayed,
+)
+
+T = TypeVar("T")
+
+
+class SingleFlightInfo(NamedTuple):
+    """
+    The statistics of a single flight group.
+
+    Attributes:
+        calls: Requests that made a call.
+        coalesced: Requests that waited for the call of an identical request.
+        in_flight: Calls being made now.
+    """
+
+    calls: int
+    coalesced: int
+    in_flight: int
+
+
+class AsyncFlight:
+    """A call in flight on an event loop, and the number of callers waiting on it."""
+
+    def __init__(self, task: "asyncio.Task[Any]"):
+        self.task = task
+        self.callers = 1
+        self.claimed = False
+
+
+class SingleFlight:
+    """A group of calls, in which only one call with each key is made at a time."""
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._futures: Dict[str, "Future[Any]"] = {}
+        self._async_flights: Dict[
+            Tuple[asyncio.AbstractEventLoop, str], AsyncFlight
+        ] = {}
+
+    def do(
+        self,
+        key: str,
+        call: Callable[[], T],
+        share: Optional[Callable[[T], T]] = None,
+    ) -> T:
+        """Return the result of `call`, or of the call with `key` in flight.
+
+        `share` is applied to the result for each caller that waited for it.
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = self._futures[key] = Future()
+                self.calls += 1
+                leader = True
+        if not leader:
+            result = future.result()
+            return share(result) if share is not None else result
+        try:
+            result = call()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                del self._futures[key]
+        return result
+
+    async def ado(
+        self,
+        key: str,
+        acall: Callable[[], Awaitable[T]],
+        share: Optional[Callable[[T], T]] = None,
+    ) -> T:
+        """Return the result of `acall`, or of the call with `key` in flight.
+
+        The call runs as a task of its own, so that it carries on for the other
+        callers if the caller that started it is cancelled, and is only cancelled
+        once every caller is. The first caller to receive the result gets it as
+        is, and `share` is applied to it for the rest. Only calls made on the same
+        event loop are shared.
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (loop, key)
+        with self._lock:
+            flight = self._async_flights.get(flight_key)
+            if flight is not None:
+                self.coalesced += 1
+                flight.callers += 1
+            else:
+                flight = AsyncFlight(loop.create_task(acall()))
+                self._async_flights[flight_key] = flight
+                self.calls += 1
+                flight.task.add_done_callback(
+                    lambda task: self._end_async_flight(flight_key, task)
+                )
+        try:
+            # Shield the call, so that a caller being cancelled does not cancel it
+            result = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            with self._lock:
+                flight.callers -= 1
+                if flight.callers == 0:
+                    flight.task.cancel()
+            raise
+        with self._lock:
+            first = not flight.claimed
+            flight.claimed = True
+        return result if first or share is None else share(result)
+
+    def _end_async_flight(
+        self, flight_key: Tuple[asyncio.AbstractEventLoop, str], task: "asyncio.Task"
+    ):
+        with self._lock:
+            del self._async_flights[flight_key]
+        if not task.cancelled():
+            # Mark any error as retrieved, in case every caller was cancelled
+            task.exception()
+
+    def info(self) -> SingleFlightInfo:
+        with self._lock:
+            return SingleFlightInfo(
+                calls=self.calls,
+                coalesced=self.coalesced,
+                in_flight=len(self._futures) + len(self._async_flights),
+            )
+
+
+def init_single_flight_chat_completion(
+    single_flight: SingleFlight, create: ChatCompletionFn = create_chat_completion
+) -> ChatCompletionFn:
+    """Wrap `create` to share calls between identical requests in flight."""
+
+    def create_single_flight_chat_completion(**request: Any) -> Dict[str, Any]:
+        if request.get("stream"):
+            return create(**request)
+        return single_flight.do(
+            get_request_key(request), lambda: create(**request), mark_replayed
+        )
+
+    return create_single_flight_chat_completion
+
+
+def init_async_single_flight_chat_completion(
+    single_flight: SingleFlight,
+    acreate: AsyncChatCompletionFn = acreate_chat_completion,
+) -> AsyncChatCompletionFn:
+    """Wrap `acreate` to share calls between identical requests in flight."""
+
+    async def acreate_single_flight_chat_completion(**request: Any) -> Dict[str, Any]:
+        if request.get("stream"):
+            return await acreate(**request)
+        return await single_flight.ado(
+            get_request_key(request), lambda: acreate(**request), mark_replayed
+        )
+
+    return acreate_single_flight_chat_completion
@@ -0,0 +1,179 @@
+"""
+Stream chat completions, letting subscribers watch the response as it arrives.
+
+Each subscriber is called with the content received so far and the latest delta,
+and decides whether generation should go on. Subscribers may keep state about the
+stream, so a new set is made for every completion from the factories given:
+
+    generate_response = init_streaming_chat_completion_generator(
+        subscriber_factories=[init_json_stream_validator(ResponseSchema)]
+    )
+
+A subscriber can stop the stream once the response holds everything it needs, or
+abort it as soon as the response is clearly unusable. Either way the API call is
+closed early, so no more completion tokens are generated or waited for. An aborted
+response is recorded in the agent response as an error from that subscriber. A
+subscriber that parses the response can expose it as `parsed_response`, which is
+then kept in the agent response so that it is not parsed again.
+"""
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Protocol
+
+from sembla.conversation_history import get_prompt_token_count
+from sembla.llm.openai.chat_completion import (
+    AsyncChatCompletionFn,
+    ChatCompletionFn,
+    acreate_chat_completion,
+    create_chat_completion,
+    create_chat_completion_request,
+)
+from sembla.llm.tokenizer import get_tokenizer
+from sembla.schemas.system import (
+    AgentResponse,
+    ProcessingStatus,
+    ProcessorOutput,
+    SystemState,
+    TokenUsage,
+)
+from sembla.system import AsyncStateOperator, StateOperator
+
+
+class StreamDecision(Enum):
+    """What a stream subscriber wants done with the rest of the completion."""
+
+    CONTINUE = "CONTINUE"
+    STOP = "STOP"
+    ABORT = "ABORT"
+
+
+class StreamSubscriber(Protocol):
+    """Called with the content streamed so far and the newest part of it."""
+
+    def __call__(self, content: str, delta: str) -> StreamDecision:
+        ...
+
+
+StreamSubscriberFactory = Callable[[], StreamSubscriber]
+
+
+class StreamAccumulator:
+    """
+    Builds an agent response from a stream of completion chunks.
+
+    Attributes:
+        content: The content received so far.
+        decision: The last decision made by the subscribers.
+        decided_by: The name of the subscriber that stopped or aborted the stream.
+    """
+
+    def __init__(self, subscribers: List[StreamSubscriber]):
+        self.subscribers = subscribers
+        self.content = ""
+        self.decision = StreamDecision.CONTINUE
+        self.decided_by: Optional[str] = None
+
+    def feed(self, chunk: Dict[str, Any]) -> StreamDecision:
+        """Add the content of `chunk` and return whether to keep streaming."""
+        delta = chunk["choices"][0].get("delta", {}).get("content") or ""
+        if not delta:
+            return self.decision
+        self.content += delta
+        for subscriber in self.subscribers:
+            decision = subscriber(self.content, delta)
+            if decision != StreamDecision.CONTINUE:
+                self.decision = decision
+                self.decided_by = getattr(
+                    subscriber, "__name__", type(subscriber).__name__
+                )
+                break
+        return self.decision
+
+    def apply(self, system_state: SystemState) -> SystemState:
+        """Set the agent response of the state from the content streamed."""
+        # Streamed completions do not report usage, so count it
+        model_name = system_state.model.name
+        prompt_tokens = get_prompt_token_count(system_state.memory, model_name)
+        completion_tokens = get_tokenizer().count_tokens(self.content, model_name)
+        usage = TokenUsage.trusted(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+        processor_outputs = []
+        parsed_response = None
+        if self.decision != StreamDecision.ABORT:
+            parsed_response = next(
+                (
+                    subscriber.parsed_response
+                    for subscriber in self.subscribers
+                    if getattr(subscriber, "parsed_response", None) is not None
+                ),
+                None,
+            )
+        if self.decision == StreamDecision.ABORT:
+            processor_outputs.append(
+                ProcessorOutput.trusted(
+                    processor_name=self.decided_by,
+                    processing_status=ProcessingStatus.Error,
+                    data={"reason": "Completion aborted while streaming"},
+                )
+            )
+        agent_response = AgentResponse.trusted(
+            raw_response=self.content.strip(),
+            parsed_response=parsed_response,
+            processor_outputs=processor_outputs,
+            usage=usage,
+        )
+        return system_state.evolve(agent_response=agent_response)
+
+
+def init_streaming_chat_completion_generator(
+    subscriber_factories: List[StreamSubscriberFactory],
+    create: ChatCompletionFn = create_chat_completion,
+) -> StateOperator:
+    """Create an operator that streams the agent response to subscribers."""
+
+    def generate_streaming_chat_completion(system_state: SystemState) -> SystemState:
+        request = create_chat_completion_request(system_state)
+        accumulator = StreamAccumulator(
+            [make_subscriber() for make_subscriber in subscriber_factories]
+        )
+        stream = create(**request, stream=True)
+        try:
+            for chunk in stream:
+                if accumulator.feed(chunk) != StreamDecision.CONTINUE:
+                    break
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+        return accumulator.apply(system_state)
+
+    return generate_streaming_chat_completion
+
+
+def init_async_streaming_chat_completion_generator(
+    subscriber_factories: List[StreamSubscriberFactory],
+    acreate: AsyncChatCompletionFn = acreate_chat_completion,
+) -> AsyncStateOperator:
+    """Create an operator that streams the agent response to subscribers."""
+
+    async def agenerate_streaming_chat_completion(
+        system_state: SystemState,
+    ) -> SystemState:
+        request = create_chat_completion_request(system_state)
+        accumulator = StreamAccumulator(
+            [make_subscriber() for make_subscriber in subscriber_factories]
+        )
+        stream = await acreate(**request, stream=True)
+        try:
+            async for chunk in stream:
+                if accumulator.feed(chunk) != StreamDecision.CONTINUE:
+                    break
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        return accumulator.apply(system_state)
+
+    return agenerate_streaming_chat_completion
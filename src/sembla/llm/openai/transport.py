@@ -0,0 +1,151 @@
+"""
+A pooled, keep-alive HTTP transport for the OpenAI API.
+
+By default the openai library opens a session per thread with its default pool
+size, and a new aiohttp session, and so a new connection and TLS handshake, for
+every async request. A `Transport` shares one bounded pool of keep-alive
+connections between every call instead:
+
+    transport = Transport(pool_maxsize=32, timeout=(5, 120))
+    create = init_transport_chat_completion(transport)
+
+    async with transport.aiosession():
+        await arun_batch(...)
+
+The openai library sends requests with requests and aiohttp, neither of which
+speaks HTTP/2, so connections are HTTP/1.1 with keep-alive.
+"""
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Tuple, Union
+
+import aiohttp
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+
+from sembla.llm.openai.chat_completion import (
+    AsyncChatCompletionFn,
+    ChatCompletionFn,
+    acreate_chat_completion,
+    create_chat_completion,
+)
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class Transport:
+    """
+    A shared pool of keep-alive connections for API requests.
+
+    Args:
+        pool_connections: The number of hosts to keep connection pools for.
+        pool_maxsize: The most connections to keep open to each host.
+        pool_block: Wait for a free connection rather than open one beyond
+            `pool_maxsize` that is closed after use.
+        max_retries: The retries of requests that fail to connect.
+        timeout: The request timeout in seconds, or a (connect, read) pair.
+        keepalive_timeout: The seconds an idle async connection is kept open.
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = 4,
+        pool_maxsize: int = 32,
+        pool_block: bool = False,
+        max_retries: int = 2,
+        timeout: Timeout = (10, 600),
+        keepalive_timeout: float = 60,
+    ):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.keepalive_timeout = keepalive_timeout
+        self._session: Optional[requests.Session] = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """The session shared by all threads, created on first use."""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._make_session()
+        return self._session
+
+    def install(self):
+        """Send the openai library's sync requests through this transport.
+
+        The openai library keeps the session of each thread once it has made a
+        request, so install the transport before any requests are made.
+        """
+        openai.requestssession = self.session
+
+    @asynccontextmanager
+    async def aiosession(self) -> AsyncIterator[aiohttp.ClientSession]:
+        """Pool the openai library's async requests made within the block.
+
+        The session is closed when the block exits.
+        """
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_maxsize, keepalive_timeout=self.keepalive_timeout
+        )
+        async with aiohttp.ClientSession(connector=connector) as session:
+            token = openai.aiosession.set(session)
+            try:
+                yield session
+            finally:
+                openai.aiosession.reset(token)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+        if openai.requestssession is self._session:
+            openai.requestssession = None
+        self._session = None
+
+    def _make_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=self.max_retries,
+            pool_block=self.pool_block,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+
+def with_timeout(transport: Transport, request: Dict[str, Any]) -> Dict[str, Any]:
+    if "request_timeout" in request:
+        return request
+    return {**request, "request_timeout": transport.timeout}
+
+
+def init_transport_chat_completion(
+    transport: Transport, create: ChatCompletionFn = create_chat_completion
+) -> ChatCompletionFn:
+    """Wrap `create` to send requests through `transport`, with its timeout."""
+    transport.install()
+
+    def create_transport_chat_completion(**request: Any) -> Dict[str, Any]:
+        return create(**with_timeout(transport, request))
+
+    return create_transport_chat_completion
+
+
+def init_async_transport_chat_completion(
+    transport: Transport, acreate: AsyncChatCompletionFn = acreate_chat_completion
+) -> AsyncChatCompletionFn:
+    """Wrap `acreate` to use the timeout of `transport`.
+
+    Requests are only pooled when made within `transport.aiosession()`.
+    """
+
+    async def acreate_transport_chat_completion(**request: Any) -> Dict[str, Any]:
+        return await acreate(**with_timeout(transport, request))
+
+    return acreate_transport_chat_completion
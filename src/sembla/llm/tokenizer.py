@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Tuple
+
+import tiktoken
+
+from sembla.llm.models import find_model_spec
+
+DEFAULT_ENCODING_NAME = "cl100k_base"
+DEFAULT_MAX_CACHE_SIZE = 10_000
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    max_size: int
+    current_size: int
+
+
+def hash_content(content: str) -> bytes:
+    """Return a short digest of `content` for use as a cache key."""
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()
+
+
+def resolve_encoding(model_name: str) -> tiktoken.Encoding:
+    """Return the encoding of a registered model, or else tiktoken's for the model."""
+    model_spec = find_model_spec(model_name)
+    if model_spec is not None:
+        return tiktoken.get_encoding(model_spec.encoding_name)
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        logging.debug("Model not found. Using cl100k_base encoding.")
+        return tiktoken.get_encoding(DEFAULT_ENCODING_NAME)
+
+
+class Tokenizer:
+    """
+    Resolves model encodings once and memoizes token counts by content hash.
+
+    Attributes:
+        max_cache_size: The maximum number of token counts to keep.
+        hits: The number of counts served from the cache.
+        misses: The number of counts that required encoding.
+    """
+
+    def __init__(self, max_cache_size: int = DEFAULT_MAX_CACHE_SIZE):
+        self.max_cache_size = max_cache_size
+        self.hits = 0
+        self.misses = 0
+        self._encodings: Dict[str, tiktoken.Encoding] = {}
+        self._cache: "OrderedDict[Tuple[str, bytes], int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register_encoding(self, model_name: str, encoding: tiktoken.Encoding):
+        """Use `encoding` for `model_name` instead of resolving it with tiktoken."""
+        with self._lock:
+            self._encodings[model_name] = encoding
+
+    def get_encoding(self, model_name: str) -> tiktoken.Encoding:
+        """Return the encoding for `model_name`, resolving it on first use."""
+        encoding = self._encodings.get(model_name)
+        if encoding is None:
+            encoding = resolve_encoding(model_name)
+            with self._lock:
+                encoding = self._encodings.setdefault(model_name, encoding)
+        return encoding
+
+    def encode(self, content: str, model_name: str) -> List[int]:
+        """Encode `content` with the encoding for `model_name`."""
+        return self.get_encoding(model_name).encode(content)
+
+    def truncate(self, content: str, max_tokens: int, model_name: str) -> str:
+        """Truncate `content` to at most `max_tokens` tokens."""
+        encoding = self.get_encoding(model_name)
+        tokens = encoding.encode(content)
+        if len(tokens) <= max_tokens:
+            return content
+        return encoding.decode(tokens[:max_tokens])
+
+    def count_tokens(self, content: str, model_name: str) -> int:
+        """Return the number of tokens in `content`, memoized by content hash."""
+        encoding = self.get_encoding(model_name)
+        key = (encoding.name, hash_content(content))
+        with self._lock:
+            num_tokens = self._cache.get(key)
+            if num_tokens is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return num_tokens
+            self.misses += 1
+        num_tokens = len(encoding.encode(content))
+        self._store(key, num_tokens)
+        return num_tokens
+
+    def count_tokens_batch(
+        self, contents: List[str], model_name: str, num_threads: int = 8
+    ) -> List[int]:
+        """Return the number of tokens in each of `contents`.
+
+        Cached counts are reused, and the remaining distinct contents are encoded
+        together with tiktoken's batch encoder across `num_threads` threads.
+        """
+        encoding = self.get_encoding(model_name)
+        keys = [(encoding.name, hash_content(content)) for content in contents]
+        counts: Dict[Tuple[str, bytes], int] = {}
+        missing: Dict[Tuple[str, bytes], str] = {}
+        with self._lock:
+            for key, content in zip(keys, contents):
+                num_tokens = self._cache.get(key)
+                if num_tokens is not None:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    counts[key] = num_tokens
+                elif key in missing:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                    missing[key] = content
+        if missing:
+            encoded = encoding.encode_batch(
+                list(missing.values()), num_threads=num_threads
+            )
+            for key, tokens in zip(missing, encoded):
+                counts[key] = len(tokens)
+                self._store(key, len(tokens))
+        return [counts[key] for key in keys]
+
+    def cache_info(self) -> CacheInfo:
+        """Report cache statistics, in the style of `functools.lru_cache`."""
+        with self._lock:
+            return CacheInfo(
+                self.hits, self.misses, self.max_cache_size, len(self._cache)
+            )
+
+    def clear_cache(self):
+        """Clear memoized token counts and reset the statistics."""
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _store(self, key: Tuple[str, bytes], num_tokens: int):
+        with self._lock:
+            self._cache[key] = num_tokens
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cache_size:
+                self._cache.popitem(last=False)
+
+
+_tokenizer = Tokenizer()
+
+
+def get_tokenizer() -> Tokenizer:
+    """Return the process-wide tokenizer."""
+    return _tokenizer
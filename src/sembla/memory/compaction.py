@@ -0,0 +1,137 @@
+"""
+Compaction folds messages evicted from the conversation history into a rolling
+summary, so that long running agents keep the gist of what they have done.
+
+A `SummarizingCompactor` is an eviction handler, used with
+`init_conversation_history_manager`:
+
+    summarize = init_chat_completion_summarizer(create)
+    manage_memory = init_conversation_history_manager(
+        eviction_handlers=[SummarizingCompactor(summarize)]
+    )
+
+The tokens and cost of each summary are added to the task, so they count against
+its budget like the agent's own completions.
+"""
+from typing import List, NamedTuple, Optional, Protocol
+
+from sembla.budget import add_completion_usage
+from sembla.conversation_history import with_token_count
+from sembla.llm.openai.chat_completion import ChatCompletionFn
+from sembla.llm.tokenizer import get_tokenizer
+from sembla.schemas.system import Message, SystemState, TokenUsage
+
+SUMMARY_INSTRUCTIONS = """\
+Summarise the conversation below for an assistant that can no longer see it.
+Keep the facts, decisions and outcomes needed to continue the task.
+Be concise."""
+
+
+class Summary(NamedTuple):
+    """
+    A summary made by a summarizer.
+
+    Attributes:
+        content: The text of the summary.
+        model_name: The model that wrote the summary, if one did.
+        usage: The tokens the model was billed for the summary.
+    """
+
+    content: str
+    model_name: Optional[str] = None
+    usage: Optional[TokenUsage] = None
+
+
+class Summarizer(Protocol):
+    """A callable that folds `messages` into the `previous_summary`."""
+
+    def __call__(
+        self, previous_summary: Optional[str], messages: List[Message]
+    ) -> Summary:
+        ...
+
+
+class SummarizingCompactor:
+    """
+    Folds evicted messages into a rolling summary message.
+
+    Evicted messages are collected in the memory's compaction buffer and only
+    summarized once `batch_size` of them have accumulated, so that the summarizer
+    runs once per batch rather than once per eviction. The summary is truncated to
+    `max_summary_tokens` tokens.
+    """
+
+    def __init__(
+        self,
+        summarize: Summarizer,
+        batch_size: int = 10,
+        max_summary_tokens: int = 256,
+    ):
+        self.summarize = summarize
+        self.batch_size = batch_size
+        self.max_summary_tokens = max_summary_tokens
+
+    def __call__(
+        self, system_state: SystemState, evicted_messages: List[Message]
+    ) -> SystemState:
+        memory = system_state.memory
+        compaction_buffer = memory.compaction_buffer + evicted_messages
+        if len(compaction_buffer) < self.batch_size:
+            new_memory = memory.evolve(compaction_buffer=compaction_buffer)
+            return system_state.evolve(memory=new_memory)
+
+        model_name = system_state.model.name
+        previous_summary = memory.summary.content if memory.summary else None
+        summary = self.summarize(previous_summary, compaction_buffer)
+        content = get_tokenizer().truncate(
+            summary.content, self.max_summary_tokens, model_name
+        )
+        summary_message = with_token_count(
+            Message.trusted(role="system", content=content), model_name
+        )
+        new_memory = memory.evolve(summary=summary_message, compaction_buffer=[])
+        task = system_state.task
+        if summary.usage is not None:
+            task = add_completion_usage(
+                task, summary.model_name or model_name, summary.usage
+            )
+        return system_state.evolve(memory=new_memory, task=task)
+
+
+def format_messages(messages: List[Message]) -> str:
+    return "\n".join(f"{message.role}: {message.content}" for message in messages)
+
+
+def init_chat_completion_summarizer(
+    create: ChatCompletionFn,
+    model_name: str = "gpt-3.5-turbo",
+    max_tokens: int = 256,
+    temperature: float = 0,
+) -> Summarizer:
+    """Create a summarizer that asks a chat model to update the summary.
+
+    Pass the same `create` as the agent's own completions, so that summaries go
+    through the same transport, rate limiter and cache.
+    """
+
+    def summarize(previous_summary: Optional[str], messages: List[Message]) -> Summary:
+        conversation = format_messages(messages)
+        if previous_summary:
+            conversation = f"Summary so far:\n{previous_summary}\n\n{conversation}"
+        response = create(
+            model=model_name,
+            messages=[
+                {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                {"role": "user", "content": conversation},
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        usage = response.get("usage")
+        return Summary(
+            content=response["choices"][0]["message"]["content"].strip(),
+            model_name=model_name,
+            usage=TokenUsage(**usage) if usage else None,
+        )
+
+    return summarize
@@ -0,0 +1,268 @@
+from heapq import merge
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+M = TypeVar("M")
+
+
+def is_system_message(message: Any) -> bool:
+    """Return True if `message` was authored by the system."""
+    role = message["role"] if isinstance(message, dict) else message.role
+    return role == "system"
+
+
+class _Node(Generic[M]):
+    """A link in the append-only chain of evictable messages."""
+
+    __slots__ = ("position", "message", "next")
+
+    def __init__(self, position: int, message: M):
+        self.position = position
+        self.message = message
+        self.next: Optional[_Node[M]] = None
+
+
+class MessageHistory(Generic[M]):
+    """
+    A conversation history that keeps pinned messages apart from evictable ones.
+
+    Pinned messages (system messages by default) are never evicted. All other
+    messages are held in an append-only linked chain, and a history is a window
+    onto that chain. Evicting the earliest message moves the start of the window,
+    and appending links a new node after its end, so both take constant time.
+
+    Copies share the chain with the history they were copied from, so `copy` is
+    also constant time. Changing a copy never changes the original: the original's
+    window does not cover nodes appended by the copy, and if both append, the
+    second to do so copies its window onto a new chain. The ordered view of the
+    history is only built when it is read, and is cached until the history changes.
+
+    Works with `Message` schemas as well as plain `{"role": ..., "content": ...}`
+    dictionaries.
+    """
+
+    def __init__(
+        self,
+        messages: Iterable[M] = (),
+        is_pinned: Callable[[M], bool] = is_system_message,
+    ):
+        self._is_pinned = is_pinned
+        self._pinned: Tuple[Tuple[int, M], ...] = ()
+        self._head: Optional[_Node[M]] = None
+        self._tail: Optional[_Node[M]] = None
+        self._evictable_count = 0
+        self._next_position = 0
+        self._messages: Optional[List[M]] = None
+        self.extend(messages)
+
+    @property
+    def messages(self) -> List[M]:
+        """The messages in the order they were added."""
+        if self._messages is None:
+            evictable = ((node.position, node.message) for node in self._iter_nodes())
+            self._messages = [
+                message for _, message in merge(self._pinned, evictable, key=_position)
+            ]
+        return self._messages
+
+    @property
+    def pinned(self) -> List[M]:
+        """The messages that are never evicted."""
+        return [message for _, message in self._pinned]
+
+    @property
+    def evictable(self) -> List[M]:
+        """The messages that may be evicted, earliest first."""
+        return [node.message for node in self._iter_nodes()]
+
+    @property
+    def evictable_count(self) -> int:
+        return self._evictable_count
+
+    @property
+    def next_position(self) -> int:
+        """The position that the next message appended will take."""
+        return self._next_position
+
+    @property
+    def first_position(self) -> int:
+        """The position of the earliest evictable message, if there is one."""
+        if self._head is None:
+            return self._next_position
+        return self._head.position
+
+    def entries_since(self, position: int) -> List[Tuple[int, M]]:
+        """Return the messages at or after `position`, with their positions."""
+        pinned = [entry for entry in self._pinned if entry[0] >= position]
+        evictable = [
+            (node.position, node.message)
+            for node in self._iter_nodes()
+            if node.position >= position
+        ]
+        return list(merge(pinned, evictable, key=_position))
+
+    def entries_after(self, other: "MessageHistory[M]") -> List[Tuple[int, M]]:
+        """Return the messages added since `other`, which the history extends.
+
+        Only the nodes appended after the end of `other` are walked, so this takes
+        the same time however long the history is.
+        """
+        pinned = list(self._pinned[len(other._pinned) :])
+        if self._tail is None or other._tail is self._tail:
+            evictable = []
+        else:
+            start = self._head
+            if other._tail is not None and other._tail.position >= start.position:
+                start = other._tail.next
+            evictable = [
+                (node.position, node.message) for node in self._iter_nodes(start)
+            ]
+        return list(merge(pinned, evictable, key=_position))
+
+    def extends(self, other: "MessageHistory[M]") -> bool:
+        """Return True if the history is `other` with messages added or evicted.
+
+        The evictable messages of `other` that are left must be the same nodes of
+        the chain, so the check only walks the nodes appended since `other`.
+        """
+        if (
+            self._next_position < other._next_position
+            or self.first_position < other.first_position
+        ):
+            return False
+        pinned = self._pinned[: len(other._pinned)]
+        if len(pinned) < len(other._pinned) or any(
+            entry[1] is not other_entry[1]
+            for entry, other_entry in zip(pinned, other._pinned)
+        ):
+            return False
+        if other._tail is None:
+            return self.first_position >= other._next_position
+        if self._tail is None:
+            return True
+        node: Optional[_Node[M]] = other._tail
+        while node is not None and node.position < self._tail.position:
+            node = node.next
+        return node is self._tail
+
+    def advance_to(self, position: int):
+        """Skip positions up to `position`, as if messages had been added and evicted.
+
+        Used to rebuild a history with the positions of the one it was saved from.
+        """
+        if position < self._next_position:
+            raise ValueError(
+                f"Cannot move back from position {self._next_position} to {position}"
+            )
+        self._next_position = position
+
+    def append(self, message: M):
+        position = self._next_position
+        self._next_position += 1
+        self._messages = None
+        if self._is_pinned(message):
+            self._pinned = self._pinned + ((position, message),)
+            return
+        node = _Node(position, message)
+        if self._tail is None:
+            self._head = node
+        else:
+            if self._tail.next is not None:
+                # Another history sharing this chain has already appended to it
+                self._branch()
+            self._tail.next = node
+        self._tail = node
+        self._evictable_count += 1
+
+    def extend(self, messages: Iterable[M]):
+        for message in messages:
+            self.append(message)
+
+    def evict(self) -> Optional[M]:
+        """Remove and return the earliest evictable message, if there is one."""
+        if self._head is None:
+            return None
+        node = self._head
+        if node is self._tail:
+            self._head = self._tail = None
+        else:
+            self._head = node.next
+        self._evictable_count -= 1
+        self._messages = None
+        return node.message
+
+    def copy(self) -> "MessageHistory[M]":
+        """Return a copy of the history that shares its messages."""
+        new_history: MessageHistory[M] = self.__class__.__new__(self.__class__)
+        new_history.__dict__.update(self.__dict__)
+        return new_history
+
+    def _iter_nodes(self, node: Optional[_Node[M]] = None) -> Iterator[_Node[M]]:
+        """Yield the nodes of the window from `node`, or from its start."""
+        if self._tail is None:
+            return
+        node = self._head if node is None else node
+        while node is not self._tail:
+            yield node
+            node = node.next
+        yield node
+
+    def _branch(self):
+        """Copy the window onto a new chain, so that it can be appended to."""
+        head = tail = None
+        for node in self._iter_nodes():
+            new_node = _Node(node.position, node.message)
+            if tail is None:
+                head = new_node
+            else:
+                tail.next = new_node
+            tail = new_node
+        self._head, self._tail = head, tail
+
+    def __len__(self) -> int:
+        return len(self._pinned) + self._evictable_count
+
+    def __iter__(self) -> Iterator[M]:
+        return iter(self.messages)
+
+    def __getitem__(self, index):
+        return self.messages[index]
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, MessageHistory):
+            return self.messages == other.messages
+        if isinstance(other, list):
+            return self.messages == other
+        return NotImplemented
+
+    def __reduce__(self):
+        # Rebuild from the ordered messages rather than recursing down the chain
+        return (self.__class__, (self.messages, self._is_pinned))
+
+    def __repr__(self) -> str:
+        return f"MessageHistory({self.messages!r})"
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def validate(cls, value: Any) -> "MessageHistory":
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, (list, tuple)):
+            return cls(value)
+        raise TypeError(f"Cannot convert {type(value).__name__} to MessageHistory")
+
+
+def _position(entry: Tuple[int, Any]) -> int:
+    return entry[0]
@@ -0,0 +1,171 @@
+"""
+Lexical recall of messages that have been evicted from the conversation history.
+
+Evicted messages are added to an in-process BM25 index by an eviction handler,
+and a prompt processor re-injects the most relevant of them as a single system
+message before each response:
+
+    recall_index = RecallIndex()
+    manage_memory = init_conversation_history_manager(
+        eviction_handlers=[init_recall_indexer(recall_index)]
+    )
+    recall_messages = init_recall_processor(recall_index, k=5)
+"""
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from sembla.conversation_history import EvictionHandler, with_token_count
+from sembla.llm.tokenizer import get_tokenizer
+from sembla.schemas.system import Message, SystemState
+from sembla.system import StateOperator
+
+WORD_PATTERN = re.compile(r"\w+")
+
+RECALL_HEADER = "Relevant messages from earlier in the conversation:"
+
+
+def tokenize(text: str) -> List[str]:
+    return WORD_PATTERN.findall(text.lower())
+
+
+class RecallIndex:
+    """
+    An incremental BM25 index over messages.
+
+    Each term maps to a postings dictionary of `{document id: term frequency}`,
+    so a query only visits the documents that contain its terms. Terms that appear
+    in more than `max_document_frequency` of the documents carry little weight and
+    are skipped, unless the query has no other matching terms.
+    """
+
+    def __init__(
+        self, k1: float = 1.2, b: float = 0.75, max_document_frequency: float = 0.5
+    ):
+        self.k1 = k1
+        self.b = b
+        self.max_document_frequency = max_document_frequency
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._document_lengths: List[int] = []
+        self._messages: List[Message] = []
+        self._total_length = 0
+
+    def add(self, message: Message) -> int:
+        """Add `message` to the index and return its document id."""
+        document_id = len(self._messages)
+        terms = tokenize(message.content)
+        for term, frequency in Counter(terms).items():
+            self._postings.setdefault(term, {})[document_id] = frequency
+        self._messages.append(message)
+        self._document_lengths.append(len(terms))
+        self._total_length += len(terms)
+        return document_id
+
+    def extend(self, messages: List[Message]):
+        for message in messages:
+            self.add(message)
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[float, Message]]:
+        """Return the `k` best matching messages for `query`, best first."""
+        document_count = len(self._messages)
+        if not document_count:
+            return []
+        average_length = self._total_length / document_count
+        max_postings = max(1, int(self.max_document_frequency * document_count))
+        document_lengths = self._document_lengths
+        k1 = self.k1
+        length_weight = k1 * self.b / average_length if average_length else 0.0
+        base_weight = k1 * (1 - self.b)
+
+        query_postings = [
+            postings
+            for postings in map(self._postings.get, set(tokenize(query)))
+            if postings
+        ]
+        selective_postings = [
+            postings for postings in query_postings if len(postings) <= max_postings
+        ]
+        scores: Dict[int, float] = {}
+        for postings in selective_postings or query_postings:
+            document_frequency = len(postings)
+            idf = math.log(
+                1
+                + (document_count - document_frequency + 0.5)
+                / (document_frequency + 0.5)
+            )
+            for document_id, frequency in postings.items():
+                norm = base_weight + length_weight * document_lengths[document_id]
+                score = idf * frequency * (k1 + 1) / (frequency + norm)
+                scores[document_id] = scores.get(document_id, 0.0) + score
+
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(score, self._messages[document_id]) for document_id, score in best]
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+
+def init_recall_indexer(recall_index: RecallIndex) -> EvictionHandler:
+    """Create an eviction handler that adds evicted messages to `recall_index`."""
+
+    def index_evicted_messages(
+        system_state: SystemState, evicted_messages: List[Message]
+    ) -> SystemState:
+        recall_index.extend(evicted_messages)
+        return system_state
+
+    return index_evicted_messages
+
+
+def init_recall_processor(
+    recall_index: RecallIndex, k: int = 5, max_recall_tokens: int = 512
+) -> StateOperator:
+    """
+    Create a prompt processor that recalls the messages most relevant to the query.
+
+    The recalled messages are joined into a single system message, which is sent
+    with the prompt and kept within `max_recall_tokens` tokens.
+    """
+
+    def recall_relevant_messages(system_state: SystemState) -> SystemState:
+        model_name = system_state.model.name
+        tokenizer = get_tokenizer()
+        recall = None
+        query = get_recall_query(system_state)
+        if query:
+            header = with_token_count(
+                Message.trusted(role="system", content=RECALL_HEADER), model_name
+            )
+            lines = [RECALL_HEADER]
+            token_count = header.token_count
+            for _, message in recall_index.search(query, k):
+                line = f"{message.role}: {message.content}"
+                # One more token for the newline joining the lines
+                line_token_count = tokenizer.count_tokens(line, model_name) + 1
+                if token_count + line_token_count > max_recall_tokens:
+                    continue
+                lines.append(line)
+                token_count += line_token_count
+            if len(lines) > 1:
+                recall = with_token_count(
+                    Message.trusted(role="system", content="\n".join(lines)), model_name
+                )
+        new_memory = system_state.memory.evolve(recall=recall)
+        return system_state.evolve(memory=new_memory)
+
+    return recall_relevant_messages
+
+
+def get_recall_query(system_state: SystemState) -> Optional[str]:
+    """Return the text to search for: the user query or the latest message."""
+    user_query = system_state.user_query
+    if user_query is not None:
+        return user_query.processed_query or user_query.raw_query
+    memory = system_state.memory
+    for messages in (memory.conversation_buffer, memory.conversation_history.messages):
+        for message in reversed(messages):
+            if message.role != "system":
+                return message.content
+    return None
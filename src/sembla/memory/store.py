@@ -0,0 +1,230 @@
+"""
+An append-only, on-disk log of conversation messages.
+
+Each record is a fixed size header followed by the message as JSON:
+
+    <length: uint32> <flags: uint8> <message json: length bytes>
+
+Besides the messages of the conversation history, the log records every new
+version of the memory's summary and recall, so that they are restored with it.
+The log is memory-mapped for reads, so that only the records that are read are
+paged in. A torn record at the end of the log, left by a crash mid-write, is
+discarded when the log is opened.
+"""
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from sembla.conversation_history import (
+    REPLY_PRIMING_TOKENS,
+    get_history_token_budget,
+    get_reserved_token_count,
+    with_token_count,
+)
+from sembla.memory.history import MessageHistory, is_system_message
+from sembla.schemas.system import MemoryState, Message, SystemState
+
+HEADER = struct.Struct("<IB")
+PINNED_FLAG = 1
+SUMMARY_FLAG = 2
+RECALL_FLAG = 4
+MEMORY_MESSAGE_FLAGS = {"summary": SUMMARY_FLAG, "recall": RECALL_FLAG}
+
+
+class MessageLog:
+    """
+    An append-only log of messages, addressed by byte offset.
+
+    Attributes:
+        path: The path of the log file.
+        offsets: The offset of every history message in the log.
+        pinned_offsets: The offsets of records holding pinned (system) messages.
+        memory_message_offsets: The offset of the latest record of each memory
+            message, such as the summary, by the name of its `MemoryState` field.
+    """
+
+    def __init__(self, path: Union[str, Path], fsync: bool = False):
+        self.path = Path(path)
+        self.fsync = fsync
+        self.offsets: List[int] = []
+        self.pinned_offsets: List[int] = []
+        self.memory_message_offsets: Dict[str, int] = {}
+        self._memory_messages: Dict[str, Message] = {}
+        self._file = open(self.path, "a+b")
+        self._mmap: Optional[mmap.mmap] = None
+        self._size = 0
+        self._recover()
+
+    @property
+    def size(self) -> int:
+        """The offset at which the next record will be written."""
+        return self._size
+
+    def append(self, message: Message) -> int:
+        """Append `message` to the log and return its offset."""
+        flags = PINNED_FLAG if is_system_message(message) else 0
+        offset = self._write(message, flags)
+        self.offsets.append(offset)
+        if flags & PINNED_FLAG:
+            self.pinned_offsets.append(offset)
+        return offset
+
+    def save_memory_message(self, name: str, message: Message) -> Optional[int]:
+        """Record `message` as the latest `summary` or `recall` of the memory.
+
+        Returns the offset of the record, or None if `message` was already the
+        latest and so was not written again.
+        """
+        if self._memory_messages.get(name) == message:
+            return None
+        offset = self._write(message, MEMORY_MESSAGE_FLAGS[name])
+        self.memory_message_offsets[name] = offset
+        self._memory_messages[name] = message
+        return offset
+
+    def read_memory_message(self, name: str) -> Optional[Message]:
+        """Read the latest `summary` or `recall` recorded in the log, if any."""
+        if name not in self._memory_messages:
+            offset = self.memory_message_offsets.get(name)
+            if offset is None:
+                return None
+            self._memory_messages[name] = self.read(offset)
+        return self._memory_messages[name]
+
+    def extend(self, messages: List[Message]) -> List[int]:
+        return [self.append(message) for message in messages]
+
+    def read(self, offset: int) -> Message:
+        """Read the message recorded at `offset`."""
+        buffer = self._get_mmap()
+        length, _ = HEADER.unpack_from(buffer, offset)
+        start = offset + HEADER.size
+        return Message.parse_raw(buffer[start : start + length])
+
+    def iter_from(self, offset: int = 0) -> Iterator[Tuple[int, Message]]:
+        """Iterate over the `(offset, message)` pairs of history messages."""
+        while offset < self._size:
+            length, flags = HEADER.unpack_from(self._get_mmap(), offset)
+            if not flags & (SUMMARY_FLAG | RECALL_FLAG):
+                yield offset, self.read(offset)
+            offset += HEADER.size + length
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __enter__(self) -> "MessageLog":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write(self, message: Message, flags: int) -> int:
+        data = message.json().encode("utf-8")
+        offset = self._size
+        self._file.write(HEADER.pack(len(data), flags) + data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._size += HEADER.size + len(data)
+        return offset
+
+    def _get_mmap(self) -> mmap.mmap:
+        # Remap when records have been appended since the log was last mapped
+        if self._mmap is None or len(self._mmap) < self._size:
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def _recover(self):
+        """Index the records in the log and drop a torn record at the end."""
+        file_size = os.fstat(self._file.fileno()).st_size
+        if file_size == 0:
+            return
+        self._size = file_size
+        buffer = self._get_mmap()
+        offset = 0
+        while offset + HEADER.size <= file_size:
+            length, flags = HEADER.unpack_from(buffer, offset)
+            if offset + HEADER.size + length > file_size:
+                break
+            for name, memory_flag in MEMORY_MESSAGE_FLAGS.items():
+                if flags & memory_flag:
+                    self.memory_message_offsets[name] = offset
+            if not flags & (SUMMARY_FLAG | RECALL_FLAG):
+                self.offsets.append(offset)
+                if flags & PINNED_FLAG:
+                    self.pinned_offsets.append(offset)
+            offset += HEADER.size + length
+        if offset < file_size:
+            self._mmap.close()
+            self._mmap = None
+            self._file.truncate(offset)
+        self._size = offset
+
+
+def load_memory_state(
+    message_log: MessageLog, system_state: SystemState
+) -> MemoryState:
+    """Restore the memory of `system_state` from `message_log`.
+
+    The latest summary and recall, and every pinned message, are restored. The
+    remaining messages are read from the end of the log until the history limits
+    are reached, leaving room for the summary and recall as the live history does,
+    so only the messages that are kept are read from disk.
+    """
+    model_name = system_state.model.name
+    memory = system_state.memory.evolve(
+        **{
+            name: read_memory_message(message_log, name, model_name)
+            for name in MEMORY_MESSAGE_FLAGS
+        }
+    )
+    pinned = [
+        (offset, with_token_count(message_log.read(offset), model_name))
+        for offset in message_log.pinned_offsets
+    ]
+    token_count = REPLY_PRIMING_TOKENS + sum(m.token_count for _, m in pinned)
+    max_token_count = get_history_token_budget(
+        system_state.evolve(memory=memory)
+    ) - get_reserved_token_count(memory)
+    message_count = len(pinned)
+
+    pinned_offsets = set(message_log.pinned_offsets)
+    recent: List[Tuple[int, Message]] = []
+    for offset in reversed(message_log.offsets):
+        if offset in pinned_offsets:
+            continue
+        if message_count >= memory.max_history_message_count:
+            break
+        message = with_token_count(message_log.read(offset), model_name)
+        if token_count + message.token_count > max_token_count:
+            break
+        recent.append((offset, message))
+        token_count += message.token_count
+        message_count += 1
+
+    entries = sorted(pinned + recent, key=lambda entry: entry[0])
+    conversation_history = MessageHistory(message for _, message in entries)
+    return memory.evolve(
+        conversation_history=conversation_history,
+        conversation_buffer=[],
+        message_count=len(conversation_history),
+        token_count=token_count,
+        log_offset=message_log.size,
+    )
+
+
+def read_memory_message(
+    message_log: MessageLog, name: str, model_name: str
+) -> Optional[Message]:
+    message = message_log.read_memory_message(name)
+    return with_token_count(message, model_name) if message is not None else None
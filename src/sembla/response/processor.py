@@ -1,7 +1,11 @@
 import json
 from typing import Any, Dict, Type, TypeVar
 
+from pydantic import ValidationError
+
+from sembla.actions.registry import get_action_registry
 from sembla.schemas.base import BaseSchema
+from sembla.schemas.system import ProcessingStatus, ProcessorOutput, SystemState
 
 T = TypeVar("T", bound=BaseSchema)
 
@@ -9,3 +13,72 @@ T = TypeVar("T", bound=BaseSchema)
 def parse_json_response(response: str, schema: T) -> T:
     """Parse `response` as JSON and validate it against `schema`."""
     return schema.parse_raw(response)
+
+
+def add_processor_output(
+    system_state: SystemState, processor_output: ProcessorOutput
+) -> SystemState:
+    agent_response = system_state.agent_response
+    processor_outputs = [*agent_response.processor_outputs, processor_output]
+    return system_state.evolve(
+        agent_response=agent_response.evolve(processor_outputs=processor_outputs)
+    )
+
+
+def has_processing_error(system_state: SystemState) -> bool:
+    """Check if any processor failed on the agent response of the state."""
+    if system_state.agent_response is None:
+        return False
+    return any(
+        output.processing_status == ProcessingStatus.Error
+        for output in system_state.agent_response.processor_outputs
+    )
+
+
+def process_json_response(system_state: SystemState) -> SystemState:
+    """Parse the agent response against the response schema of the state.
+
+    A response that does not parse is recorded as an error of this processor. A
+    response that was already parsed, such as while it was streamed, is kept.
+    """
+    schema = system_state.response_schema
+    agent_response = system_state.agent_response
+    if schema is None or agent_response is None:
+        return system_state
+    if isinstance(agent_response.parsed_response, schema):
+        return system_state
+    try:
+        parsed_response = parse_json_response(agent_response.raw_response, schema)
+    except (ValidationError, ValueError) as e:
+        return add_processor_output(
+            system_state,
+            ProcessorOutput.trusted(
+                processor_name="process_json_response",
+                processing_status=ProcessingStatus.Error,
+                data={"reason": f"{type(e).__name__}: {e}"},
+            ),
+        )
+    return system_state.evolve(
+        agent_response=agent_response.evolve(parsed_response=parsed_response)
+    )
+
+
+def validate_action_call(system_state: SystemState) -> SystemState:
+    """Check that the action called by the parsed response is available.
+
+    A call of an unknown action is recorded as an error of this processor.
+    """
+    agent_response = system_state.agent_response
+    if agent_response is None or agent_response.parsed_response is None:
+        return system_state
+    action_call = agent_response.parsed_response.action
+    if get_action_registry(system_state.actions).get(action_call.name) is not None:
+        return system_state
+    return add_processor_output(
+        system_state,
+        ProcessorOutput.trusted(
+            processor_name="validate_action_call",
+            processing_status=ProcessingStatus.Error,
+            data={"reason": f"Action not available: {action_call.name}"},
+        ),
+    )
@@ -0,0 +1,83 @@
+"""
+Stream subscribers that check a response while it is being generated.
+"""
+from typing import List, Optional, Type
+
+from pydantic import ValidationError
+
+from sembla.llm.openai.streaming import (
+    StreamDecision,
+    StreamSubscriber,
+    StreamSubscriberFactory,
+)
+from sembla.response.processor import parse_json_response
+from sembla.schemas.base import BaseSchema
+
+CLOSING_BRACKETS = {"}": "{", "]": "["}
+
+
+class JSONStreamValidator:
+    """
+    Checks that a streamed response is a JSON object matching `schema`.
+
+    The structure of the JSON is followed as each delta arrives, so a response that
+    does not start with an object or closes the wrong bracket is aborted at once.
+    When the object is closed it is validated against `schema`, and the stream is
+    stopped if it is valid, since nothing after it is needed, or aborted if not.
+
+    Attributes:
+        parsed_response: The response parsed when the object was closed, if valid.
+    """
+
+    def __init__(self, schema: Type[BaseSchema]):
+        self.schema = schema
+        self.parsed_response: Optional[BaseSchema] = None
+        self._start: Optional[int] = None
+        self._position = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escaped = False
+
+    def __call__(self, content: str, delta: str) -> StreamDecision:
+        for char in delta:
+            position = self._position
+            self._position += 1
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif self._start is None:
+                if char == "{":
+                    self._start = position
+                    self._stack.append(char)
+                elif not char.isspace():
+                    return StreamDecision.ABORT
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._stack.append(char)
+            elif char in CLOSING_BRACKETS:
+                if self._stack.pop() != CLOSING_BRACKETS[char]:
+                    return StreamDecision.ABORT
+                if not self._stack:
+                    return self._validate(content[self._start : position + 1])
+        return StreamDecision.CONTINUE
+
+    def _validate(self, json_content: str) -> StreamDecision:
+        try:
+            self.parsed_response = parse_json_response(json_content, self.schema)
+        except (ValidationError, ValueError):
+            return StreamDecision.ABORT
+        return StreamDecision.STOP
+
+
+def init_json_stream_validator(schema: Type[BaseSchema]) -> StreamSubscriberFactory:
+    """Create a factory of validators of streamed `schema` responses."""
+
+    def make_json_stream_validator() -> StreamSubscriber:
+        return JSONStreamValidator(schema)
+
+    return make_json_stream_validator
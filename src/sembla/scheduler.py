@@ -0,0 +1,190 @@
+"""
+Run the components of an agent system concurrently when they do not interact.
+
+Components declare the `SystemState` fields they read and write:
+
+    @component(reads=["memory", "model"], writes=["memory"])
+    def manage_memory(system_state: SystemState) -> SystemState:
+        ...
+
+`ParallelPipeline` orders the components into stages. A component is placed after
+every earlier component that writes a field it reads or writes, or that reads a
+field it writes. Components in the same stage run concurrently on the same input
+state, and their declared writes are merged back in the order the components were
+given, so the result does not depend on which finishes first. Components without
+declarations read and write everything, so they run alone.
+"""
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, FrozenSet, Iterable, List, Optional
+
+from .schemas.system import SystemState
+from .system import StateOperator, init_autonomous_agent_system
+
+ALL_FIELDS: FrozenSet[str] = frozenset(SystemState.__fields__)
+
+
+class UndeclaredWriteError(ValueError):
+    """Raised when a component changes a field it did not declare that it writes."""
+
+
+class Component:
+    """A state operator with the `SystemState` fields it reads and writes."""
+
+    def __init__(
+        self,
+        operator: StateOperator,
+        reads: Iterable[str] = ALL_FIELDS,
+        writes: Iterable[str] = ALL_FIELDS,
+    ):
+        self.operator = operator
+        self.reads = frozenset(reads)
+        self.writes = frozenset(writes)
+        unknown_fields = (self.reads | self.writes) - ALL_FIELDS
+        if unknown_fields:
+            raise ValueError(f"Unknown SystemState fields: {sorted(unknown_fields)}")
+        self.__name__ = getattr(operator, "__name__", type(operator).__name__)
+
+    def depends_on(self, other: "Component") -> bool:
+        """Check if this component must run after `other`."""
+        return bool(
+            other.writes & (self.reads | self.writes) or other.reads & self.writes
+        )
+
+    def __call__(self, system_state: SystemState) -> SystemState:
+        return self.operator(system_state)
+
+    def __repr__(self) -> str:
+        return (
+            f"Component({self.__name__}, reads={sorted(self.reads)}, "
+            f"writes={sorted(self.writes)})"
+        )
+
+
+def component(
+    reads: Iterable[str] = ALL_FIELDS, writes: Iterable[str] = ALL_FIELDS
+) -> Callable[[StateOperator], Component]:
+    """Declare the `SystemState` fields an operator reads and writes."""
+
+    def decorator(operator: StateOperator) -> Component:
+        return Component(operator, reads=reads, writes=writes)
+
+    return decorator
+
+
+def as_component(operator: StateOperator) -> Component:
+    if isinstance(operator, Component):
+        return operator
+    return Component(operator)
+
+
+def plan_stages(components: List[Component]) -> List[List[Component]]:
+    """Group `components` into stages that can each run concurrently."""
+    stage_indices: List[int] = []
+    for i, later in enumerate(components):
+        stage_index = 0
+        for j, earlier in enumerate(components[:i]):
+            if later.depends_on(earlier):
+                stage_index = max(stage_index, stage_indices[j] + 1)
+        stage_indices.append(stage_index)
+    stages: List[List[Component]] = [
+        [] for _ in range(max(stage_indices, default=-1) + 1)
+    ]
+    for stage_index, stage_component in zip(stage_indices, components):
+        stages[stage_index].append(stage_component)
+    return stages
+
+
+class ParallelPipeline:
+    """
+    Runs components in dependency order, running independent ones concurrently.
+
+    The pipeline is itself a state operator, so it can be used as the components
+    of an `AgentSystem`, or as a single component of one. Stages run in `executor`,
+    or in a thread pool of the pipeline's own that `shutdown` stops.
+    """
+
+    def __init__(
+        self,
+        components: List[StateOperator],
+        max_workers: Optional[int] = None,
+        executor: Optional[Executor] = None,
+    ):
+        self.components = [as_component(operator) for operator in components]
+        self.stages = plan_stages(self.components)
+        self.reads = frozenset().union(*(c.reads for c in self.components))
+        self.writes = frozenset().union(*(c.writes for c in self.components))
+        self._own_executor = executor is None
+        if executor is None:
+            widest_stage = max((len(stage) for stage in self.stages), default=1)
+            executor = ThreadPoolExecutor(max_workers=max_workers or widest_stage)
+        self._executor = executor
+
+    def __call__(self, system_state: SystemState) -> SystemState:
+        for stage in self.stages:
+            if len(stage) == 1:
+                system_state = stage[0](system_state)
+                continue
+            futures = [
+                self._executor.submit(stage_component, system_state)
+                for stage_component in stage
+            ]
+            outputs = [future.result() for future in futures]
+            system_state = merge_writes(system_state, stage, outputs)
+        return system_state
+
+    def shutdown(self):
+        """Shut down the thread pool, unless the executor was given by the caller."""
+        if self._own_executor:
+            self._executor.shutdown()
+
+    def __enter__(self) -> "ParallelPipeline":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+def merge_writes(
+    system_state: SystemState,
+    components: List[Component],
+    outputs: List[SystemState],
+) -> SystemState:
+    """Apply the declared writes of each component's output, in order.
+
+    Raises:
+        UndeclaredWriteError: If a component changed a field it did not declare,
+            which would otherwise be lost.
+    """
+    changes = {}
+    for stage_component, output in zip(components, outputs):
+        undeclared_writes = [
+            field
+            for field in ALL_FIELDS - stage_component.writes
+            if getattr(output, field) is not getattr(system_state, field)
+        ]
+        if undeclared_writes:
+            raise UndeclaredWriteError(
+                f"{stage_component.__name__} wrote undeclared fields: "
+                f"{sorted(undeclared_writes)}"
+            )
+        for field in stage_component.writes:
+            changes[field] = getattr(output, field)
+    return system_state.evolve(**changes)
+
+
+def init_parallel_agent_system(
+    components: List[StateOperator],
+    max_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+) -> StateOperator:
+    """Create an autonomous agent system that runs independent components at once.
+
+    Unless an executor is given, each run uses a thread pool that is shut down when
+    the run ends.
+    """
+
+    def run_parallel_system(system_state: SystemState) -> SystemState:
+        with ParallelPipeline(components, max_workers, executor) as pipeline:
+            return init_autonomous_agent_system([pipeline])(system_state)
+
+    return run_parallel_system
@@ -1,8 +1,67 @@
+import os
+from typing import Any, Dict, Type, TypeVar
+
 import yaml
 from pydantic import BaseModel as PydanticBaseModel
+from pydantic import validate_model
+
+from sembla.memory.history import MessageHistory
+
+T = TypeVar("T", bound="BaseSchema")
+
+# Set SEMBLA_VALIDATE=1 to validate trusted constructions and updates while debugging
+_validate_trusted = os.environ.get("SEMBLA_VALIDATE", "") not in ("", "0")
+
+
+def set_trusted_validation(enabled: bool):
+    """Check the values passed to `trusted` and `evolve`, for debugging."""
+    global _validate_trusted
+    _validate_trusted = enabled
 
 
 class BaseSchema(PydanticBaseModel):
+    class Config:
+        json_encoders = {MessageHistory: list}
+
+    @classmethod
+    def trusted(cls: Type[T], **values) -> T:
+        """Create a schema from values that are known to be valid.
+
+        Missing fields take their defaults, but nothing is validated or coerced, so
+        `values` must already be of the declared types. Use this for schemas built
+        by sembla itself in the agent loop, not for external input.
+        """
+        if _validate_trusted:
+            check_values(cls, values)
+        new_schema = cls.__new__(cls)
+        object.__setattr__(
+            new_schema,
+            "__dict__",
+            {
+                name: values[name] if name in values else field.get_default()
+                for name, field in cls.__fields__.items()
+            },
+        )
+        object.__setattr__(new_schema, "__fields_set__", set(values))
+        return new_schema
+
+    def evolve(self: T, **changes) -> T:
+        """Return a copy with `changes` applied, sharing all other field values.
+
+        Like `copy(update=...)`, the changes are not validated, and unchanged
+        fields (including nested states) are shared rather than copied. Unlike it,
+        the copy is made without iterating over the fields, which roughly halves
+        the cost of the small, frequent updates made by state operators.
+        """
+        if _validate_trusted:
+            check_values(self.__class__, {**self.__dict__, **changes})
+        new_schema = self.__class__.__new__(self.__class__)
+        object.__setattr__(new_schema, "__dict__", {**self.__dict__, **changes})
+        object.__setattr__(
+            new_schema, "__fields_set__", self.__fields_set__.union(changes)
+        )
+        return new_schema
+
     def from_json(self, json_str: str):
         return self.parse_raw(json_str)
 
@@ -22,6 +81,16 @@ class BaseSchema(PydanticBaseModel):
         return get_model_fields(self, indent=0)
 
 
+def check_values(schema_class: Type[BaseSchema], values: Dict[str, Any]):
+    """Raise a `ValidationError` if `values` are not valid for `schema_class`.
+
+    The values themselves are left as they are, so that shared sub-states stay shared.
+    """
+    _, _, error = validate_model(schema_class, values)
+    if error is not None:
+        raise error
+
+
 def get_model_fields(self, indent: int = 0) -> str:
     result = ""
     for key, value in self.dict().items():
@@ -1,9 +1,12 @@
 import importlib
 from enum import Enum, auto
+from functools import lru_cache
 from typing import Any, Callable, Dict, List, Optional, Type
 
 from pydantic import Field, root_validator, validator
 
+from sembla.memory.history import MessageHistory
+
 from .base import BaseSchema
 
 
@@ -15,6 +18,7 @@ class TaskStatus(Enum):
     COMPLETE = "COMPLETE"
     INCOMPLETE = "INCOMPLETE"
     UNDEFINED = "UNDEFINED"
+    BUDGET_EXCEEDED = "BUDGET_EXCEEDED"
 
 
 class TaskState(BaseSchema):
@@ -27,6 +31,13 @@ class TaskState(BaseSchema):
         status: The status of the task.
         max_cycles: The maximum number of cycles to run the task for.
         current_cycle: The current cycle of the task.
+        max_wall_time: The maximum number of seconds to run the task for.
+        max_total_tokens: The maximum number of tokens to spend on completions.
+        max_cost: The maximum amount in US dollars to spend on completions.
+        start_time: The wall clock time the agent loop started the task at.
+        elapsed_time: The seconds since the task started, as of the last component.
+        total_tokens: The tokens spent on completions so far.
+        total_cost: The US dollars spent on completions so far.
     """
 
     name: Optional[str] = None
@@ -34,6 +45,13 @@ class TaskState(BaseSchema):
     status: TaskStatus = TaskStatus.UNDEFINED
     max_cycles: Optional[int] = None
     current_cycle: int = 0
+    max_wall_time: Optional[float] = None
+    max_total_tokens: Optional[int] = None
+    max_cost: Optional[float] = None
+    start_time: Optional[float] = None
+    elapsed_time: float = 0.0
+    total_tokens: int = 0
+    total_cost: float = 0.0
 
 
 class ModelState(BaseSchema):
@@ -47,6 +65,8 @@ class ModelState(BaseSchema):
         max_tokens: The maximum number of tokens to generate.
         frequency_penalty: The frequency penalty of the model.
         presence_penalty: The presence penalty of the model.
+        cascade: The models to try in turn, cheapest first, escalating when a
+            response fails processing. If empty, only `name` is used.
     """
 
     name: str = "gpt-3.5-turbo"
@@ -55,6 +75,7 @@ class ModelState(BaseSchema):
     max_tokens: int = 2000
     frequency_penalty: float = 0
     presence_penalty: float = 0
+    cascade: List[str] = []
 
 
 class Message(BaseSchema):
@@ -65,29 +86,67 @@ class Message(BaseSchema):
         role: The role of the message author.
         content: The content of the message.
         name: The name of the message author.
+        token_count: The number of tokens the message adds to a prompt, cached
+            when the message enters the conversation history.
     """
 
     role: str
     content: str
     name: Optional[str] = None
+    token_count: Optional[int] = None
 
 
 class MemoryState(BaseSchema):
     """
     Represents the memory of the system.
+
+    Attributes:
+        max_history_message_count: The maximum number of messages in the history.
+        max_history_token_count: The maximum number of tokens in the history.
+        conversation_history: The messages sent to the model, with system messages
+            pinned so that they are never evicted.
+        conversation_buffer: New messages waiting to enter the history.
+        message_count: The number of messages in the history.
+        token_count: The running total of tokens in the history.
+        summary: A rolling summary of messages evicted from the history.
+        compaction_buffer: Evicted messages waiting to be folded into the summary.
+        recall: Evicted messages recalled as relevant to the current query.
+        log_offset: The offset in the message log up to which messages have been
+            persisted, if the memory is backed by a log.
     """
 
     max_history_message_count: int = 100
     max_history_token_count: int = 1000
-    conversation_history: List[Message] = []
+    conversation_history: MessageHistory = Field(default_factory=MessageHistory)
     conversation_buffer: List[Message] = []
     message_count: int = 0
     token_count: int = 0
+    summary: Optional[Message] = None
+    compaction_buffer: List[Message] = []
+    recall: Optional[Message] = None
+    log_offset: Optional[int] = None
+
+    @validator("conversation_history", pre=True)
+    def parse_history_messages(cls, value):
+        if isinstance(value, (list, tuple)):
+            return [
+                message if isinstance(message, Message) else Message.parse_obj(message)
+                for message in value
+            ]
+        return value
 
 
 ActionCallable = Callable[..., str]
 
 
+@lru_cache(maxsize=None)
+def import_qualified_name(qualified_name: str) -> Any:
+    """Import an object from its `module.name`, resolving each name only once."""
+    module_name, object_name = qualified_name.rsplit(".", 1)
+    module = importlib.import_module(module_name)
+    return getattr(module, object_name)
+
+
 from pydantic import BaseModel
 from typing import Callable, Optional
 import importlib
@@ -106,9 +165,7 @@ class Action(BaseModel):
     @property
     def callable(self):
         if self.callable_name:
-            module_name, function_name = self.callable_name.rsplit('.', 1)
-            module = importlib.import_module(module_name)
-            return getattr(module, function_name)
+            return import_qualified_name(self.callable_name)
         else:
             return None
 
@@ -177,15 +234,36 @@ class ResponseSchema(BaseSchema):
     action: ActionCall
 
 
+class TokenUsage(BaseSchema):
+    """
+    The tokens billed for a model completion, and their cost in US dollars if it
+    was priced when the completion was made.
+
+    `replayed` is set on the usage of a completion that was not made for this call,
+    such as a cached or shared response, so that it is not billed again.
+    """
+
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    cost: Optional[float] = None
+    replayed: bool = False
+
+
 class AgentResponse(BaseSchema):
     """
     Represents the response of the agent.
+
+    `accounted` is set once the usage of the response has been added to the task,
+    so that it is only counted once however the response is copied or rebuilt.
     """
 
     raw_response: str
     parsed_response: Optional[ResponseSchema] = None
     processor_outputs: List[ProcessorOutput] = []
     processed_response: Optional[str] = None
+    usage: Optional[TokenUsage] = None
+    accounted: bool = False
 
 
 class SystemState(BaseSchema):
@@ -210,8 +288,6 @@ class SystemState(BaseSchema):
     @property
     def response_schema(self):
         if self.response_schema_class:
-            module_name, class_name = self.response_schema_class.rsplit(".", 1)
-            module = importlib.import_module(module_name)
-            return getattr(module, class_name)
+            return import_qualified_name(self.response_schema_class)
         else:
             return None
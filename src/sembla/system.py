@@ -5,20 +5,30 @@ The functions should be replaced with classes that implement the __call__
 method and define the __init__ method to take in any necessary parameters.
 OR we use higher-order functions to create the functions with parameters.
 """
-from typing import List, Protocol
+import asyncio
+import inspect
+import time
+from concurrent.futures import Executor
+from typing import TYPE_CHECKING, List, Optional, Protocol, Union
 
+from .budget import account_usage, budget_exceeded, check_prices
 from .schemas.system import SystemState, TaskStatus
 
+if TYPE_CHECKING:
+    from .checkpoint import Checkpointer
+    from .instrumentation import Profiler
+
 
 def manage_memory(system_state: SystemState) -> SystemState:
     """Move messages from the conversation buffer to the conversation history."""
     new_message = system_state.memory.conversation_buffer[-1]
-    new_history = system_state.memory.conversation_history + [new_message]
+    new_history = system_state.memory.conversation_history.copy()
+    new_history.append(new_message)
 
     # TODO: Add logic to handle maximum history count / token count
 
-    new_memory = system_state.memory.copy(update={"conversation_history": new_history})
-    new_state = system_state.copy(update={"memory": new_memory})
+    new_memory = system_state.memory.evolve(conversation_history=new_history)
+    new_state = system_state.evolve(memory=new_memory)
 
     return new_state
 
@@ -65,80 +75,180 @@ class StateOperator(Protocol):
         ...
 
 
+class AsyncStateOperator(Protocol):
+    """A coroutine function that takes in a system state and returns a new one."""
+
+    async def __call__(self, system_state: SystemState) -> SystemState:
+        ...
+
+
+def is_async_operator(operator: Union[StateOperator, AsyncStateOperator]) -> bool:
+    """Check if `operator` is a coroutine function or has an async `__call__`."""
+    return inspect.iscoroutinefunction(operator) or inspect.iscoroutinefunction(
+        getattr(operator, "__call__", None)
+    )
+
+
+def as_async_operator(
+    operator: Union[StateOperator, AsyncStateOperator],
+    executor: Optional[Executor] = None,
+) -> AsyncStateOperator:
+    """Adapt `operator` to run on an event loop.
+
+    Async operators are returned unchanged. Sync operators are run in `executor`,
+    or the event loop's default thread pool, so that they do not block the loop.
+    """
+    if is_async_operator(operator):
+        return operator  # type: ignore
+
+    async def run_in_executor(system_state: SystemState) -> SystemState:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, operator, system_state)
+
+    return run_in_executor
+
+
 class AgentSystem:
     """A system that manages the agent's conversation with the user."""
 
-    def __init__(self, components: List[StateOperator]):
+    def __init__(
+        self,
+        components: List[Union[StateOperator, AsyncStateOperator]],
+        profiler: Optional["Profiler"] = None,
+        checkpointer: Optional["Checkpointer"] = None,
+    ):
+        if profiler is not None:
+            components = [profiler.wrap(component) for component in components]
         self._components = components
+        self.profiler = profiler
+        self.checkpointer = checkpointer
+        self._async_components: Optional[List[AsyncStateOperator]] = None
+        self._checked_sync = False
 
     def increment_cycle(self, system_state: SystemState) -> SystemState:
         """Increment the current cycle."""
-        new_task = system_state.task.copy(
-            update={"current_cycle": system_state.task.current_cycle + 1}
+        new_task = system_state.task.evolve(
+            current_cycle=system_state.task.current_cycle + 1
         )
-        new_state = system_state.copy(update={"task": new_task})
+        new_state = system_state.evolve(task=new_task)
         return new_state
 
     def termination_condition_met(self, system_state: SystemState) -> bool:
         """Check if the system should terminate."""
-        if system_state.task.status == TaskStatus.COMPLETE:
+        if system_state.task.status in (
+            TaskStatus.COMPLETE,
+            TaskStatus.BUDGET_EXCEEDED,
+        ):
             return True
         elif (
             system_state.task.max_cycles is not None
             and system_state.task.current_cycle >= system_state.task.max_cycles
         ):
             return True
-        return False
+        return budget_exceeded(system_state.task)
+
+    def start_task(self, system_state: SystemState) -> SystemState:
+        """Record the time the task started, if it has not started already."""
+        if system_state.task.start_time is not None:
+            return system_state
+        new_task = system_state.task.evolve(start_time=time.time())
+        return system_state.evolve(task=new_task)
+
+    def account_usage(
+        self, system_state: SystemState, new_state: SystemState
+    ) -> SystemState:
+        """Account for a component's usage and flag the task if over budget."""
+        elapsed_time = time.time() - new_state.task.start_time
+        new_state = account_usage(system_state, new_state, elapsed_time)
+        if budget_exceeded(new_state.task):
+            new_task = new_state.task.evolve(status=TaskStatus.BUDGET_EXCEEDED)
+            new_state = new_state.evolve(task=new_task)
+        return new_state
 
-    def run(self, system_state: SystemState) -> SystemState:
-        """Run the system for a single cycle."""
-        for component in self._components:
-            system_state = component(system_state)
+    def end_cycle(self, system_state: SystemState) -> SystemState:
+        """Increment the current cycle and checkpoint the state."""
         system_state = self.increment_cycle(system_state)
+        elapsed_time = time.time() - system_state.task.start_time
+        new_task = system_state.task.evolve(elapsed_time=elapsed_time)
+        system_state = system_state.evolve(task=new_task)
+        if self.checkpointer is not None:
+            self.checkpointer.save(system_state)
         return system_state
 
+    def check_sync_components(self):
+        """Check that every component can be run outside an event loop."""
+        for component in self._components:
+            if is_async_operator(component):
+                name = getattr(component, "__name__", type(component).__name__)
+                raise TypeError(
+                    f"Cannot run async component {name} outside an event loop; "
+                    "use arun or aloop"
+                )
+        self._checked_sync = True
+
+    def run(self, system_state: SystemState) -> SystemState:
+        """Run the system for a single cycle.
+
+        The cycle ends early if a component takes the task over budget.
+
+        Raises:
+            TypeError: If a component is async, and so must be run with `arun`.
+        """
+        if not self._checked_sync:
+            self.check_sync_components()
+        system_state = self.start_task(system_state)
+        for component in self._components:
+            new_state = component(system_state)
+            system_state = self.account_usage(system_state, new_state)
+            if system_state.task.status == TaskStatus.BUDGET_EXCEEDED:
+                break
+        return self.end_cycle(system_state)
+
     def loop(self, system_state: SystemState) -> SystemState:
-        """Run the system indefinitely."""
+        """Run the system until a termination condition is met."""
+        check_prices(system_state)
+        system_state = self.start_task(system_state)
         while not self.termination_condition_met(system_state):
             system_state = self.run(system_state)
-            system_state = self.increment_cycle(system_state)
         return system_state
 
+    async def arun(self, system_state: SystemState) -> SystemState:
+        """Run the system for a single cycle on the event loop."""
+        if self._async_components is None:
+            self._async_components = [
+                as_async_operator(component) for component in self._components
+            ]
+        system_state = self.start_task(system_state)
+        for component in self._async_components:
+            new_state = await component(system_state)
+            system_state = self.account_usage(system_state, new_state)
+            if system_state.task.status == TaskStatus.BUDGET_EXCEEDED:
+                break
+        return self.end_cycle(system_state)
+
+    async def aloop(self, system_state: SystemState) -> SystemState:
+        """Run the system on the event loop until a termination condition is met."""
+        check_prices(system_state)
+        system_state = self.start_task(system_state)
+        while not self.termination_condition_met(system_state):
+            system_state = await self.arun(system_state)
+        return system_state
 
-def init_autonomous_agent_system(components: List[StateOperator]) -> StateOperator:
-    def increment_cycle(system_state: SystemState) -> SystemState:
-        """Increment the current cycle."""
-        new_task = system_state.task.copy(
-            update={"current_cycle": system_state.task.current_cycle + 1}
-        )
-        new_state = system_state.copy(update={"task": new_task})
-        return new_state
 
-    def termination_condition_met(system_state: SystemState) -> bool:
-        """Check if the system should terminate."""
-        if system_state.task.status == TaskStatus.COMPLETE:
-            return True
-        elif (
-            system_state.task.max_cycles is not None
-            and system_state.task.current_cycle >= system_state.task.max_cycles
-        ):
-            return True
-        return False
+def init_autonomous_agent_system(components: List[StateOperator]) -> StateOperator:
+    """Create an agent system that runs until a termination condition is met."""
+    return AgentSystem(components).loop
 
-    def run_cycle(system_state: SystemState) -> SystemState:
-        """Run the system for a single cycle."""
-        for component in components:
-            system_state = component(system_state)
-        system_state = increment_cycle(system_state)
-        return system_state
 
-    def run_system(system_state: SystemState) -> SystemState:
-        """Run the system indefinitely."""
-        while not termination_condition_met(system_state):
-            system_state = run_cycle(system_state)
-        return system_state
+def init_async_autonomous_agent_system(
+    components: List[Union[StateOperator, AsyncStateOperator]],
+) -> AsyncStateOperator:
+    """Create an autonomous agent system that runs on the event loop.
 
-    return run_system
+    Sync components are run in the event loop's default thread pool, so many
+    systems can share a single event loop.
+    """
+    return AgentSystem(components).aloop
 
 
 def init_sequential_agent_system(components: List[StateOperator]) -> StateOperator:
@@ -147,10 +257,10 @@ def init_sequential_agent_system(components: List[StateOperator]) -> StateOperat
         for component in components:
             system_state = component(system_state)
         # Increment the cycle
-        new_task = system_state.task.copy(
-            update={"current_cycle": system_state.task.current_cycle + 1}
+        new_task = system_state.task.evolve(
+            current_cycle=system_state.task.current_cycle + 1
         )
-        new_state = system_state.copy(update={"task": new_task})
+        new_state = system_state.evolve(task=new_task)
         return new_state
 
     return run_system
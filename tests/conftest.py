@@ -0,0 +1,29 @@
+import pytest
+import tiktoken
+
+import sembla.llm.tokenizer
+from sembla.llm.tokenizer import Tokenizer
+
+
+@pytest.fixture
+def byte_encoding():
+    """A byte level encoding, which counts one token per byte."""
+    return tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+
+
+@pytest.fixture
+def offline_tokenizer(byte_encoding, monkeypatch):
+    """A fresh process-wide tokenizer, counting chat model tokens with `byte_encoding`.
+
+    The original tokenizer is restored when the test ends.
+    """
+    tokenizer = Tokenizer()
+    for model_name in ["gpt-3.5-turbo", "gpt-4"]:
+        tokenizer.register_encoding(model_name, byte_encoding)
+    monkeypatch.setattr(sembla.llm.tokenizer, "_tokenizer", tokenizer)
+    return tokenizer
@@ -0,0 +1,54 @@
+from sembla.actions import functions
+from sembla.actions.registry import RegistryCache, get_action_registry
+from sembla.actions.utils import execute_action_call, get_docs_from_actions
+from sembla.schemas.system import Action, ActionCall
+
+
+def make_actions():
+    return [
+        Action.from_callable(functions.no_action),
+        Action.from_callable(functions.read_file),
+    ]
+
+
+def test_registry_is_shared_by_equal_action_sets():
+    assert get_action_registry(make_actions()) is get_action_registry(make_actions())
+    assert get_action_registry(make_actions()[:1]) is not get_action_registry(
+        make_actions()
+    )
+
+
+def test_docs_are_built_from_signatures():
+    assert get_docs_from_actions(make_actions()) == (
+        "no_action(*args, **kwargs): No action.\n"
+        "read_file(filename): Read contents of `filename`."
+    )
+
+
+def test_execute_action_call(tmp_path):
+    file_path = tmp_path / "hello.txt"
+    file_path.write_text("Hello, Sembla!")
+    action_call = ActionCall(name="read_file", parameters={"filename": str(file_path)})
+    assert execute_action_call(make_actions(), action_call).output == "Hello, Sembla!"
+
+    action_call = ActionCall(name="read_file", parameters={})
+    assert execute_action_call(make_actions(), action_call).output.startswith(
+        "TypeError"
+    )
+
+    action_call = ActionCall(name="delete_everything", parameters=None)
+    assert execute_action_call(make_actions(), action_call).output == (
+        "Error - Action not available: delete_everything"
+    )
+
+
+def test_registry_cache_is_bounded():
+    cache = RegistryCache(max_size=2)
+    actions = make_actions()
+    registry = cache.get(actions)
+    assert cache.get(actions) is registry
+    for size in range(3):
+        cache.get(make_actions()[:size])
+    assert len(cache._by_key) == 2 and len(cache._by_identity) == 2
+    # The evicted action set gets a new registry
+    assert cache.get(actions) is not registry
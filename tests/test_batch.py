@@ -0,0 +1,68 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from sembla.batch import arun_batch, run_batch
+from sembla.schemas.system import SystemState, TaskState
+
+
+def run_task(system_state):
+    if system_state.task.name == "fail":
+        raise RuntimeError("boom")
+    return system_state.evolve(system_prompt=f"done {system_state.task.name}")
+
+
+def make_states(names):
+    return [SystemState(task=TaskState(name=name)) for name in names]
+
+
+def test_run_batch_isolates_failures():
+    results = sorted(run_batch(make_states(["0", "fail", "2"]), run_task))
+    assert [result.index for result in results] == [0, 1, 2]
+    assert results[0].system_state.system_prompt == "done 0"
+    assert isinstance(results[1].error, RuntimeError)
+    assert results[2].system_state.system_prompt == "done 2"
+
+
+def test_run_batch_in_process_pool():
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        results = list(run_batch(make_states(["a", "b"]), run_task, 2, executor))
+    assert sorted(r.system_state.system_prompt for r in results) == ["done a", "done b"]
+
+
+def test_arun_batch_streams_results_as_they_complete():
+    release_order = ["fail", "a", "b", "slow"]
+    started = []
+
+    async def collect():
+        released = {name: asyncio.Event() for name in release_order}
+
+        async def arun_task(system_state):
+            started.append(system_state.task.name)
+            await released[system_state.task.name].wait()
+            return run_task(system_state)
+
+        # Each run is released only once the result before it has been received
+        results = []
+        released[release_order[0]].set()
+        states = make_states(["slow", "fail", "a", "b"])
+        async for result in arun_batch(states, arun_task, 2):
+            results.append(result)
+            if len(results) < len(release_order):
+                released[release_order[len(results)]].set()
+        return results
+
+    results = asyncio.run(collect())
+    assert [result.index for result in results] == [1, 2, 3, 0]
+    assert isinstance(results[0].error, RuntimeError)
+    assert results[1].system_state.system_prompt == "done a"
+    assert started == ["slow", "fail", "a", "b"]
+
+
+@pytest.mark.parametrize("concurrency", [0, -1])
+def test_batch_rejects_concurrency_below_one(concurrency):
+    with pytest.raises(ValueError, match="Concurrency"):
+        run_batch(make_states(["a"]), run_task, concurrency)
+    with pytest.raises(ValueError, match="Concurrency"):
+        arun_batch(make_states(["a"]), run_task, concurrency)
@@ -0,0 +1,135 @@
+import time
+
+import pytest
+
+from sembla.llm import models
+from sembla.llm.models import ModelSpec
+from sembla.schemas.system import (
+    AgentResponse,
+    ModelState,
+    SystemState,
+    TaskState,
+    TaskStatus,
+    TokenUsage,
+)
+from sembla.system import AgentSystem
+
+
+def generate_response(system_state):
+    usage = TokenUsage(prompt_tokens=900, completion_tokens=100, total_tokens=1000)
+    agent_response = AgentResponse(raw_response="hello", usage=usage)
+    return system_state.evolve(agent_response=agent_response)
+
+
+def process_response(system_state):
+    agent_response = system_state.agent_response.evolve(processed_response="hello")
+    return system_state.evolve(agent_response=agent_response)
+
+
+def wait(system_state):
+    time.sleep(0.02)
+    return system_state
+
+
+def wait_for_nothing(system_state):
+    return system_state
+
+
+def never_called(system_state):
+    raise AssertionError("component ran after the budget was exceeded")
+
+
+def test_loop_increments_cycle_once_per_run():
+    system = AgentSystem([process_response, wait])
+    state = SystemState(task=TaskState(max_cycles=3))
+    state = system.loop(state.evolve(agent_response=AgentResponse(raw_response="")))
+    assert state.task.current_cycle == 3
+    assert state.task.elapsed_time >= 0.06
+
+
+def test_token_budget_stops_the_cycle():
+    system = AgentSystem([generate_response, process_response, never_called])
+    state = system.loop(SystemState(task=TaskState(max_total_tokens=1000)))
+    assert state.task.status == TaskStatus.BUDGET_EXCEEDED
+    assert state.task.current_cycle == 1
+    assert state.task.total_tokens == 1000
+    assert state.task.total_cost == pytest.approx(0.0015 * 0.9 + 0.002 * 0.1)
+
+
+def rebuild_response(system_state):
+    agent_response = AgentResponse(**system_state.agent_response.dict())
+    return system_state.evolve(agent_response=agent_response)
+
+
+def copy_response(system_state):
+    return system_state.evolve(
+        agent_response=system_state.agent_response.copy(deep=True)
+    )
+
+
+@pytest.mark.parametrize(
+    "processor", [process_response, rebuild_response, copy_response]
+)
+def test_cost_budget_counts_each_completion_once(processor):
+    system = AgentSystem([generate_response, processor, processor])
+    task = TaskState(max_cost=0.1)
+    state = system.loop(SystemState(task=task, model=ModelState(name="gpt-4")))
+    # Each cycle costs 0.027 + 0.006 dollars
+    assert state.task.current_cycle == 4
+    assert state.task.total_tokens == 4000
+    assert state.task.total_cost == pytest.approx(4 * 0.033)
+
+
+def test_wall_time_budget():
+    system = AgentSystem([wait, wait])
+    state = system.loop(SystemState(task=TaskState(max_wall_time=0.05)))
+    assert state.task.status == TaskStatus.BUDGET_EXCEEDED
+    assert 0.05 <= state.task.elapsed_time < 0.2
+
+
+class SlowCheckpointer:
+    def save(self, system_state):
+        time.sleep(0.02)
+
+
+def test_wall_time_counts_time_between_components():
+    system = AgentSystem([wait_for_nothing], checkpointer=SlowCheckpointer())
+    task = TaskState(max_wall_time=0.05, max_cycles=10)
+    state = system.loop(SystemState(task=task))
+    # Only the checkpoints take any time, so the components alone never would
+    assert 3 <= state.task.current_cycle < 10
+    assert state.task.elapsed_time >= 0.05
+
+
+@pytest.mark.parametrize("registered", [False, True])
+def test_unpriced_model_fails_before_any_completion(monkeypatch, registered):
+    if registered:
+        spec = ModelSpec(name="local-llama", context_window=4096)
+        monkeypatch.setitem(models._model_specs, spec.name, spec)
+    system = AgentSystem([never_called])
+    model = ModelState(cascade=["gpt-3.5-turbo", "local-llama"])
+    state = SystemState(task=TaskState(max_cost=1.0), model=model)
+    with pytest.raises(ValueError, match="local-llama"):
+        system.loop(state)
+
+    # Without a cost budget, spend on unpriced models is simply not counted
+    system = AgentSystem([generate_response])
+    state = system.loop(
+        state.evolve(task=TaskState(max_cycles=1), model=ModelState(name="local-llama"))
+    )
+    assert state.task.current_cycle == 1
+    assert state.task.total_tokens == 1000
+    assert state.task.total_cost == 0
+    assert state.task.status == TaskStatus.UNDEFINED
+
+
+def replay_response(system_state):
+    usage = TokenUsage(prompt_tokens=900, completion_tokens=100, replayed=True)
+    agent_response = AgentResponse(raw_response="hello", usage=usage)
+    return system_state.evolve(agent_response=agent_response)
+
+
+def test_replayed_responses_are_not_billed():
+    system = AgentSystem([replay_response, generate_response])
+    state = system.loop(SystemState(task=TaskState(max_cycles=2)))
+    assert state.task.total_tokens == 2000
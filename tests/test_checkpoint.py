@@ -0,0 +1,155 @@
+import json
+
+import pytest
+
+from sembla.checkpoint import Checkpointer, diff_system_state
+from sembla.memory.history import MessageHistory
+from sembla.schemas.system import (
+    AgentResponse,
+    MemoryState,
+    Message,
+    SystemState,
+    TaskState,
+)
+from sembla.system import AgentSystem
+
+
+def chat(system_state):
+    """Add a user message and reply to the history, keeping the last three."""
+    cycle = system_state.task.current_cycle
+    history = system_state.memory.conversation_history.copy()
+    history.append(Message(role="user", content=f"question {cycle}"))
+    history.append(Message(role="assistant", content=f"answer {cycle}"))
+    while history.evictable_count > 3:
+        history.evict()
+    memory = system_state.memory.evolve(
+        conversation_history=history, message_count=len(history)
+    )
+    agent_response = AgentResponse(raw_response=f"answer {cycle}")
+    return system_state.evolve(memory=memory, agent_response=agent_response)
+
+
+@pytest.fixture
+def checkpoint_path(tmp_path):
+    return tmp_path / "checkpoints.jsonl"
+
+
+def make_state():
+    history = [Message(role="system", content="instructions")]
+    memory = MemoryState(conversation_history=history)
+    return SystemState(task=TaskState(name="test"), memory=memory)
+
+
+def run_cycles(checkpointer, system_state, cycles):
+    system = AgentSystem([chat], checkpointer=checkpointer)
+    states = []
+    for _ in range(cycles):
+        system_state = system.run(system_state)
+        states.append(system_state)
+    return states
+
+
+def assert_same_state(restored, expected):
+    assert restored.task == expected.task
+    assert restored.agent_response == expected.agent_response
+    assert restored.memory.message_count == expected.memory.message_count
+    restored_history = restored.memory.conversation_history
+    expected_history = expected.memory.conversation_history
+    assert restored_history == expected_history
+    assert restored_history.next_position == expected_history.next_position
+
+
+def test_checkpoints_store_only_changes(checkpoint_path):
+    with Checkpointer(checkpoint_path) as checkpointer:
+        states = run_cycles(checkpointer, make_state(), 4)
+        for state in states:
+            assert_same_state(checkpointer.load(state.task.current_cycle), state)
+
+    records = [json.loads(line) for line in checkpoint_path.read_text().splitlines()]
+    assert [record["snapshot"] for record in records] == [True, False, False, False]
+    assert set(records[3]["state"]) == {"task", "agent_response"}
+    assert set(records[1]["memory"]) == {"message_count"}
+    assert records[3]["memory"] == {}
+    assert [entry[0] for entry in records[3]["history"]["entries"]] == [7, 8]
+
+
+def test_resume_discards_later_checkpoints(checkpoint_path):
+    with Checkpointer(checkpoint_path) as checkpointer:
+        states = run_cycles(checkpointer, make_state(), 4)
+
+    with Checkpointer(checkpoint_path) as checkpointer:
+        assert checkpointer.cycles == [1, 2, 3, 4]
+        system_state = checkpointer.resume(2)
+        assert checkpointer.cycles == [1, 2]
+        assert_same_state(system_state, states[1])
+        resumed_states = run_cycles(checkpointer, system_state, 2)
+
+    with Checkpointer(checkpoint_path) as checkpointer:
+        assert checkpointer.cycles == [1, 2, 3, 4]
+        assert_same_state(checkpointer.load(), resumed_states[-1])
+        # Only the time spent differs from the original run
+        restored = checkpointer.load()
+        assert restored.memory == states[-1].memory
+        assert restored.task.current_cycle == states[-1].task.current_cycle
+
+
+def test_torn_checkpoint_is_discarded(checkpoint_path):
+    with Checkpointer(checkpoint_path) as checkpointer:
+        states = run_cycles(checkpointer, make_state(), 2)
+    with open(checkpoint_path, "ab") as f:
+        f.write(b'{"cycle": 3, "snap')
+
+    with Checkpointer(checkpoint_path) as checkpointer:
+        assert checkpointer.cycles == [1, 2]
+        assert_same_state(checkpointer.resume(), states[-1])
+
+
+def replace_history(system_state):
+    """Replace the history with a longer one that shares none of its messages."""
+    history = MessageHistory([Message(role="system", content="new instructions")])
+    history.advance_to(system_state.memory.conversation_history.next_position + 1)
+    history.append(Message(role="user", content="start again"))
+    memory = system_state.memory.evolve(conversation_history=history)
+    return system_state.evolve(memory=memory)
+
+
+def test_replaced_history_is_saved_whole(checkpoint_path):
+    with Checkpointer(checkpoint_path) as checkpointer:
+        [state] = run_cycles(checkpointer, make_state(), 1)
+        replaced = replace_history(state)
+        checkpointer.save(replaced)
+        [state] = run_cycles(checkpointer, replaced, 1)
+
+        assert_same_state(checkpointer.load(1), replaced)
+        assert_same_state(checkpointer.load(), state)
+
+    records = [json.loads(line) for line in checkpoint_path.read_text().splitlines()]
+    assert [record["snapshot"] for record in records] == [True, True, False]
+
+
+def test_delta_checkpoint_only_walks_new_messages(monkeypatch):
+    messages = [Message(role="user", content=str(i)) for i in range(10_000)]
+    previous = SystemState(memory=MemoryState(conversation_history=messages))
+    history = previous.memory.conversation_history.copy()
+    history.evict()
+    history.append(Message(role="system", content="note"))
+    history.append(Message(role="assistant", content="reply"))
+    system_state = previous.evolve(
+        memory=previous.memory.evolve(conversation_history=history)
+    )
+
+    visited = []
+    iter_nodes = MessageHistory._iter_nodes
+
+    def count_nodes(self, *args):
+        for node in iter_nodes(self, *args):
+            visited.append(node)
+            yield node
+
+    monkeypatch.setattr(MessageHistory, "_iter_nodes", count_nodes)
+    record = diff_system_state(previous, system_state)
+
+    assert not record["snapshot"]
+    assert [entry[0] for entry in record["history"]["entries"]] == [10_000, 10_001]
+    assert len(visited) == 1
+    assert record["history"]["first_position"] == 1
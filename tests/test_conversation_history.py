@@ -0,0 +1,95 @@
+from sembla.conversation_history import (
+    REPLY_PRIMING_TOKENS,
+    get_prompt_messages,
+    init_conversation_history_manager,
+    trim_conversation_history,
+    update_conversation_history,
+)
+from sembla.memory.history import MessageHistory
+from sembla.schemas.system import MemoryState, Message, SystemState
+
+
+def make_message(role: str, token_count: int) -> Message:
+    return Message(role=role, content=f"{role} message", token_count=token_count)
+
+
+def test_trim_conversation_history_keeps_system_messages():
+    history = MessageHistory(
+        [
+            make_message("system", 10),
+            make_message("user", 5),
+            make_message("assistant", 5),
+            make_message("user", 5),
+        ]
+    )
+    evicted = trim_conversation_history(
+        history,
+        REPLY_PRIMING_TOKENS + 25,
+        max_message_count=10,
+        max_token_count=20,
+    )
+    assert [message.role for message in history] == ["system", "user"]
+    assert [message.role for message in evicted] == ["user", "assistant"]
+
+
+def test_trim_conversation_history_by_message_count():
+    messages = [make_message("user", 1) for _ in range(5)]
+    history = MessageHistory(messages)
+    evicted = trim_conversation_history(
+        history, REPLY_PRIMING_TOKENS + 5, max_message_count=2, max_token_count=100
+    )
+    assert history == messages[3:]
+    assert evicted == messages[:3]
+
+
+def test_update_conversation_history_keeps_running_token_count():
+    memory = MemoryState(
+        max_history_message_count=3,
+        max_history_token_count=100,
+        conversation_buffer=[make_message("system", 10), make_message("user", 5)],
+    )
+    state = update_conversation_history(SystemState(memory=memory))
+    assert state.memory.token_count == REPLY_PRIMING_TOKENS + 15
+
+    buffer = [make_message("assistant", 7), make_message("user", 3)]
+    memory = state.memory.copy(update={"conversation_buffer": buffer})
+    state = update_conversation_history(state.copy(update={"memory": memory}))
+    assert [message.role for message in state.memory.conversation_history] == [
+        "system",
+        "assistant",
+        "user",
+    ]
+    assert state.memory.message_count == 3
+    assert state.memory.token_count == REPLY_PRIMING_TOKENS + 20
+    assert state.memory.conversation_buffer == []
+
+
+def test_conversation_history_manager_hands_on_evicted_messages():
+    received = []
+
+    def record_evictions(system_state, evicted_messages):
+        received.extend(evicted_messages)
+        return system_state
+
+    manage_conversation_history = init_conversation_history_manager(
+        eviction_handlers=[record_evictions]
+    )
+    buffer = [make_message("user", 1) for _ in range(3)]
+    memory = MemoryState(max_history_message_count=1, conversation_buffer=buffer)
+    state = manage_conversation_history(SystemState(memory=memory))
+    assert state.memory.conversation_history == buffer[2:]
+    assert received == buffer[:2]
+
+
+def test_get_prompt_messages_places_summary_before_evictable_messages():
+    summary = make_message("system", 4)
+    memory = MemoryState(
+        conversation_history=[make_message("system", 10), make_message("user", 5)],
+        summary=summary,
+    )
+    prompt_messages = get_prompt_messages(memory)
+    assert prompt_messages == [
+        memory.conversation_history[0],
+        summary,
+        memory.conversation_history[1],
+    ]
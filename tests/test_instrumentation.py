@@ -0,0 +1,72 @@
+import asyncio
+import tracemalloc
+
+from sembla.instrumentation import Profiler
+from sembla.schemas.system import (
+    AgentResponse,
+    SystemState,
+    TaskState,
+    TaskStatus,
+    TokenUsage,
+)
+from sembla.system import AgentSystem
+
+
+def generate_response(system_state):
+    usage = TokenUsage(prompt_tokens=10, completion_tokens=5, total_tokens=15)
+    agent_response = AgentResponse(raw_response="hello", usage=usage)
+    return system_state.evolve(agent_response=agent_response)
+
+
+def process_response(system_state):
+    agent_response = system_state.agent_response.evolve(processed_response="hello")
+    task = system_state.task
+    if task.current_cycle == 1:
+        task = task.evolve(status=TaskStatus.COMPLETE)
+    return system_state.evolve(agent_response=agent_response, task=task)
+
+
+def make_state():
+    return SystemState(task=TaskState(name="test"))
+
+
+def test_profiler_aggregates_per_cycle_and_run():
+    records = []
+    with Profiler(trace_memory=True, callback=records.append) as profiler:
+        system = AgentSystem([generate_response, process_response], profiler=profiler)
+        system.run(system.run(make_state()))
+    assert not tracemalloc.is_tracing()
+
+    assert [(m.operator_name, m.cycle) for m in records] == [
+        ("generate_response", 0),
+        ("process_response", 0),
+        ("generate_response", 1),
+        ("process_response", 1),
+    ]
+    assert all(m.allocated_bytes is not None and m.cpu_time >= 0 for m in records)
+    cycles = profiler.by_cycle()
+    assert cycles[1]["generate_response"].prompt_tokens == 10
+    assert cycles[1]["process_response"].prompt_tokens == 0
+    totals = profiler.totals()
+    assert totals["generate_response"].calls == 2
+    assert totals["generate_response"].completion_tokens == 10
+
+
+def test_profiler_wraps_async_components():
+    async def agenerate_response(system_state):
+        return generate_response(system_state)
+
+    with Profiler(trace_memory=True) as profiler:
+        system = AgentSystem([agenerate_response, process_response], profiler=profiler)
+        asyncio.run(system.aloop(make_state()))
+
+    totals = profiler.totals()
+    assert totals["agenerate_response"].calls == 2
+    assert totals["agenerate_response"].prompt_tokens == 20
+    # Allocations of concurrent tasks cannot be told apart, so none are reported
+    assert [m.allocated_bytes is None for m in profiler.records] == [True, False] * 2
+
+
+def test_agent_system_without_profiler_keeps_components():
+    components = [generate_response, process_response]
+    assert AgentSystem(components)._components is components
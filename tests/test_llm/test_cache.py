@@ -0,0 +1,77 @@
+import asyncio
+
+from sembla.llm.openai.cache import (
+    ResponseCache,
+    init_async_cached_chat_completion,
+    init_cached_chat_completion,
+)
+
+
+class FakeAPI:
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, **request):
+        self.calls += 1
+        content = f"reply {self.calls}"
+        return {
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3},
+        }
+
+    async def acreate(self, **request):
+        return self.create(**request)
+
+
+def make_request(content="hi", temperature=0.0):
+    return {
+        "model": "gpt-4",
+        "messages": [{"role": "user", "content": content}],
+        "temperature": temperature,
+    }
+
+
+def test_identical_requests_hit_the_cache():
+    api = FakeAPI()
+    cache = ResponseCache(max_size=1)
+    create = init_cached_chat_completion(cache, api.create)
+
+    first = create(**make_request())
+    hit = create(**make_request())
+    assert hit["choices"] == first["choices"]
+    # Only the call that was made is billed
+    assert hit["usage"]["replayed"] and "replayed" not in first["usage"]
+    create(**make_request("other"))
+    # The first request was evicted from the single entry LRU
+    create(**make_request())
+    create(**make_request(temperature=1.0))
+
+    assert api.calls == 4
+    info = cache.cache_info()
+    assert (info.memory_hits, info.misses, info.skipped) == (1, 3, 1)
+    assert info.hit_rate == 0.25
+    assert info.current_size == 1
+
+
+def test_disk_tier_is_shared_and_expires(tmp_path):
+    api = FakeAPI()
+    now = 1000.0
+
+    def clock():
+        return now
+
+    writer = ResponseCache(path=tmp_path, clock=clock)
+    create = init_cached_chat_completion(writer, api.create)
+    create(**make_request())
+
+    cache = ResponseCache(path=tmp_path, ttl=60, clock=clock)
+    acreate = init_async_cached_chat_completion(cache, api.acreate)
+    response = asyncio.run(acreate(**make_request()))
+    assert response.choices[0].message.content == "reply 1"
+    assert cache.cache_info().disk_hits == 1
+    assert cache.cache_info().latency_saved >= 0
+
+    now += 120
+    cache.clear()
+    asyncio.run(acreate(**make_request()))
+    assert api.calls == 2
@@ -0,0 +1,150 @@
+import pytest
+
+from sembla.actions.functions import no_action
+from sembla.llm.cascade import CascadeStats, init_model_cascade
+from sembla.llm.openai.cache import ResponseCache, init_cached_chat_completion
+from sembla.llm.openai.chat_completion import init_chat_completion_generator
+from sembla.response.processor import process_json_response, validate_action_call
+from sembla.schemas.system import (
+    Action,
+    ActionCall,
+    AgentResponse,
+    MemoryState,
+    Message,
+    ModelState,
+    ResponseSchema,
+    SystemState,
+    TaskState,
+    TokenUsage,
+)
+from sembla.system import AgentSystem
+
+VALID = ResponseSchema(
+    goal="idle", objectives=[], observations=[], action=ActionCall(name="no_action")
+).json()
+UNKNOWN_ACTION = VALID.replace("no_action", "fly")
+
+
+class TieredAPI:
+    def __init__(self, replies):
+        self.replies = replies
+        self.models = []
+
+    def create(self, **request):
+        self.models.append(request["model"])
+        content = self.replies[request["model"]]
+        return {
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": {
+                "prompt_tokens": 900,
+                "completion_tokens": 100,
+                "total_tokens": 1000,
+            },
+        }
+
+
+def make_state(**task):
+    memory = MemoryState(conversation_history=[Message(role="user", content="hi")])
+    return SystemState(
+        task=TaskState(**task),
+        model=ModelState(cascade=["gpt-3.5-turbo", "gpt-4"]),
+        memory=memory,
+        actions=[Action.from_callable(no_action)],
+        response_schema=ResponseSchema,
+    )
+
+
+def init_cascade(api, stats=None):
+    return init_model_cascade(
+        init_chat_completion_generator(api.create),
+        processors=[process_json_response, validate_action_call],
+        stats=stats,
+    )
+
+
+@pytest.mark.parametrize("cheap_reply", ["not json", UNKNOWN_ACTION])
+def test_escalates_when_processing_fails(offline_tokenizer, cheap_reply):
+    api = TieredAPI({"gpt-3.5-turbo": cheap_reply, "gpt-4": VALID})
+    stats = CascadeStats()
+
+    state = init_cascade(api, stats)(make_state())
+
+    assert api.models == ["gpt-3.5-turbo", "gpt-4"]
+    assert state.model.name == "gpt-4"
+    assert state.agent_response.processor_outputs == []
+    assert state.agent_response.parsed_response.action.name == "no_action"
+    usage = state.agent_response.usage
+    assert usage.total_tokens == 2000
+    assert usage.cost == pytest.approx(0.00155 + 0.033)
+    assert stats.tier_info()["gpt-3.5-turbo"].success_rate == 0.0
+    assert stats.tier_info()["gpt-4"].success_rate == 1.0
+
+
+def test_cheap_model_success_stops_the_cascade(offline_tokenizer):
+    api = TieredAPI({"gpt-3.5-turbo": VALID, "gpt-4": VALID})
+    stats = CascadeStats()
+    system = AgentSystem([init_cascade(api, stats)])
+
+    state = system.loop(make_state(max_cycles=2))
+
+    assert api.models == ["gpt-3.5-turbo"] * 2
+    assert stats.tier_info() == {"gpt-3.5-turbo": (2, 2)}
+    assert state.task.total_cost == pytest.approx(2 * 0.00155)
+
+
+def test_budget_counts_every_model_tried(offline_tokenizer):
+    api = TieredAPI({"gpt-3.5-turbo": "not json", "gpt-4": "not json"})
+    system = AgentSystem([init_cascade(api)])
+
+    state = system.loop(make_state(max_cycles=1))
+
+    [output] = state.agent_response.processor_outputs
+    assert output.processor_name == "process_json_response"
+    assert state.task.total_tokens == 2000
+    assert state.task.total_cost == pytest.approx(0.00155 + 0.033)
+
+
+def test_unpriced_model_adds_nothing_to_the_cost():
+    replies = {"local-model": "not json", "gpt-4": VALID}
+
+    def generate(system_state):
+        usage = TokenUsage(prompt_tokens=900, completion_tokens=100, total_tokens=1000)
+        agent_response = AgentResponse(
+            raw_response=replies[system_state.model.name], usage=usage
+        )
+        return system_state.evolve(agent_response=agent_response)
+
+    cascade = init_model_cascade(generate, [process_json_response])
+    system_state = make_state(max_cycles=1).evolve(
+        model=ModelState(cascade=["local-model", "gpt-4"])
+    )
+
+    state = AgentSystem([cascade]).loop(system_state)
+
+    assert state.agent_response.usage.cost == pytest.approx(0.033)
+    assert state.task.total_tokens == 2000
+    assert state.task.total_cost == pytest.approx(0.033)
+
+
+def test_cached_tier_is_not_billed(offline_tokenizer):
+    api = TieredAPI({"gpt-3.5-turbo": "not json", "gpt-4": VALID})
+    create = init_cached_chat_completion(ResponseCache(), api.create)
+    cascade = init_model_cascade(
+        init_chat_completion_generator(create), [process_json_response]
+    )
+    # Cache the response of the cheap model
+    cheap_only = make_state().evolve(model=ModelState(cascade=["gpt-3.5-turbo"]))
+    cascade(cheap_only)
+
+    state = AgentSystem([cascade]).loop(make_state(max_cycles=1))
+
+    assert api.models == ["gpt-3.5-turbo", "gpt-4"]
+    assert not state.agent_response.usage.replayed
+    assert state.task.total_tokens == 1000
+    assert state.task.total_cost == pytest.approx(0.033)
+
+    # A cascade answered wholly from the cache is not billed at all
+    state = AgentSystem([cascade]).loop(make_state(max_cycles=1))
+    assert api.models == ["gpt-3.5-turbo", "gpt-4"]
+    assert state.agent_response.usage.replayed
+    assert state.task.total_tokens == 0
@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+import pytest
+
+from sembla.llm.openai.cassette import Cassette, CassetteMissError
+from sembla.llm.openai.chat_completion import init_chat_completion_generator
+from sembla.schemas.system import MemoryState, Message, SystemState, TaskState
+from sembla.system import AgentSystem
+
+
+class FakeAPI:
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, **request):
+        self.calls += 1
+        content = f"reply {self.calls} to {request['messages'][-1]['content']}"
+        return {
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3},
+        }
+
+
+@pytest.fixture
+def cassette_path(tmp_path):
+    return tmp_path / "completions.jsonl"
+
+
+def make_state():
+    memory = MemoryState(conversation_history=[Message(role="user", content="hi")])
+    return SystemState(task=TaskState(max_cycles=2), memory=memory)
+
+
+def run_agent(cassette):
+    generate_response = init_chat_completion_generator(cassette.create)
+    return AgentSystem([generate_response]).loop(make_state())
+
+
+def test_replays_recorded_responses_in_order(offline_tokenizer, cassette_path):
+    api = FakeAPI()
+    recorded = run_agent(Cassette(cassette_path, mode="record", create=api.create))
+    assert api.calls == 2
+
+    replayed = run_agent(Cassette(cassette_path, mode="replay", create=api.create))
+    assert api.calls == 2
+    assert replayed.agent_response == recorded.agent_response
+    assert replayed.agent_response.raw_response == "reply 2 to hi"
+
+
+def test_replay_miss_and_auto_mode(offline_tokenizer, cassette_path):
+    api = FakeAPI()
+    request = {"model": "gpt-4", "messages": [{"role": "user", "content": "new"}]}
+    with pytest.raises(CassetteMissError):
+        Cassette(cassette_path, create=api.create).create(**request)
+
+    auto = Cassette(cassette_path, mode="auto", create=api.create)
+    first = auto.create(**request)
+    assert auto.create(**request) == first
+    assert api.calls == 1
+
+
+def test_replay_latency(cassette_path):
+    api = FakeAPI()
+    request = {"model": "gpt-4", "messages": [{"role": "user", "content": "hi"}]}
+    Cassette(cassette_path, mode="record", create=api.create).create(**request)
+
+    cassette = Cassette(cassette_path, latency=0.05)
+    start = time.perf_counter()
+    response = asyncio.run(cassette.acreate(**request))
+    assert time.perf_counter() - start >= 0.05
+    assert response.choices[0].message.content == "reply 1 to hi"
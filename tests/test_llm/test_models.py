@@ -0,0 +1,40 @@
+import pytest
+
+from sembla.conversation_history import get_max_token_count, update_conversation_history
+from sembla.llm.models import (
+    ContextWindowExceededError,
+    get_model_spec,
+    pack_token_budget,
+)
+from sembla.schemas.system import MemoryState, Message, ModelState, SystemState
+
+
+def test_get_model_spec_matches_dated_snapshots():
+    assert get_model_spec("gpt-4-0613").name == "gpt-4"
+    assert get_model_spec("gpt-4-32k-0613").context_window == 32768
+    assert get_model_spec("gpt-3.5-turbo-16k-0613").context_window == 16385
+    assert get_model_spec("gpt-3.5-turbo-1106").context_window == 16385
+    assert get_max_token_count("gpt-3.5-turbo") == 4097
+    for model_name in ["davinci", "gpt-4-turbo-preview", "gpt-4-0613-preview"]:
+        with pytest.raises(ValueError):
+            get_model_spec(model_name)
+
+
+def test_pack_token_budget_uses_the_whole_window():
+    assert pack_token_budget("gpt-4", 7000, 2000) == (7000, 1192)
+    assert pack_token_budget("gpt-4", 1000, 2000) == (1000, 2000)
+    with pytest.raises(ContextWindowExceededError):
+        pack_token_budget("gpt-4", 8192, 2000)
+
+
+def test_history_leaves_room_for_the_completion():
+    memory = MemoryState(
+        max_history_token_count=10_000,
+        conversation_buffer=[
+            Message(role="user", content=str(i), token_count=1000) for i in range(8)
+        ],
+    )
+    model = ModelState(name="gpt-4", max_tokens=2192)
+    state = update_conversation_history(SystemState(model=model, memory=memory))
+    assert state.memory.message_count == 5
+    assert state.memory.token_count == 5003
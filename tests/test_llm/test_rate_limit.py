@@ -0,0 +1,185 @@
+import asyncio
+import threading
+import time
+
+import openai
+import pytest
+
+from sembla.llm.openai.rate_limit import (
+    RateLimiter,
+    RetryPolicy,
+    estimate_request_tokens,
+    init_async_rate_limited_chat_completion,
+    init_rate_limited_chat_completion,
+    is_retryable,
+)
+
+NO_DELAY = RetryPolicy(max_retries=2, base_delay=0.0)
+
+
+class FlakyAPI:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def create(self, **request):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        usage = {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6}
+        return {"choices": [{"message": {"content": "ok"}}], "usage": usage}
+
+    async def acreate(self, **request):
+        return self.create(**request)
+
+
+def make_request(content="hello", max_tokens=10):
+    return {
+        "model": "gpt-4",
+        "messages": [{"role": "user", "content": content}],
+        "max_tokens": max_tokens,
+    }
+
+
+def test_estimate_request_tokens(offline_tokenizer):
+    # 3 tokens of overhead per message, 5 bytes of content and 3 to prime the reply
+    assert estimate_request_tokens(make_request()) == 3 + 5 + 3 + 10
+    offline_tokenizer.register_encoding(
+        "my-model", offline_tokenizer.get_encoding("gpt-4")
+    )
+    request = {**make_request(), "model": "my-model"}
+    assert estimate_request_tokens(request) == 3 + 5 + 3 + 10
+
+
+def test_buckets_refill_at_their_rate(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("time.monotonic", lambda: now[0])
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=600)
+
+    # The buckets hold ten seconds of traffic: 10 requests and 100 tokens
+    assert limiter.try_acquire(60) == 0
+    assert limiter.try_acquire(60) == pytest.approx(2.0)
+    limiter.release(20)
+    assert limiter.try_acquire(60) == 0
+    assert limiter.try_acquire(1) == pytest.approx(0.1)
+    now[0] = 0.1
+    assert limiter.try_acquire(1) == 0
+    # A request larger than the bucket waits for a full bucket, not forever
+    now[0] = 100.0
+    assert limiter.try_acquire(10_000) == 0
+
+
+def test_callers_are_served_in_order():
+    limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=60_000)
+    limiter.try_acquire(int(limiter.token_capacity))
+    served = []
+
+    def call(name, tokens):
+        limiter.acquire(tokens)
+        served.append(name)
+
+    big = threading.Thread(target=call, args=("big", 100))
+    big.start()
+    while limiter._next_ticket < 1:
+        time.sleep(0.001)
+    small = threading.Thread(target=call, args=("small", 1))
+    small.start()
+    big.join()
+    small.join()
+    assert served == ["big", "small"]
+    assert limiter.waited > 0
+
+
+def test_retries_rate_limit_and_server_errors(offline_tokenizer):
+    api = FlakyAPI(
+        [
+            openai.error.RateLimitError("slow down"),
+            openai.error.APIError("bad gateway", http_status=502),
+        ]
+    )
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=600)
+    create = init_rate_limited_chat_completion(limiter, api.create, NO_DELAY)
+
+    assert create(**make_request())["choices"][0]["message"]["content"] == "ok"
+    assert api.calls == 3
+    # The failed attempts and the unused completion tokens were returned
+    assert limiter._levels.tokens == pytest.approx(
+        limiter.token_capacity - estimate_request_tokens(make_request()) + 15,
+        abs=1,
+    )
+
+
+def test_gives_up_on_other_errors_and_after_max_retries(offline_tokenizer):
+    assert not is_retryable(openai.error.InvalidRequestError("bad", param=None))
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=60_000)
+
+    api = FlakyAPI([openai.error.InvalidRequestError("bad", param=None)])
+    create = init_rate_limited_chat_completion(limiter, api.create, NO_DELAY)
+    with pytest.raises(openai.error.InvalidRequestError):
+        create(**make_request())
+    assert api.calls == 1
+
+    api = FlakyAPI([openai.error.Timeout("late")] * 3)
+    acreate = init_async_rate_limited_chat_completion(limiter, api.acreate, NO_DELAY)
+    with pytest.raises(openai.error.Timeout):
+        asyncio.run(acreate(**make_request()))
+    assert api.calls == 3
+    # Calls that failed give back all of their tokens
+    assert limiter._levels.tokens == pytest.approx(limiter.token_capacity, abs=1)
+
+
+def test_limits_are_shared_through_the_state_file(tmp_path):
+    path = tmp_path / "limits.json"
+    first = RateLimiter(requests_per_minute=6, tokens_per_minute=600, state_path=path)
+    second = RateLimiter(requests_per_minute=6, tokens_per_minute=600, state_path=path)
+
+    assert first.try_acquire(10) == 0
+    assert second.try_acquire(10) > 9
+
+
+def test_streams_release_unused_tokens_when_they_end(offline_tokenizer):
+    def create(**request):
+        for content in ["o", "k", "!"]:
+            yield {"choices": [{"delta": {"content": content}}]}
+
+    async def acreate(**request):
+        async def stream():
+            for chunk in create(**request):
+                yield chunk
+
+        return stream()
+
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=600)
+    request = {**make_request(), "stream": True}
+    reserved = estimate_request_tokens(request)
+    start = limiter._levels.tokens
+
+    stream = init_rate_limited_chat_completion(limiter, create, NO_DELAY)(**request)
+    assert limiter._levels.tokens == pytest.approx(start - reserved, abs=1)
+    next(stream)
+    stream.close()
+    # One of the ten completion tokens was streamed before the stream was closed
+    assert limiter._levels.tokens == pytest.approx(start - reserved + 9, abs=1)
+
+    async def consume():
+        acreate_limited = init_async_rate_limited_chat_completion(
+            limiter, acreate, NO_DELAY
+        )
+        return [chunk async for chunk in await acreate_limited(**request)]
+
+    before = limiter._levels.tokens
+    assert len(asyncio.run(consume())) == 3
+    assert limiter._levels.tokens == pytest.approx(before - reserved + 7, abs=1)
+
+
+def test_async_locks_of_closed_loops_are_dropped():
+    limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=6000)
+
+    async def contend():
+        # Empty the bucket, so that the callers wait on the lock
+        limiter.try_acquire(int(limiter.token_capacity))
+        await asyncio.gather(*[limiter.aacquire(1) for _ in range(3)])
+
+    for _ in range(3):
+        asyncio.run(contend())
+    assert len(limiter._async_locks) <= 1
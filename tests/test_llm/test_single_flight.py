@@ -0,0 +1,122 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from sembla.llm.openai.single_flight import (
+    SingleFlight,
+    init_async_single_flight_chat_completion,
+    init_single_flight_chat_completion,
+)
+
+
+class SlowAPI:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+        self.release = threading.Event()
+
+    def create(self, **request):
+        self.calls += 1
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return {
+            "choices": [{"message": {"content": request["messages"][0]["content"]}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3},
+        }
+
+    async def acreate(self, **request):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self.error is not None:
+            raise self.error
+        return {
+            "choices": [{"message": {"content": request["messages"][0]["content"]}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3},
+        }
+
+
+def make_request(content="hi"):
+    return {"model": "gpt-4", "messages": [{"role": "user", "content": content}]}
+
+
+def test_identical_requests_in_flight_share_a_call():
+    api = SlowAPI()
+    single_flight = SingleFlight()
+    create = init_single_flight_chat_completion(single_flight, api.create)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(create, **make_request()) for _ in range(3)]
+        other = executor.submit(create, **make_request("other"))
+        while single_flight.info().coalesced < 2:
+            time.sleep(0.001)
+        api.release.set()
+        responses = [future.result() for future in futures]
+
+    assert all(response["choices"] == responses[0]["choices"] for response in responses)
+    # Only the caller that made the call is billed for it
+    replayed = [response["usage"].get("replayed", False) for response in responses]
+    assert sorted(replayed) == [False, True, True]
+    assert other.result()["choices"] != responses[0]["choices"]
+    assert api.calls == 2
+    assert single_flight.info() == (2, 2, 0)
+    # Nothing is kept once the call has returned
+    create(**make_request())
+    assert api.calls == 3
+
+
+def test_async_callers_share_the_call_and_its_error():
+    api = SlowAPI(error=RuntimeError("down"))
+    single_flight = SingleFlight()
+    acreate = init_async_single_flight_chat_completion(single_flight, api.acreate)
+
+    async def run():
+        return await asyncio.gather(
+            *[acreate(**make_request()) for _ in range(3)], return_exceptions=True
+        )
+
+    errors = asyncio.run(run())
+    assert all(isinstance(error, RuntimeError) for error in errors)
+    assert api.calls == 1
+    assert single_flight.info() == (1, 2, 0)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(acreate(**make_request()))
+    assert api.calls == 2
+
+
+def test_async_call_outlives_a_cancelled_caller():
+    api = SlowAPI()
+    single_flight = SingleFlight()
+
+    async def run():
+        release = asyncio.Event()
+
+        async def acreate(**request):
+            await release.wait()
+            return await api.acreate(**request)
+
+        create = init_async_single_flight_chat_completion(single_flight, acreate)
+        leader = asyncio.ensure_future(create(**make_request()))
+        await asyncio.sleep(0)
+        waiters = [asyncio.ensure_future(create(**make_request())) for _ in range(2)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        release.set()
+        responses = await asyncio.gather(*waiters)
+        assert leader.cancelled()
+        return responses
+
+    responses = asyncio.run(run())
+    assert [response["choices"][0]["message"]["content"] for response in responses] == [
+        "hi",
+        "hi",
+    ]
+    # One of the callers that received the response is billed for it
+    replayed = [response["usage"].get("replayed", False) for response in responses]
+    assert sorted(replayed) == [False, True]
+    assert api.calls == 1
+    assert single_flight.info() == (1, 2, 0)
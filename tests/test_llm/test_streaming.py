@@ -0,0 +1,108 @@
+import asyncio
+
+from sembla.llm.openai.streaming import (
+    StreamDecision,
+    init_async_streaming_chat_completion_generator,
+    init_streaming_chat_completion_generator,
+)
+from sembla.response.processor import process_json_response
+from sembla.response.stream import init_json_stream_validator
+from sembla.schemas.system import (
+    ActionCall,
+    MemoryState,
+    Message,
+    ProcessingStatus,
+    ResponseSchema,
+    SystemState,
+)
+
+RESPONSE_SCHEMA_CLASS = "sembla.schemas.system.ResponseSchema"
+
+
+class FakeStream:
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.sent = 0
+        self.closed = False
+
+    def __iter__(self):
+        for delta in self.deltas:
+            self.sent += 1
+            yield {"choices": [{"delta": {"content": delta}}]}
+
+    def close(self):
+        self.closed = True
+
+
+class StopAfter:
+    def __init__(self, text, decision):
+        self.text = text
+        self.decision = decision
+
+    def __call__(self, content, delta):
+        if self.text in content:
+            return self.decision
+        return StreamDecision.CONTINUE
+
+
+def make_state():
+    memory = MemoryState(conversation_history=[Message(role="user", content="hi")])
+    return SystemState(memory=memory)
+
+
+def test_subscriber_stops_the_stream(offline_tokenizer):
+    stream = FakeStream(["Hello", ", ", "world", "!", " More"])
+    requests = []
+
+    def create(**request):
+        requests.append(request)
+        return stream
+
+    generate = init_streaming_chat_completion_generator(
+        [lambda: StopAfter("world", StreamDecision.STOP)], create
+    )
+    state = generate(make_state())
+
+    assert requests[0]["stream"] is True
+    assert stream.sent == 3 and stream.closed
+    assert state.agent_response.raw_response == "Hello, world"
+    assert state.agent_response.processor_outputs == []
+    assert state.agent_response.usage.completion_tokens == len("Hello, world")
+
+
+def test_aborted_stream_is_recorded_as_an_error(offline_tokenizer):
+    async def acreate(**request):
+        async def stream():
+            for delta in ["not ", "json", " at all"]:
+                yield {"choices": [{"delta": {"content": delta}}]}
+
+        return stream()
+
+    generate = init_async_streaming_chat_completion_generator(
+        [lambda: StopAfter("json", StreamDecision.ABORT)], acreate
+    )
+    state = asyncio.run(generate(make_state()))
+
+    assert state.agent_response.raw_response == "not json"
+    [output] = state.agent_response.processor_outputs
+    assert output.processor_name == "StopAfter"
+    assert output.processing_status == ProcessingStatus.Error
+
+
+def test_parsed_response_of_validator_is_kept(offline_tokenizer):
+    response = ResponseSchema(
+        goal="idle", objectives=[], observations=[], action=ActionCall(name="wait")
+    )
+    content = response.json()
+    stream = FakeStream([content[:10], content[10:], " Done."])
+    generate = init_streaming_chat_completion_generator(
+        [init_json_stream_validator(ResponseSchema)], lambda **request: stream
+    )
+    state = generate(make_state().evolve(response_schema_class=RESPONSE_SCHEMA_CLASS))
+
+    parsed_response = state.agent_response.parsed_response
+    assert parsed_response == response
+    # The response is not parsed again downstream
+    assert (
+        process_json_response(state).agent_response.parsed_response is parsed_response
+    )
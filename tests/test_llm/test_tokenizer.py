@@ -0,0 +1,73 @@
+from sembla.conversation_history import (
+    count_message_tokens,
+    count_tokens_in_conversations,
+)
+from sembla.llm.tokenizer import Tokenizer
+from sembla.schemas.system import Message
+
+
+def test_count_tokens_is_memoized(byte_encoding):
+    tokenizer = Tokenizer()
+    tokenizer.register_encoding("test-model", byte_encoding)
+    assert tokenizer.count_tokens("hello", "test-model") == 5
+    assert tokenizer.count_tokens("hello", "test-model") == 5
+    assert tokenizer.count_tokens("world!", "test-model") == 6
+    info = tokenizer.cache_info()
+    assert (info.hits, info.misses, info.current_size) == (1, 2, 2)
+
+
+def test_count_tokens_evicts_least_recently_used(byte_encoding):
+    tokenizer = Tokenizer(max_cache_size=2)
+    tokenizer.register_encoding("test-model", byte_encoding)
+    for content in ["a", "b", "a", "c", "b"]:
+        tokenizer.count_tokens(content, "test-model")
+    info = tokenizer.cache_info()
+    assert (info.hits, info.misses, info.current_size) == (1, 4, 2)
+
+
+def test_count_message_tokens_resolves_model_alias(offline_tokenizer):
+    message = Message(role="user", content="hello", name="dom")
+    # gpt-4 counts as gpt-4-0314: 3 tokens per message and 1 per name
+    assert count_message_tokens(message, "gpt-4") == 3 + 5 + 1
+
+
+def test_count_tokens_batch_reuses_cache(byte_encoding):
+    tokenizer = Tokenizer()
+    tokenizer.register_encoding("test-model", byte_encoding)
+    tokenizer.count_tokens("cached", "test-model")
+    counts = tokenizer.count_tokens_batch(["cached", "ab", "ab", "xyz"], "test-model")
+    assert counts == [6, 2, 2, 3]
+    info = tokenizer.cache_info()
+    assert (info.hits, info.misses, info.current_size) == (2, 3, 3)
+
+
+def test_count_tokens_in_conversations(offline_tokenizer):
+    conversations = [
+        [Message(role="system", content="abc"), Message(role="user", content="de")],
+        [],
+        [Message(role="user", content="f", name="dom")],
+    ]
+    counts = count_tokens_in_conversations(conversations, "gpt-3.5-turbo")
+    # gpt-3.5-turbo counts as gpt-3.5-turbo-0301: 4 per message and -1 per name
+    assert counts[0] == ([7, 6], 7 + 6 + 3)
+    assert counts[1] == ([], 3)
+    assert counts[2] == ([4], 4 + 3)
+
+
+def test_unregistered_models_use_tiktoken_lookup(monkeypatch, byte_encoding):
+    resolved = []
+
+    def encoding_for_model(model_name):
+        resolved.append(model_name)
+        if model_name.startswith("gpt-4o"):
+            return byte_encoding
+        raise KeyError(model_name)
+
+    monkeypatch.setattr("tiktoken.encoding_for_model", encoding_for_model)
+    monkeypatch.setattr("tiktoken.get_encoding", lambda name: name)
+    tokenizer = Tokenizer()
+    # Registered models use their spec, others are looked up by tiktoken
+    assert tokenizer.get_encoding("gpt-4") == "cl100k_base"
+    assert tokenizer.get_encoding("gpt-4o-2024-05-13") is byte_encoding
+    assert tokenizer.get_encoding("my-model") == "cl100k_base"
+    assert resolved == ["gpt-4o-2024-05-13", "my-model"]
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+
+from sembla.llm.openai.chat_completion import acreate_chat_completion
+from sembla.llm.openai.transport import (
+    Transport,
+    init_async_transport_chat_completion,
+    init_transport_chat_completion,
+)
+
+COMPLETION = {
+    "id": "chatcmpl-1",
+    "object": "chat.completion",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "hi"}}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}
+
+
+class ChatCompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        ChatCompletionHandler.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.dumps(COMPLETION).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def local_api(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ChatCompletionHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    ChatCompletionHandler.connections = 0
+    monkeypatch.setattr(openai, "api_key", "test")
+    monkeypatch.setattr(openai, "api_base", f"http://127.0.0.1:{server.server_port}/v1")
+    monkeypatch.setattr(openai, "requestssession", None)
+    yield ChatCompletionHandler
+    server.shutdown()
+    server.server_close()
+
+
+REQUEST = {"model": "gpt-4", "messages": [{"role": "user", "content": "hi"}]}
+
+
+def test_sync_requests_share_connections(local_api):
+    transport = Transport(pool_maxsize=2)
+    create = init_transport_chat_completion(transport)
+    contents = []
+    lock = threading.Lock()
+
+    def make_requests():
+        for _ in range(5):
+            response = create(**REQUEST)
+            with lock:
+                contents.append(response["choices"][0]["message"]["content"])
+
+    # Exceptions raised in threads do not fail the test, so they are collected
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(make_requests) for _ in range(2)]
+        errors = [future.exception() for future in futures]
+    transport.close()
+
+    assert errors == [None, None]
+    assert contents == ["hi"] * 10
+    assert openai.requestssession is None
+    assert 1 <= local_api.connections <= 2
+
+
+def test_async_requests_share_connections(local_api):
+    transport = Transport(timeout=5)
+    acreate = init_async_transport_chat_completion(transport)
+
+    async def make_requests():
+        async with transport.aiosession():
+            for _ in range(5):
+                await acreate(**REQUEST)
+        assert openai.aiosession.get() is None
+
+    asyncio.run(make_requests())
+    assert local_api.connections == 1
+
+    # Without the transport, every async request opens a new connection
+    async def make_default_requests():
+        for _ in range(3):
+            await acreate_chat_completion(**REQUEST)
+
+    asyncio.run(make_default_requests())
+    assert local_api.connections == 1 + 3
@@ -0,0 +1,101 @@
+import pytest
+
+from sembla.conversation_history import (
+    get_history_token_budget,
+    get_prompt_token_count,
+    init_conversation_history_manager,
+)
+from sembla.memory.compaction import (
+    SummarizingCompactor,
+    Summary,
+    init_chat_completion_summarizer,
+)
+from sembla.schemas.system import (
+    MemoryState,
+    Message,
+    ModelState,
+    SystemState,
+    TaskState,
+)
+
+
+def stub_summarizer(previous_summary, messages):
+    contents = [message.content for message in messages]
+    if previous_summary:
+        contents.insert(0, previous_summary)
+    return Summary(",".join(contents))
+
+
+def make_state(compactor, buffer, task=None, **memory_limits):
+    memory_limits.setdefault("max_history_message_count", 1)
+    memory = MemoryState(conversation_buffer=buffer, **memory_limits)
+    manage_memory = init_conversation_history_manager(eviction_handlers=[compactor])
+    system_state = SystemState(
+        task=task or TaskState(), model=ModelState(name="gpt-4"), memory=memory
+    )
+    return manage_memory(system_state)
+
+
+def test_compaction_waits_for_a_full_batch(offline_tokenizer):
+    compactor = SummarizingCompactor(stub_summarizer, batch_size=3)
+    buffer = [Message(role="user", content=str(i)) for i in range(3)]
+    state = make_state(compactor, buffer)
+    assert state.memory.summary is None
+    assert [m.content for m in state.memory.compaction_buffer] == ["0", "1"]
+
+
+def test_compaction_folds_batches_into_rolling_summary(offline_tokenizer):
+    calls = []
+
+    def summarize(previous_summary, messages):
+        calls.append(len(messages))
+        return stub_summarizer(previous_summary, messages)
+
+    compactor = SummarizingCompactor(summarize, batch_size=2, max_summary_tokens=6)
+    buffer = [Message(role="user", content=str(i)) for i in range(5)]
+    state = make_state(compactor, buffer)
+    assert calls == [4]
+    assert state.memory.summary.content == "0,1,2,"
+    assert state.memory.summary.token_count == 3 + 6
+    assert state.memory.compaction_buffer == []
+
+
+def test_summary_usage_counts_against_the_task(offline_tokenizer):
+    requests = []
+
+    def create(**request):
+        requests.append(request)
+        return {
+            "choices": [{"message": {"role": "assistant", "content": " gist "}}],
+            "usage": {
+                "prompt_tokens": 90,
+                "completion_tokens": 10,
+                "total_tokens": 100,
+            },
+        }
+
+    summarize = init_chat_completion_summarizer(create, model_name="gpt-4")
+    compactor = SummarizingCompactor(summarize, batch_size=2)
+    buffer = [Message(role="user", content=str(i)) for i in range(3)]
+    state = make_state(compactor, buffer, task=TaskState(max_cost=1.0))
+
+    assert [request["model"] for request in requests] == ["gpt-4"]
+    assert state.memory.summary.content == "gist"
+    assert state.task.total_tokens == 100
+    assert state.task.total_cost == pytest.approx(0.0027 + 0.0006)
+
+
+def test_new_summary_fits_in_the_same_cycle(offline_tokenizer):
+    def long_summarizer(previous_summary, messages):
+        return Summary("x" * 40)
+
+    compactor = SummarizingCompactor(long_summarizer, batch_size=1)
+    buffer = [Message(role="user", content="y" * 20) for _ in range(4)]
+    state = make_state(
+        compactor, buffer, max_history_message_count=10, max_history_token_count=80
+    )
+
+    assert state.memory.summary is not None
+    assert get_prompt_token_count(state.memory, "gpt-4") <= get_history_token_budget(
+        state
+    )
@@ -0,0 +1,84 @@
+import pickle
+
+from sembla.memory.history import MessageHistory
+from sembla.schemas.system import MemoryState, Message, SystemState
+
+
+def test_evict_skips_pinned_messages():
+    history = MessageHistory(
+        [
+            {"role": "user", "content": "first"},
+            {"role": "system", "content": "instructions"},
+            {"role": "assistant", "content": "second"},
+        ]
+    )
+    assert history.evict() == {"role": "user", "content": "first"}
+    assert history.evict() == {"role": "assistant", "content": "second"}
+    assert history.evict() is None
+    assert history == [{"role": "system", "content": "instructions"}]
+
+
+def test_messages_keep_insertion_order():
+    messages = [
+        {"role": "system", "content": "a"},
+        {"role": "user", "content": "b"},
+        {"role": "system", "content": "c"},
+        {"role": "assistant", "content": "d"},
+    ]
+    history = MessageHistory(messages)
+    assert history.messages == messages
+    assert history.pinned == [messages[0], messages[2]]
+    assert history.evictable == [messages[1], messages[3]]
+    assert len(history) == 4
+
+
+def test_copy_is_independent():
+    history = MessageHistory([{"role": "user", "content": "a"}])
+    new_history = history.copy()
+    new_history.append({"role": "user", "content": "b"})
+    new_history.evict()
+    assert history == [{"role": "user", "content": "a"}]
+    assert new_history == [{"role": "user", "content": "b"}]
+
+
+def test_memory_state_accepts_message_lists():
+    memory = MemoryState(
+        conversation_history=[
+            {"role": "system", "content": "instructions"},
+            Message(role="user", content="hello"),
+        ]
+    )
+    assert isinstance(memory.conversation_history, MessageHistory)
+    assert all(isinstance(m, Message) for m in memory.conversation_history)
+    assert memory.conversation_history.evictable_count == 1
+    assert '"content": "hello"' in memory.json()
+
+
+def test_copies_share_messages_until_they_diverge():
+    history = MessageHistory([{"role": "user", "content": "a"}])
+    first = history.copy()
+    second = history.copy()
+    first.append({"role": "user", "content": "b"})
+    second.append({"role": "user", "content": "c"})
+    second.evict()
+    assert [m["content"] for m in history] == ["a"]
+    assert [m["content"] for m in first] == ["a", "b"]
+    assert [m["content"] for m in second] == ["c"]
+
+
+def test_history_survives_pickling():
+    history = MessageHistory(
+        [{"role": "system", "content": "a"}, {"role": "user", "content": "b"}]
+    )
+    restored = pickle.loads(pickle.dumps(history))
+    assert restored == history
+    assert restored.evictable_count == 1
+
+
+def test_evolve_shares_unchanged_sub_states():
+    state = SystemState(memory=MemoryState(conversation_history=[]))
+    new_state = state.evolve(system_prompt="be helpful")
+    assert new_state.system_prompt == "be helpful"
+    assert state.system_prompt is None
+    assert new_state.memory is state.memory
+    assert "system_prompt" in new_state.__fields_set__
@@ -0,0 +1,51 @@
+from sembla.conversation_history import get_prompt_messages
+from sembla.memory.recall import RecallIndex, init_recall_processor
+from sembla.schemas.system import MemoryState, Message, ModelState, SystemState
+
+
+def make_index(contents):
+    recall_index = RecallIndex()
+    recall_index.extend([Message(role="user", content=c) for c in contents])
+    return recall_index
+
+
+def test_search_ranks_matching_messages():
+    recall_index = make_index(
+        [
+            "the build failed on the linter",
+            "write the report to report.md",
+            "the linter config lives in setup.cfg",
+            "lunch is at noon",
+        ]
+    )
+    results = recall_index.search("linter config", k=2)
+    assert [message.content for _, message in results] == [
+        "the linter config lives in setup.cfg",
+        "the build failed on the linter",
+    ]
+    assert recall_index.search("nothing matches", k=2) == []
+
+
+def test_search_is_incremental():
+    recall_index = make_index(["alpha", "beta"])
+    assert recall_index.search("gamma") == []
+    recall_index.add(Message(role="assistant", content="gamma ray"))
+    assert [m.content for _, m in recall_index.search("gamma")] == ["gamma ray"]
+
+
+def test_recall_processor_injects_within_budget(offline_tokenizer):
+    recall_index = make_index(["deploy the app to staging", "deploy notes: use v2"])
+    memory = MemoryState(
+        conversation_history=[Message(role="user", content="how do we deploy?")]
+    )
+    state = SystemState(model=ModelState(name="gpt-4"), memory=memory)
+
+    state = init_recall_processor(recall_index, k=2)(state)
+    recall = state.memory.recall
+    assert "user: deploy the app to staging" in recall.content
+    assert "user: deploy notes: use v2" in recall.content
+    assert get_prompt_messages(state.memory) == [recall, memory.conversation_history[0]]
+
+    state = init_recall_processor(recall_index, k=2, max_recall_tokens=90)(state)
+    assert state.memory.recall.token_count <= 90
+    assert state.memory.recall.content.count("\n") == 1
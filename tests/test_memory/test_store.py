@@ -0,0 +1,101 @@
+import pytest
+
+from sembla.conversation_history import init_conversation_history_manager
+from sembla.memory.store import MessageLog, load_memory_state
+from sembla.schemas.system import MemoryState, Message, ModelState, SystemState
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    return tmp_path / "messages.log"
+
+
+def test_messages_survive_reopening(log_path):
+    messages = [
+        Message(role="system", content="instructions"),
+        Message(role="user", content="hello"),
+    ]
+    with MessageLog(log_path) as message_log:
+        offsets = message_log.extend(messages)
+
+    with MessageLog(log_path) as message_log:
+        assert message_log.offsets == offsets
+        assert message_log.pinned_offsets == offsets[:1]
+        assert [m for _, m in message_log.iter_from()] == messages
+        assert message_log.read(offsets[1]) == messages[1]
+
+
+def test_torn_record_is_discarded(log_path):
+    with MessageLog(log_path) as message_log:
+        message_log.append(Message(role="user", content="kept"))
+        size = message_log.size
+    with open(log_path, "ab") as f:
+        f.write(b"\xff\x00\x00\x00\x00{")
+
+    with MessageLog(log_path) as message_log:
+        assert len(message_log) == 1
+        assert message_log.size == size
+        offset = message_log.append(Message(role="user", content="next"))
+        assert message_log.read(offset).content == "next"
+
+
+def test_load_memory_state_restores_recent_messages(log_path):
+    messages = [Message(role="system", content="s", token_count=10)] + [
+        Message(role="user", content=str(i), token_count=5) for i in range(10)
+    ]
+    with MessageLog(log_path) as message_log:
+        message_log.extend(messages)
+        memory = MemoryState(max_history_message_count=4, max_history_token_count=100)
+        state = SystemState(model=ModelState(name="gpt-4"), memory=memory)
+        memory = load_memory_state(message_log, state)
+
+    assert memory.conversation_history == [messages[0]] + messages[-3:]
+    assert memory.token_count == 3 + 10 + 3 * 5
+    assert memory.log_offset == log_path.stat().st_size
+
+
+def test_conversation_history_manager_logs_new_messages(log_path, offline_tokenizer):
+    with MessageLog(log_path) as message_log:
+        manage_memory = init_conversation_history_manager([], message_log=message_log)
+        memory = MemoryState(
+            max_history_message_count=1,
+            conversation_buffer=[
+                Message(role="user", content=str(i)) for i in range(3)
+            ],
+        )
+        state = SystemState(model=ModelState(name="gpt-4"), memory=memory)
+        state = manage_memory(state)
+        assert len(state.memory.conversation_history) == 1
+        assert len(message_log) == 3
+        assert state.memory.log_offset == message_log.size
+
+
+def test_load_memory_state_matches_the_live_memory(log_path, offline_tokenizer):
+    summary = Message(role="system", content="gist", token_count=7)
+    recall = Message(role="system", content="recalled", token_count=11)
+
+    def summarize(system_state, evicted_messages):
+        memory = system_state.memory.evolve(summary=summary, recall=recall)
+        return system_state.evolve(memory=memory)
+
+    # The completion leaves 50 tokens of the context window for the prompt
+    model = ModelState(name="gpt-4", max_tokens=8192 - 50)
+    memory = MemoryState(
+        conversation_buffer=[Message(role="user", content=str(i)) for i in range(20)]
+    )
+    with MessageLog(log_path) as message_log:
+        manage_memory = init_conversation_history_manager(
+            [summarize], message_log=message_log
+        )
+        live = manage_memory(SystemState(model=model, memory=memory)).memory
+
+    with MessageLog(log_path) as message_log:
+        assert len(message_log) == 20
+        state = SystemState(model=model, memory=MemoryState())
+        restored = load_memory_state(message_log, state)
+
+    assert restored.summary == summary
+    assert restored.recall == recall
+    assert restored.conversation_history == live.conversation_history
+    assert restored.token_count == live.token_count
+    assert restored.log_offset == live.log_offset
@@ -0,0 +1,42 @@
+from sembla.llm.openai.streaming import StreamDecision
+from sembla.response.stream import init_json_stream_validator
+from sembla.schemas.system import ActionCall, ResponseSchema
+
+RESPONSE = ResponseSchema(
+    goal='Say "hi" {politely}',
+    objectives=["greet"],
+    observations=[],
+    action=ActionCall(name="say", parameters={"text": "hi]"}),
+)
+
+
+def feed(content, chunk_size=3):
+    validator = init_json_stream_validator(ResponseSchema)()
+    streamed = ""
+    for start in range(0, len(content), chunk_size):
+        delta = content[start : start + chunk_size]
+        streamed += delta
+        decision = validator(streamed, delta)
+        if decision != StreamDecision.CONTINUE:
+            return decision, streamed, validator
+    return StreamDecision.CONTINUE, streamed, validator
+
+
+def test_valid_response_stops_when_the_object_closes():
+    content = "  " + RESPONSE.json() + "\nThat is my answer."
+    decision, streamed, validator = feed(content)
+    assert decision == StreamDecision.STOP
+    assert len(streamed) < len(content)
+    assert validator.parsed_response == RESPONSE
+
+
+def test_malformed_responses_are_aborted_early():
+    decision, streamed, _ = feed("Sure! Here is the JSON: {}")
+    assert (decision, streamed) == (StreamDecision.ABORT, "Sur")
+
+    decision, streamed, _ = feed('{"goal": ["x"}, "objectives": []}', chunk_size=1)
+    assert (decision, streamed) == (StreamDecision.ABORT, '{"goal": ["x"}')
+
+    decision, _, validator = feed('{"goal": "missing fields"}')
+    assert decision == StreamDecision.ABORT
+    assert validator.parsed_response is None
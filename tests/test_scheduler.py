@@ -0,0 +1,112 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from sembla.scheduler import (
+    Component,
+    ParallelPipeline,
+    UndeclaredWriteError,
+    component,
+    init_parallel_agent_system,
+    plan_stages,
+)
+from sembla.schemas.system import SystemState, TaskState, TaskStatus
+
+
+def test_plan_stages_orders_dependent_components():
+    write_memory = Component(lambda s: s, reads=["memory"], writes=["memory"])
+    write_prompt = Component(lambda s: s, reads=["actions"], writes=["system_prompt"])
+    read_both = Component(lambda s: s, reads=["memory", "system_prompt"], writes=[])
+    overwrite_prompt = Component(lambda s: s, reads=[], writes=["system_prompt"])
+    undeclared = Component(lambda s: s)
+
+    stages = plan_stages(
+        [write_memory, write_prompt, read_both, overwrite_prompt, undeclared]
+    )
+
+    assert stages == [
+        [write_memory, write_prompt],
+        [read_both],
+        [overwrite_prompt],
+        [undeclared],
+    ]
+
+
+def test_component_rejects_unknown_fields():
+    with pytest.raises(ValueError):
+        Component(lambda s: s, reads=["memroy"])
+
+
+def test_parallel_pipeline_runs_independent_components_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+
+    @component(reads=[], writes=["system_prompt"])
+    def build_prompt(system_state):
+        barrier.wait()
+        return system_state.evolve(system_prompt="prompt")
+
+    @component(reads=["model"], writes=["model"])
+    def select_model(system_state):
+        barrier.wait()
+        return system_state.evolve(model=system_state.model.evolve(name="gpt-4"))
+
+    @component(reads=["system_prompt", "model"], writes=["task"])
+    def complete(system_state):
+        description = f"{system_state.system_prompt}: {system_state.model.name}"
+        task = system_state.task.evolve(
+            description=description, status=TaskStatus.COMPLETE
+        )
+        return system_state.evolve(task=task)
+
+    pipeline = ParallelPipeline([build_prompt, select_model, complete])
+    system_state = pipeline(SystemState())
+    pipeline.shutdown()
+
+    assert len(pipeline.stages) == 2
+    assert system_state.task.description == "prompt: gpt-4"
+    assert system_state.system_prompt == "prompt"
+
+
+def test_parallel_agent_system_runs_until_complete():
+    @component(reads=["task"], writes=["task"])
+    def finish_after_two_cycles(system_state):
+        if system_state.task.current_cycle == 1:
+            task = system_state.task.evolve(status=TaskStatus.COMPLETE)
+            return system_state.evolve(task=task)
+        return system_state
+
+    @component(reads=[], writes=["system_prompt"])
+    def build_prompt(system_state):
+        return system_state.evolve(system_prompt="prompt")
+
+    threads = set(threading.enumerate())
+    agent_system = init_parallel_agent_system([finish_after_two_cycles, build_prompt])
+    system_state = agent_system(SystemState(task=TaskState(name="test")))
+
+    assert system_state.task.current_cycle == 2
+    # The thread pool of the run is shut down when it ends
+    assert set(threading.enumerate()) <= threads
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        agent_system = init_parallel_agent_system(
+            [finish_after_two_cycles, build_prompt], executor=executor
+        )
+        system_state = agent_system(SystemState(task=TaskState(name="test")))
+        # An executor given by the caller is left running
+        assert executor.submit(len, "abc").result() == 3
+    assert system_state.system_prompt == "prompt"
+
+
+def test_parallel_pipeline_rejects_undeclared_writes():
+    @component(reads=[], writes=["system_prompt"])
+    def build_prompt(system_state):
+        return system_state.evolve(system_prompt="prompt")
+
+    @component(reads=["model"], writes=[])
+    def select_model(system_state):
+        return system_state.evolve(model=system_state.model.evolve(name="gpt-4"))
+
+    with ParallelPipeline([build_prompt, select_model]) as pipeline:
+        with pytest.raises(UndeclaredWriteError, match=r"select_model.*\['model'\]"):
+            pipeline(SystemState())
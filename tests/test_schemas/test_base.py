@@ -0,0 +1,39 @@
+import pytest
+from pydantic import ValidationError
+
+from sembla.schemas import base
+from sembla.schemas.base import set_trusted_validation
+from sembla.schemas.system import AgentResponse, MemoryState, TaskState
+
+
+@pytest.fixture
+def set_validation():
+    validate_trusted = base._validate_trusted
+    yield set_trusted_validation
+    set_trusted_validation(validate_trusted)
+
+
+def test_trusted_fills_defaults_without_validating(set_validation):
+    set_validation(False)
+    first = AgentResponse.trusted(raw_response="hello")
+    second = AgentResponse.trusted(raw_response="hello")
+    assert first == AgentResponse(raw_response="hello")
+    assert first.__fields_set__ == {"raw_response"}
+    assert first.processor_outputs is not second.processor_outputs
+
+    unchecked = TaskState.trusted(current_cycle="not a number")
+    assert unchecked.current_cycle == "not a number"
+
+
+def test_memory_history_default_is_not_shared():
+    first, second = MemoryState.trusted(), MemoryState.trusted()
+    assert first.conversation_history is not second.conversation_history
+
+
+def test_validation_switch(set_validation):
+    set_validation(True)
+    with pytest.raises(ValidationError):
+        TaskState.trusted(current_cycle="not a number")
+    with pytest.raises(ValidationError):
+        TaskState().evolve(current_cycle="not a number")
+    assert TaskState().evolve(current_cycle=2).current_cycle == 2
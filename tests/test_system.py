@@ -0,0 +1,56 @@
+import asyncio
+import threading
+
+import pytest
+
+from sembla.schemas.system import SystemState, TaskState
+from sembla.system import AgentSystem, as_async_operator, is_async_operator
+
+
+def set_prompt(system_state):
+    return system_state.evolve(system_prompt=threading.current_thread().name)
+
+
+async def respond(system_state):
+    await asyncio.sleep(0)
+    return system_state.evolve(system_prompt=system_state.system_prompt + "!")
+
+
+class AsyncOperator:
+    async def __call__(self, system_state):
+        return system_state
+
+
+def test_is_async_operator():
+    assert is_async_operator(respond)
+    assert is_async_operator(AsyncOperator())
+    assert not is_async_operator(set_prompt)
+    assert as_async_operator(respond) is respond
+
+
+def test_aloop_runs_sync_operators_off_the_event_loop():
+    system = AgentSystem(components=[set_prompt, respond])
+    state = SystemState(task=TaskState(max_cycles=3))
+    state = asyncio.run(system.aloop(state))
+    assert state.task.current_cycle == 3
+    assert state.system_prompt.endswith("!")
+    assert state.system_prompt != threading.current_thread().name + "!"
+
+
+def test_many_systems_share_one_event_loop():
+    system = AgentSystem(components=[set_prompt, respond])
+
+    async def run_all():
+        states = [SystemState(task=TaskState(max_cycles=2)) for _ in range(50)]
+        return await asyncio.gather(*(system.aloop(state) for state in states))
+
+    states = asyncio.run(run_all())
+    assert [state.task.current_cycle for state in states] == [2] * 50
+
+
+def test_run_rejects_async_components():
+    system = AgentSystem(components=[set_prompt, AsyncOperator()])
+    with pytest.raises(TypeError, match="AsyncOperator"):
+        system.run(SystemState())
+    with pytest.raises(TypeError, match="respond"):
+        AgentSystem(components=[respond]).loop(SystemState())